@@ -5,7 +5,7 @@ import warnings
 
 from dateutil.relativedelta import relativedelta
 
-from aclimate_resampling import AClimateResampling
+from resampling import AClimateResampling
 from complete_data import CompleteData
 
 
@@ -16,7 +16,8 @@ if __name__ == "__main__":
     # 2: Previous months
     # 3: Cores
     # 4: Year of forecast
-    parameters = sys.argv[2:]
+    # 5: Backend to process the stations: serial, thread, process or dask (optional)
+    parameters = sys.argv[1:]
     print("Reading inputs")
     #country = "ETHIOPIA"
     country = parameters[0]
@@ -27,7 +28,9 @@ if __name__ == "__main__":
     start_date = (datetime.date.today() - pd.DateOffset(months=months_previous)).replace(day=1)
     cores = int(parameters[3])
     
-    ar = AClimateResampling(path, country, cores=cores, year_forecast = int(parameters[4]))
+    backend = parameters[5] if len(parameters) > 5 else "dask"
+    
+    ar = AClimateResampling(path, country, year_forecast = int(parameters[4]), cores = cores, backend = backend)
     ar.resampling()
     dd = CompleteData(start_date,country,path,cores=cores)
     dd.run()
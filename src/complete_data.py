@@ -6,27 +6,98 @@ import sys
 import os
 import glob
 import datetime
-import urllib.request
+import urllib.parse
 from datetime import timedelta
 from zipfile import ZipFile
 import gzip
-from concurrent.futures import ThreadPoolExecutor
+import shutil
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import pandas as pd
 from tqdm import tqdm
 import numpy as np
 import rasterio
+from rasterio.windows import from_bounds,Window
 import xarray
-import multiprocessing as mp
+import netCDF4
 
 import cdsapi # https://cds.climate.copernicus.eu/cdsapp#!/dataset/sis-agrometeorological-indicators?tab=form
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 from tools import DownloadProgressBar,DirectoryManager
+from station_cache import StationCache
+from scenario_bundle import ScenarioBundle
+from pixel_index import PixelIndex
+from raster_cube import RasterCube,raster_path
+from downloader import Downloader
+from pipeline import Pipeline
+from download_cache import DownloadCache
+
+# =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+# Function to open a NetCDF file or a NetCDF member of a zip without extracting it
+# =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+# path: Path of the NetCDF file or of the zip
+# member: Name of the NetCDF file in the zip. If it is None path is opened as a NetCDF file
+# OUTPUT: xarray Dataset
+def open_nc(path,member = None):
+    if member is None:
+        return xarray.open_dataset(path)
+    with ZipFile(path, 'r') as zObject:
+        content = zObject.read(member)
+    # The member is decoded from memory, nothing is written in disk
+    return xarray.open_dataset(xarray.backends.NetCDF4DataStore(netCDF4.Dataset(member,memory=content)))
+
+# =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+# Function to convert a NetCDF file of ERA 5 to raster, it runs in the workers of a process pool
+# =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+# input_file: Path of the NetCDF file, or of the zip if member is set
+# output_file: Path of the raster
+# transform: Operation to change the units ("-" or "/")
+# value: Value of the operation
+# crs: Coordinate reference system of the raster
+# force: If you want to convert the file although the raster is up to date
+# member: Name of the NetCDF file in the zip
+# OUTPUT: True if the file was converted, False if the raster was already up to date
+def nc_to_tif(input_file,output_file,transform,value,crs,force = False,member = None):
+    if not force and os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(input_file):
+        return False
+    with open_nc(input_file,member) as xds:
+        if transform == "-":
+            xds = xds - value
+        elif transform == "/":
+            xds = xds / value
+        xds.rio.write_crs(crs, inplace=True)
+        variable_names = list(xds.variables)
+        # Write in a temporal file and rename it, so an interrupted conversion is done again
+        tmp = output_file + ".tmp" + str(os.getpid()) + ".tif"
+        xds[variable_names[3]].rio.to_raster(tmp)
+    os.replace(tmp,output_file)
+    return True
 
 class CompleteData():
 
+    # Url of the daily files of CHIRP
+    chirp_url = "http://data.chc.ucsb.edu/products/CHIRP/daily"
+
+    # Define the variables classes and their parameters for the CDSAPI
+    enum_variables ={
+                        "t_max":{"name":"2m_temperature",
+                                "statistics":['24_hour_maximum'],
+                                "transform":"-",
+                                "value":273.15},
+                        "t_min":{"name":"2m_temperature",
+                                "statistics":['24_hour_minimum'],
+                                "transform":"-",
+                                "value":273.15},
+                        "sol_rad":{"name":"solar_radiation_flux",
+                                "statistics":[],
+                                "transform":"/",
+                                "value":1000000}
+                    }
+
     # start_date: start date to download.
     def __init__(self,start_date,country,path,cores = 1,force = False):
         self.start_date = start_date
@@ -41,8 +112,24 @@ class CompleteData():
         self.path_country_inputs_forecast = ""
         self.path_country_inputs_forecast_dailydata = ""
         self.path_country_inputs_forecast_dailydownloaded = ""
+        self.path_country_inputs_forecast_dailydata_cache = ""
         self.path_country_outputs = ""
         self.path_country_outputs_resampling = ""
+        self.cache = None
+        self.pixel_index = PixelIndex()
+        self.raster_cube = None
+        # Margin in degrees around the stations of the cropped rasters and of the monthly cubes
+        self.cube_buffer = 1.0
+        # The downloads share a pool of connections with as many simultaneous downloads as cores
+        self.downloader = Downloader(workers=cores)
+        # Function which creates the client of the CDS, the requests of the variables are sent at the same time
+        self.cds_client = cdsapi.Client
+        # Maximum number of requests waiting at the same time in the queue of the CDS
+        self.cds_limit = 3
+        # Status of the request of every ERA 5 variable: queued, requested, downloaded, taken from the cache, already downloaded or failed
+        self.era5_status = {}
+        # Cache of the global files shared by the runs of all countries in the path, it is set by prepare_env
+        self.download_cache = None
 
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
     # Function to prepare and validate the enviroment
@@ -55,6 +142,7 @@ class CompleteData():
         self.path_country_inputs_forecast = os.path.join(self.path_country_inputs,"prediccionClimatica")
         self.path_country_inputs_forecast_dailydata = os.path.join(self.path_country_inputs_forecast,"dailyData")
         self.path_country_inputs_forecast_dailydownloaded = os.path.join(self.path_country_inputs_forecast,"daily_downloaded")
+        self.path_country_inputs_forecast_dailydata_cache = os.path.join(self.path_country_inputs_forecast,"dailyData_cache")
 
         self.path_country_outputs = os.path.join(self.path_country,"outputs")
         self.path_country_outputs_resampling = os.path.join(self.path_country_outputs,"resampling")
@@ -74,6 +162,11 @@ class CompleteData():
             raise ValueError("ERROR Directories don't exist (" + str(missing_count) + "): " + missing_files)
 
         self.manager.mkdir(self.path_country_inputs_forecast_dailydownloaded)
+        self.cache = StationCache(self.path_country_inputs_forecast_dailydata_cache)
+        self.cache.evict()
+        self.pixel_index = PixelIndex(os.path.join(self.path_country_inputs_forecast_dailydownloaded,"pixel_index"))
+        self.raster_cube = RasterCube(os.path.join(self.path_country_inputs_forecast_dailydownloaded,"cube"),workers=self.cores)
+        self.download_cache = DownloadCache(os.path.join(self.path,"download_cache"))
         print("Init:",self.start_date,"End:",self.end_date,"Year:",self.start_date.year,"Month:",self.start_date.month)
 
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -103,26 +196,46 @@ class CompleteData():
     # path: path to save file.
     # force: If you want to force to execute the process
     # remove: Set if you want to remove the gz file
-    def download_file(self, url, path, force = False, remove = True):
-        if force or os.path.exists(path.replace('.gz','')) == False:
-            if os.path.exists(path.replace('.gz','')):
-                os.remove(path.replace('.gz',''))
+    # size: Expected size of the file in bytes. If it is None, it is taken from the server
+    # checksum: Expected hash of the file as "algorithm:hexdigest". If it is None, it is not validated.
+    # The invalid downloads are tried again and fail with ValueError, so a corrupt file is never saved nor cached
+    def download_file(self, url, path, force = False, remove = True, size = None, checksum = None):
+        path_raster = path.replace('.gz','')
+        downloaded = os.path.exists(path_raster) or (not remove and os.path.exists(path))
+        if force or downloaded == False:
+            if os.path.exists(path_raster):
+                os.remove(path_raster)
+            # The partial file of an interrupted download is resumed, it is renamed when it is complete
             with DownloadProgressBar(unit='B', unit_scale=True,miniters=1, desc=url.split('/')[-1]) as t:
-                urllib.request.urlretrieve(url, filename=path, reporthook=t.update_to)
-            with gzip.open(path, 'rb') as f_in:
-                with open(path.replace('.gz',''), 'wb') as f_out:
-                # Read the compressed content and write it to the output file
-                    f_out.write(f_in.read())
-            os.remove(path)
+                if self.download_cache is None:
+                    self.downloader.fetch(url, path, size, checksum, progress=t.update)
+                else:
+                    # The files are global, so they are downloaded once for all countries
+                    self.download_cache.fetch(self.cache_key(url), path, lambda tmp: self.downloader.fetch(url, tmp, size, checksum, progress=t.update), force)
+            if remove:
+                with gzip.open(path, 'rb') as f_in:
+                    with open(path_raster, 'wb') as f_out:
+                        # Decompress by chunks, so the file is never fully in memory
+                        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+                os.remove(path)
         else:
             print("\tFile already downloaded!",path)
 
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
-    # Function to download chirp data
+    # Function to get the key of an url in the download cache
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
-    # test: Set if it is a test or not. If it is test, it just will download three or two files. By default it is False
-    # OUTPUT: save rasters layers.
-    def download_data_chirp(self, test = False):
+    # url: url of the file
+    # OUTPUT: List with the server and the folders of the url, they have the product, the version and the date of the file
+    def cache_key(self, url):
+        parsed = urllib.parse.urlparse(url)
+        return [parsed.netloc.replace(':','_')] + [p for p in parsed.path.split('/') if p != '']
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to list the chirp files of the month
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # test: Set if it is a test or not. If it is test, it just will list two files. By default it is False
+    # OUTPUT: List with the urls and list with the paths where the files are saved
+    def chirp_files(self, test = False):
         save_path = self.path_country_inputs_forecast_dailydownloaded
         print(save_path)
         # Create folder for data
@@ -136,38 +249,83 @@ class CompleteData():
             dates = [self.start_date + timedelta(days=x) for x in range((self.end_date - self.start_date).days + 1)]
 
         # Creating a list of all files that should be downloaded
-        urls = [f"http://data.chc.ucsb.edu/products/CHIRP/daily/{self.start_date.year}/chirp.{date.strftime('%Y.%m.%d')}.tif.gz" for date in dates]
+        urls = [f"{self.chirp_url}/{self.start_date.year}/chirp.{date.strftime('%Y.%m.%d')}.tif.gz" for date in dates]
         files = [os.path.basename(url) for url in urls]
         save_path_chirp_all = [os.path.join(save_path_chirp, file) for file in files]
-        force_all = [self.force] * len(files)
+        return urls,save_path_chirp_all
 
-        # Download in parallel
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to download chirp data
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # test: Set if it is a test or not. If it is test, it just will download three or two files. By default it is False
+    # compressed: Set if the files are kept compressed (.tif.gz), they are read in place by the extraction
+    # OUTPUT: save rasters layers. It returns the number of files which could not be downloaded
+    def download_data_chirp(self, test = False, compressed = False):
+        urls,save_path_chirp_all = self.chirp_files(test)
+        force_all = [self.force] * len(urls)
+        remove_all = [not compressed] * len(urls)
+
+        # Download in parallel, the failed files are reported and downloaded again in the next run
         with ThreadPoolExecutor(max_workers=self.cores) as executor:
-            executor.map(self.download_file, urls, save_path_chirp_all,force_all)
+            futures = [executor.submit(self.download_file, *args) for args in zip(urls, save_path_chirp_all,force_all,remove_all)]
+        errors = [(url, f.exception()) for url, f in zip(urls, futures) if f.exception() is not None]
+        for url, error in errors:
+            print("\tERROR downloading",url,error)
+        return len(errors)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to download chirp data and extract it, every file is extracted as soon as it is downloaded
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # locations: Dataframe with coordinates for each location that we want to extract.
+    # test: Set if it is a test or not. If it is test, it just will download two files. By default it is False
+    # compressed: Set if the files are kept compressed (.tif.gz), they are read in place by the extraction
+    # bounds: Extent to which every file is cropped before its extraction (left, bottom, right, top). If it is None the global files are kept
+    # OUTPUT: Dataframe with the precipitation of the locations, the same of extract_chirp_data. It raises RuntimeError
+    # if some days could not be downloaded or extracted, after processing the others, so no day is left without data
+    def download_extract_chirp(self, locations, test = False, compressed = False, bounds = None):
+        urls,save_path_chirp_all = self.chirp_files(test)
+
+        def download(item):
+            url,path = item
+            self.download_file(url, path, self.force, not compressed)
+            file_path = path.replace('.gz','') if os.path.exists(path.replace('.gz','')) else path
+            if bounds is None:
+                return file_path
+            try:
+                return self.crop_raster(file_path,bounds)
+            except ValueError:
+                # The raster was cropped before to other stations, the global file is taken again from the cache or the server
+                os.remove(file_path)
+                self.download_file(url, path, False, not compressed)
+                return self.crop_raster(path.replace('.gz','') if os.path.exists(path.replace('.gz','')) else path,bounds)
+
+        def extract(item,path):
+            return self.extract_file(path,locations)
+
+        # The downloads wait for the network and the extraction for the disk and the decoding, so they run at the same time
+        pipeline = Pipeline(producers=self.cores,consumers=self.cores,size=2 * self.cores)
+        results = pipeline.run(list(zip(urls,save_path_chirp_all)),download,extract)
+
+        errors = [(url,result) for url,result in zip(urls,results) if isinstance(result,Exception)]
+        for url,error in errors:
+            print("\tERROR downloading or extracting",url,error)
+        if len(errors) > 0:
+            raise RuntimeError(str(len(errors)) + " days of CHIRP could not be downloaded or extracted: " + ",".join(os.path.basename(url) for url,error in errors))
+
+        dates = [datetime.datetime.strptime(os.path.basename(url).replace('.gz','')[-14:-4], '%Y.%m.%d') for url in urls]
+        return self.values_table(locations,'prec',dates,results)
 
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
     # Function to download ERA 5 data
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
     # variables: List of variables to download. by default all are selected
     # test: Set if it is a test or not. If it is test, it just will download two files. By default it is False
-    # OUTPUT: save rasters layers.
-    def download_era5_data(self,variables=["t_max","t_min","sol_rad"], test = False):
+    # convert: Set if the NetCDF files are converted to rasters. The extraction can read the NetCDF files directly
+    # unzip: Set if the zip is extracted in a temporal folder. Otherwise the NetCDF files are read from the zip
+    # OUTPUT: save rasters layers. It raises RuntimeError if some variables could not be downloaded, after processing the others
+    def download_era5_data(self,variables=["t_max","t_min","sol_rad"], test = False, convert = True, unzip = True):
         new_crs = '+proj=longlat +datum=WGS84 +no_defs'
-        # Define the variables classes and their parameters for the CDSAPI
-        enum_variables ={
-                            "t_max":{"name":"2m_temperature",
-                                    "statistics":['24_hour_maximum'],
-                                    "transform":"-",
-                                    "value":273.15},
-                            "t_min":{"name":"2m_temperature",
-                                    "statistics":['24_hour_minimum'],
-                                    "transform":"-",
-                                    "value":273.15},
-                            "sol_rad":{"name":"solar_radiation_flux",
-                                    "statistics":[],
-                                    "transform":"/",
-                                    "value":1000000}
-                        }
+        enum_variables = self.enum_variables
 
         # Create folder for data
         save_path = self.path_country_inputs_forecast_dailydownloaded
@@ -183,33 +341,28 @@ class CompleteData():
             days = [(self.start_date + timedelta(days=x)).strftime("%d") for x in range((self.end_date - self.start_date).days + 1)]
         
 
-        # Process for each variable that should be downloaded
+        # The requests of all variables wait at the same time in the queue of the CDS
+        self.era5_status = {v: "queued" for v in variables}
+        with ThreadPoolExecutor(max_workers=max(1,min(self.cds_limit,len(variables)))) as executor:
+            list(executor.map(lambda v: self.retrieve_era5(v,year,month,days),variables))
+        failed = [v for v in variables if self.era5_status[v].startswith("failed")]
+
+        # Process for each variable that was downloaded
         for v in variables:
-            print("\tProcesing",v)
+            print("\tProcesing",v,self.era5_status[v])
+            if v in failed:
+                continue
             # Creating folder for each variable
             save_path_era5 = os.path.join(save_path,"era5",v + ".zip")
             save_path_era5_data = os.path.join(save_path,"era5",v)
             save_path_era5_data_tmp = os.path.join(save_path,"era5",v + "_tmp")
             self.manager.mkdir(save_path_era5_data)
-            self.manager.mkdir(save_path_era5_data_tmp)
-
-            if self.force or os.path.exists(save_path_era5) == False:
-                c = cdsapi.Client()
-                c.retrieve('sis-agrometeorological-indicators',
-                    {
-                        'format': 'zip',
-                        'variable': enum_variables[v]["name"],
-                        'statistic': enum_variables[v]["statistics"],
-                        'year': year,
-                        'month': month,
-                        'day': days,
-                    },
-                    save_path_era5
-                )
-            else:
-                print("\tFile already downloaded!",save_path_era5)
+            if unzip:
+                self.manager.mkdir(save_path_era5_data_tmp)
 
-            if self.force or len(os.listdir(save_path_era5_data_tmp)) == 0:
+            if not unzip:
+                print("\tNetCDF files will be read from the zip",save_path_era5)
+            elif self.force or len(os.listdir(save_path_era5_data_tmp)) == 0:
                 print("\tExtracting temporally",save_path_era5)
                 # loading the zip and creating a zip object
                 with ZipFile(save_path_era5, 'r') as zObject:
@@ -220,24 +373,147 @@ class CompleteData():
             else:
                 print("\tFiles already extracted!",save_path_era5_data_tmp)
 
-            if self.force or len(os.listdir(save_path_era5_data)) == 0:
-                tmp_files = glob.glob(os.path.join(save_path_era5_data_tmp, '*'))
-                print("\tSetting CRS",save_path_era5_data_tmp,len(tmp_files))
-                for file in tqdm(tmp_files,desc="nc to raster and setting new CRS " + v):
-                    input_file = file
-                    output_file = os.path.join(save_path_era5_data,file.split(os.path.sep)[-1].replace(".nc",".tif"))
-
-                    xds = xarray.open_dataset(input_file)
-                    if enum_variables[v]["transform"] == "-":
-                        xds = xds - enum_variables[v]["value"]
-                    elif enum_variables[v]["transform"] == "/":
-                        xds = xds / enum_variables[v]["value"]
-                    xds.rio.write_crs(new_crs, inplace=True)
-                    variable_names = list(xds.variables)
-                    xds[variable_names[3]].rio.to_raster(output_file)
-                print("\tSetted!")
+            if not convert:
+                print("\tNetCDF files will be extracted directly",save_path_era5_data_tmp)
             else:
-                print("\tFiles already transformed!",save_path_era5_data)
+                if unzip:
+                    tmp_files = glob.glob(os.path.join(save_path_era5_data_tmp, '*.nc'))
+                    members = [None] * len(tmp_files)
+                else:
+                    members = self.zip_members(save_path_era5)
+                    tmp_files = [save_path_era5] * len(members)
+                names = [os.path.basename(file) if member is None else member for file,member in zip(tmp_files,members)]
+                output_files = [os.path.join(save_path_era5_data,os.path.basename(name).replace(".nc",".tif")) for name in names]
+                print("\tSetting CRS",save_path_era5_data_tmp if unzip else save_path_era5,len(tmp_files))
+                args = [tmp_files,output_files,[enum_variables[v]["transform"]] * len(tmp_files),[enum_variables[v]["value"]] * len(tmp_files),
+                        [new_crs] * len(tmp_files),[self.force] * len(tmp_files),members]
+                # Every file is converted by one worker, the rasters up to date are skipped
+                if self.cores > 1 and len(tmp_files) > 1:
+                    with ProcessPoolExecutor(max_workers=self.cores) as executor:
+                        converted = list(tqdm(executor.map(nc_to_tif,*args),total=len(tmp_files),desc="nc to raster and setting new CRS " + v))
+                else:
+                    converted = [nc_to_tif(*a) for a in tqdm(list(zip(*args)),desc="nc to raster and setting new CRS " + v)]
+                print("\tSetted!",sum(converted),"converted,",len(converted) - sum(converted),"already transformed")
+
+        if len(failed) > 0:
+            raise RuntimeError("ERA 5 variables could not be downloaded: " + ", ".join(v + " (" + self.era5_status[v] + ")" for v in failed))
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to request an ERA 5 variable to the CDS
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # v: Name of the variable
+    # year: Year to download
+    # month: Month to download
+    # days: List of days to download
+    # OUTPUT: save the zip of the variable. The result is saved in era5_status
+    def retrieve_era5(self,v,year,month,days):
+        save_path_era5 = os.path.join(self.path_country_inputs_forecast_dailydownloaded,"era5",v + ".zip")
+        if not self.force and os.path.exists(save_path_era5):
+            print("\tFile already downloaded!",save_path_era5)
+            self.era5_status[v] = "already downloaded"
+            return
+        try:
+            self.era5_status[v] = "requested"
+            def retrieve(path):
+                c = self.cds_client()
+                c.retrieve('sis-agrometeorological-indicators',
+                    {
+                        'format': 'zip',
+                        'variable': self.enum_variables[v]["name"],
+                        'statistic': self.enum_variables[v]["statistics"],
+                        'year': year,
+                        'month': month,
+                        'day': days,
+                    },
+                    path
+                )
+            if self.download_cache is None:
+                # The file is renamed at the end, so an interrupted download is not taken as downloaded
+                retrieve(save_path_era5 + ".part")
+                os.replace(save_path_era5 + ".part",save_path_era5)
+                self.era5_status[v] = "downloaded"
+            else:
+                # The requests are global, so they are downloaded once for all countries
+                key = ["cds","sis-agrometeorological-indicators",year,month,v + "_" + days[0] + "-" + days[-1] + ".zip"]
+                downloaded = self.download_cache.fetch(key,save_path_era5,retrieve,self.force)
+                self.era5_status[v] = "downloaded" if downloaded else "taken from the cache"
+        except Exception as e:
+            print("\tERROR downloading",v,e)
+            self.era5_status[v] = "failed: " + str(e)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get the extent of the stations
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # locations: Dataframe with the coordinates of the stations
+    # buffer: Margin added to the bounding box. By default cube_buffer
+    # OUTPUT: List with the bounding box of the stations with the margin (left, bottom, right, top). The stations without
+    # coordinates are skipped
+    def stations_bounds(self,locations,buffer=None):
+        buffer = self.cube_buffer if buffer is None else buffer
+        lons = pd.to_numeric(locations['lon'],errors='coerce').dropna()
+        lats = pd.to_numeric(locations['lat'],errors='coerce').dropna()
+        return [lons.min() - buffer,lats.min() - buffer,lons.max() + buffer,lats.max() + buffer]
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to crop a downloaded raster to an extent
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # file_path: path of the raster (.tif or .tif.gz)
+    # bounds: Extent to keep (left, bottom, right, top)
+    # OUTPUT: Path of the cropped raster (.tif). The compressed file is replaced by it, the cropped raster is compressed
+    # with deflate by blocks, so it is smaller than the global file and its blocks are read in place, while a .tif.gz
+    # would be decompressed from the start to read every block.
+    # It raises ValueError if the raster was cropped before to an extent which does not cover the new one
+    def crop_raster(self,file_path,bounds):
+        output_file = file_path.replace('.gz','')
+        with rasterio.open(raster_path(file_path)) as src:
+            # The rasters already cropped are skipped
+            tags = src.tags()
+            if "crop_bounds" in tags:
+                left,bottom,right,top = json.loads(tags["crop_bounds"])
+                if left <= bounds[0] and bottom <= bounds[1] and right >= bounds[2] and top >= bounds[3]:
+                    return file_path
+                raise ValueError("Raster cropped to a smaller extent than the stations, download it again with force " + file_path)
+            window = from_bounds(*bounds,transform=src.transform).round_offsets(op="floor").round_lengths(op="ceil")
+            window = window.intersection(Window(0,0,src.width,src.height))
+            profile = src.profile.copy()
+            profile.update(driver="GTiff",height=int(window.height),width=int(window.width),transform=src.window_transform(window),
+                           tiled=True,blockxsize=256,blockysize=256,compress="deflate")
+            data = src.read(window=window)
+
+        # Write in a temporal file and rename it, so an interrupted crop keeps the original file
+        tmp = output_file + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident()) + ".tif"
+        with rasterio.open(tmp,"w",**profile) as dst:
+            dst.write(data)
+            dst.update_tags(crop_bounds=json.dumps([float(b) for b in bounds]))
+        os.replace(tmp,output_file)
+        if file_path != output_file:
+            os.remove(file_path)
+        return output_file
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to crop the downloaded rasters to an extent
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # dir_path: path of the rasters (.tif or .tif.gz)
+    # bounds: Extent to keep (left, bottom, right, top)
+    # OUTPUT: Paths of the cropped rasters. It raises ValueError if some rasters were cropped before to a smaller extent,
+    # the stations out of it would not have data. They should be downloaded again with force
+    def crop_rasters(self,dir_path,bounds):
+        files = [f for f in sorted(os.listdir(dir_path)) if f.endswith('.tif') or f.endswith('.tif.gz')]
+        # The compressed files already decompressed are not cropped twice
+        files = [f for f in files if not (f.endswith('.gz') and f[:-3] in files)]
+
+        def crop(file):
+            try:
+                return self.crop_raster(os.path.join(dir_path,file),bounds)
+            except ValueError as error:
+                return error
+
+        with ThreadPoolExecutor(max_workers=max(1,self.cores)) as executor:
+            cropped = list(tqdm(executor.map(crop,files),total=len(files),desc="Cropping " + dir_path))
+        missing = [c for c in cropped if isinstance(c,ValueError)]
+        if len(missing) > 0:
+            raise ValueError(str(len(missing)) + " rasters were cropped to a smaller extent, download them again with force " + dir_path)
+        return cropped
 
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
     # Function to extract data from rasters
@@ -248,28 +524,63 @@ class CompleteData():
     # date_start: Position into the filename where the date starts
     # date_end: Position into the filename where the date ends
     # date_format: Format in which we can find the date in the filename
-    # OUTPUT: list with values extracted by variable, date, and station.
+    # OUTPUT: Dataframe with values extracted by variable, date, and station (ws, day, month, year, var).
     def extract_values(self,dir_path,var,locations, date_start,date_end,date_format):
-        files = [f for f in sorted(os.listdir(dir_path)) if f.endswith('.tif')]
-        data = []
-
-        # Loop for each daily file
-        for file in tqdm(files,desc="Extracting " + var):
-            file_path = os.path.join(dir_path, file)
-            with rasterio.open(file_path) as src:
-                # Loop for each location
-                for index,location in locations.iterrows():
-                    #col, row = ~transform * (location['lon'], location['lat'])
-                    row, col = src.index(location['lon'], location['lat'])
-                    value = src.read(1)[row, col]
-                    date_str = file[date_start:date_end]
-                    date = datetime.datetime.strptime(date_str, date_format)
-                    data.append({'ws':location['ws'],
-                                'day':date.day,
-                                'month':date.month,
-                                'year': date.year,
-                                var: value})
-        #print(data)
+        # Rasters compressed with gzip are read in place, if the file was also decompressed the raster is used
+        files = [f for f in sorted(os.listdir(dir_path)) if f.endswith('.tif') or f.endswith('.tif.gz')]
+        files = [f for f in files if not (f.endswith('.gz') and f[:-3] in files)]
+        dates = [datetime.datetime.strptime(file.replace('.gz','')[date_start:date_end], date_format) for file in files]
+
+        # Extent of the locations, the buffer is added by the cube just when it is built
+        bounds = self.stations_bounds(locations,0) if locations.shape[0] > 0 else [np.nan] * 4
+        if self.raster_cube is not None and len(files) > 0 and np.isfinite(bounds).all():
+            # All days of the month are stacked in one cube cropped around the locations
+            print("Extracting " + var + " from the monthly cube")
+            cube, transform, crs = self.raster_cube.read(dir_path, [os.path.join(dir_path, f) for f in files],
+                                                         bounds, self.cube_buffer)
+            rows, cols, inverse = self.pixel_index.lookup(transform, cube.shape[1:], crs, locations)
+            # The locations out of the cube have no data, negative indices would take pixels of the other side
+            inside = self.pixel_index.inside(cube.shape[1:], rows, cols)
+            values = np.full((cube.shape[0], len(rows)), np.nan, dtype=np.result_type(cube.dtype, np.float32))
+            values[:, inside] = cube[:, rows[inside], cols[inside]]
+            values = values[:, inverse]
+        else:
+            # Every daily file is extracted in a thread, the values keep the order of the files
+            def extract_file(file):
+                return self.extract_file(os.path.join(dir_path, file), locations)
+            with ThreadPoolExecutor(max_workers=max(1,self.cores)) as executor:
+                values = list(tqdm(executor.map(extract_file, files),total=len(files),desc="Extracting " + var))
+
+        return self.values_table(locations,var,dates,values)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to extract the values of a raster
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # file_path: path of the raster (.tif or .tif.gz)
+    # locations: Dataframe with coordinates for each location that we want to extract.
+    # OUTPUT: Array with the value of every location
+    def extract_file(self,file_path,locations):
+        with rasterio.open(raster_path(file_path)) as src:
+            # Unique pixels of the locations in the grid of the file
+            rows, cols, inverse = self.pixel_index.lookup(src.transform, src.shape, src.crs, locations)
+            # Only the blocks of the raster with locations are decoded, once for all locations
+            return self.pixel_index.sample(src, rows, cols)[inverse]
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to build the table of the values extracted
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # locations: Dataframe with coordinates for each location
+    # var: Name of the variable
+    # dates: List with the date of every file
+    # values: Values of the locations by file (file x location)
+    # OUTPUT: Dataframe with a row by file and location
+    def values_table(self,locations,var,dates,values):
+        n = locations.shape[0]
+        data = pd.DataFrame({'ws':np.tile(locations['ws'].to_numpy(),len(dates)),
+                            'day':np.repeat([d.day for d in dates],n).astype(np.int64),
+                            'month':np.repeat([d.month for d in dates],n).astype(np.int64),
+                            'year':np.repeat([d.year for d in dates],n).astype(np.int64),
+                            var:np.ravel(values) if len(values) > 0 else np.array([],dtype=np.float32)})
         return data
 
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -280,8 +591,7 @@ class CompleteData():
     def extract_chirp_data(self,locations):
         save_path = self.path_country_inputs_forecast_dailydownloaded
         dir_path = os.path.join(save_path,"chirp")
-        data = self.extract_values(dir_path,'prec',locations,-14,-4,'%Y.%m.%d')
-        df = pd.DataFrame(data)
+        df = self.extract_values(dir_path,'prec',locations,-14,-4,'%Y.%m.%d')
         return df
 
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -293,16 +603,73 @@ class CompleteData():
     def extract_era5_data(self,locations,variables=["t_max","t_min","sol_rad"]):
         save_path = self.path_country_inputs_forecast_dailydownloaded
         df = pd.DataFrame()
-        for v in variables:
-            dir_path = os.path.join(save_path,"era5",v)
-            data = self.extract_values(dir_path,v,locations,-23,-15,'%Y%m%d')
-            df_tmp = pd.DataFrame(data)
+
+        # The NetCDF files of the download are read directly, from the temporal folder or from the zip.
+        # The rasters are used if they are not available
+        def extract_variable(v):
+            dir_path_nc = os.path.join(save_path,"era5",v + "_tmp")
+            zip_path = os.path.join(save_path,"era5",v + ".zip")
+            if os.path.exists(dir_path_nc) and len(glob.glob(os.path.join(dir_path_nc,"*.nc"))) > 0:
+                return self.extract_era5_nc(dir_path_nc,v,locations)
+            if os.path.exists(zip_path):
+                return self.extract_era5_nc(zip_path,v,locations)
+            return self.extract_values(os.path.join(save_path,"era5",v),v,locations,-23,-15,'%Y%m%d')
+
+        # The variables are extracted in parallel and merged in the order of the list
+        with ThreadPoolExecutor(max_workers=max(1,min(self.cores,len(variables)))) as executor:
+            tables = list(executor.map(extract_variable,variables))
+        for df_tmp in tables:
             if df.shape[0] == 0:
                 df = df_tmp.copy()
             else:
                 df = pd.merge(df,df_tmp,how='left',on=['ws','day','month','year'])
         return df
 
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to extract ERA 5 data from the NetCDF files
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # dir_path: path where it should take the NetCDF files of the variable, or path of the zip of the download.
+    # var: The name of the variable
+    # locations: Dataframe with the stations
+    # OUTPUT: Dataframe with values extracted by variable, date, and station (ws, day, month, year, var).
+    def extract_era5_nc(self,dir_path,var,locations):
+        lons = xarray.DataArray(locations['lon'].to_numpy(dtype=np.float64),dims="ws")
+        lats = xarray.DataArray(locations['lat'].to_numpy(dtype=np.float64),dims="ws")
+
+        if dir_path.endswith(".zip"):
+            # Every member is decoded from memory and only the nearest cells of the locations are kept
+            points = []
+            for member in self.zip_members(dir_path):
+                with open_nc(dir_path,member) as xds:
+                    name = [v for v in xds.data_vars if xds[v].ndim == 3][0]
+                    points.append(xds[name].sel(lon=lons,lat=lats,method="nearest").load())
+            points = xarray.concat(points,dim="time").sortby("time").transpose("time","ws")
+        else:
+            files = sorted(glob.glob(os.path.join(dir_path,"*.nc")))
+            # All days are opened lazily as one dataset and only the nearest cells of the locations are loaded
+            with xarray.open_mfdataset(files,combine="by_coords") as xds:
+                name = [v for v in xds.data_vars if xds[v].ndim == 3][0]
+                points = xds[name].sel(lon=lons,lat=lats,method="nearest").transpose("time","ws").load()
+
+        # The unit transform is applied just to the values of the locations
+        values = points.values
+        if self.enum_variables[var]["transform"] == "-":
+            values = values - np.array(self.enum_variables[var]["value"],dtype=values.dtype)
+        elif self.enum_variables[var]["transform"] == "/":
+            values = values / np.array(self.enum_variables[var]["value"],dtype=values.dtype)
+
+        dates = pd.to_datetime(points["time"].values)
+        return self.values_table(locations,var,dates,values)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to list the NetCDF files of a zip
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # path: Path of the zip
+    # OUTPUT: Sorted list with the names of the NetCDF members
+    def zip_members(self,path):
+        with ZipFile(path, 'r') as zObject:
+            return sorted([m for m in zObject.namelist() if m.endswith(".nc")])
+
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
     # Function to generate climatology from historical data
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
@@ -314,7 +681,7 @@ class CompleteData():
         # Loop for each location
         for index,location in tqdm(locations.iterrows(),total=locations.shape[0],desc="Calculating climatology"):
             file_path = os.path.join(save_path,location["ws"] + ".csv")
-            df_tmp = pd.read_csv(file_path)
+            df_tmp = self.cache.read(file_path)
             df_tmp = df_tmp.groupby(['day', 'month']).agg({
                             't_max': 'mean',
                             't_min': 'mean',
@@ -345,42 +712,73 @@ class CompleteData():
         cols_total = cols_date + variables
         for index,location in tqdm(locations.iterrows(),total=locations.shape[0],desc="Writing scenarios"):
             files = glob.glob(os.path.join(save_path,location["ws"], '*'))
+
+            # filtering data for this location
+            df_data = data.loc[data["ws"] == location["ws"],cols_total]
+
+            # We validate if we have data or we should use the climatology
+            if df_data.shape[0] == 0:
+                df_data = climatology.loc[climatology["ws"] == location["ws"],cols_total]
+
             for f in files:
+                # The folder of the summary and the fingerprint of the index are not escenaries
+                if not os.path.isfile(f) or f.endswith(".json"):
+                    continue
+
+                # The index has just the analog years, the observed month can not be set in it
+                if os.path.basename(f) == "escenarios_index.csv":
+                    print("WARNING: " + location["ws"] + " has an index of escenaries, the observed month is not written")
+                    continue
+
+                # All escenaries of the bundle are updated with one read and one write
+                if f.endswith(".nc"):
+                    bundle = ScenarioBundle.read(f)
+                    bundle.replace_month(self.start_date.year,self.start_date.month,df_data)
+                    bundle.write(f)
+                    continue
+
                 # Preparing original files
                 df_tmp = pd.read_csv(f)
                 # Remove records old
-                df_tmp = df_tmp.loc[(df_tmp["year"] != self.start_date.year) & (df_tmp["month"] != self.start_date.month),:]
-
-                # filtering data for this location
-                df_data = data.loc[data["ws"] == location["ws"],cols_total]
-
-                # We validate if we have data or we should use the climatology
-                if df_data.shape[0] == 0:
-                    df_data = climatology.loc[climatology["ws"] == location["ws"],cols_total]
+                df_tmp = df_tmp.loc[(df_tmp["year"] != self.start_date.year) | (df_tmp["month"] != self.start_date.month),:]
 
                 #
                 #df_data = df_data.append(df_tmp,ignore_index=True)
-                df_data = pd.concat([df_data,df_tmp], ignore_index=True)
-                df_data = df_data[cols_total]
-                df_data.to_csv(f,index=False)
+                df_tmp = pd.concat([df_data,df_tmp], ignore_index=True)
+                df_tmp = df_tmp[cols_total]
+                df_tmp.to_csv(f,index=False)
 
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
-    # Function to execute chunk of the waether station list
+    # Function to extract the data of the stations, every file is read once for all of them
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
-    # df_chunk: Dataframe with the partial list of weather stations
-    def run_chunk(self, df_chunk):
+    # locations: Dataframe with coordinates for each location that we want to extract.
+    # df_data_chirp: Dataframe with the CHIRP data already extracted. If it is None it is extracted from the rasters
+    # OUTPUT: Dataframe with the CHIRP and ERA 5 data of all the stations
+    def extract_data(self, locations, df_data_chirp = None):
         print("Extracting CHIRP data")
-        df_data_chirp = self.extract_chirp_data(df_chunk)
+        if df_data_chirp is None:
+            df_data_chirp = self.extract_chirp_data(locations)
         print("Extracted CHIRP data")
 
         print("Extracting ERA 5 data")
-        df_data_era5 = self.extract_era5_data(df_chunk)
+        df_data_era5 = self.extract_era5_data(locations)
         print("Extracted ERA 5 data")
 
         print("Merging CHIRPS and ERA 5")
-        df_data = pd.DataFrame()
         df_data = pd.merge(df_data_chirp,df_data_era5,how='outer',on=['ws','day','month','year'])
         print("Merged CHIRPS and ERA 5")
+        return df_data
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to execute chunk of the waether station list
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # df_chunk: Dataframe with the partial list of weather stations
+    # df_data: Dataframe with the data extracted for the stations. If it is None it is extracted for the chunk
+    def run_chunk(self, df_chunk, df_data = None):
+        if df_data is None:
+            df_data = self.extract_data(df_chunk)
+        else:
+            df_data = df_data.loc[df_data["ws"].isin(df_chunk["ws"]),:]
 
         print("Extracting Climatology data")
         df_data_climatology = self.extract_climatology(df_chunk)
@@ -400,22 +798,39 @@ class CompleteData():
         self.prepare_env()
         print("Env prepared")
 
-        print("CHIRPS data started!")
-        self.download_data_chirp()
-        print("CHIRPS data downloaded!")
+        print("Listing stations")
+        df_ws = self.list_ws()
+        print("Listed stations")
 
+        # ERA 5 is downloaded while CHIRPS is downloaded, cropped to the stations and extracted file by file
         print("ERA 5 data started!")
-        self.download_era5_data()
+        bounds = self.stations_bounds(df_ws)
+        with ThreadPoolExecutor(max_workers=1) as era5:
+            era5_download = era5.submit(self.download_era5_data,convert=False,unzip=False)
+
+            print("CHIRPS data started!")
+            df_data_chirp = self.download_extract_chirp(df_ws,compressed=True,bounds=bounds)
+            print("CHIRPS data downloaded and extracted!")
+
+            era5_download.result()
         print("ERA 5 data downloaded!")
 
-        print("Listing stations")
-        df_ws = self.list_ws()
-        print("Listed stations")
+        # The workers split the files, so every raster is read once for all stations. ERA 5 is read from its NetCDF
+        # files, the monthly cube only serves the variables downloaded as rasters
+        print("Extracting data of the stations")
+        df_data = self.extract_data(df_ws,df_data_chirp)
+        print("Extracted data of the stations")
 
+        # The stations are split only to write their files
         print("Adding data started!")
-        pool = mp.Pool(processes=self.cores)
-        chunks = np.array_split(df_ws, self.cores)
-        chunk_processes = [pool.apply_async(self.run_chunk, args=(chunk)) for chunk in chunks]
+        chunks = [chunk for chunk in np.array_split(df_ws, self.cores) if chunk.shape[0] > 0]
+        data_chunks = [df_data.loc[df_data["ws"].isin(chunk["ws"]),:] for chunk in chunks]
+        if self.cores > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=self.cores) as executor:
+                list(executor.map(self.run_chunk,chunks,data_chunks))
+        else:
+            for chunk,data_chunk in zip(chunks,data_chunks):
+                self.run_chunk(chunk,data_chunk)
         print("Added data!")
 
         print("Process finished")
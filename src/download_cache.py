@@ -0,0 +1,153 @@
+# Cache of the downloaded files shared by the runs of all countries
+# Alliance Bioversity, CIAT. 2023
+
+import os
+import time
+import shutil
+import contextlib
+
+# =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+# Function to lock a path between threads and processes
+# =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+# path: Path of the lock file
+# timeout: Seconds to wait for the lock. It raises TimeoutError when they pass
+# stale: Seconds after which a lock is taken as left by a process which died
+@contextlib.contextmanager
+def locked(path,timeout=3600,stale=3600,poll=0.1):
+    start = time.time()
+    while True:
+        try:
+            # Creating the file is atomic, only one thread or process gets it
+            fd = os.open(path,os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() - start >= timeout:
+                raise TimeoutError("Lock not released " + path)
+            time.sleep(poll)
+    try:
+        yield
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+class DownloadCache():
+
+    # path: Folder of the cache, the runs of all countries should use the same one
+    # max_size: Maximum size of the cache in bytes. The files not used for the longest time are removed when it is exceeded
+    # timeout: Seconds to wait for other run downloading the same file, the requests of the CDS can wait hours in the queue
+    def __init__(self,path,max_size=10 * 1024 ** 3,timeout=12 * 3600):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get the path of a file in the cache
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # key: List with the parts of the key, for example product, version, date and name of the file
+    # OUTPUT: Path of the file in the cache
+    def entry(self,key):
+        parts = [str(k).replace(os.path.sep,"_") for k in key]
+        if len(parts) == 0 or any(p in ["",".",".."] for p in parts):
+            raise ValueError("Invalid key of the cache " + str(key))
+        return os.path.join(self.path,*parts)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get a file from the cache, it is downloaded into the cache if it is not there
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # key: List with the parts of the key
+    # target: Path where the file should be saved
+    # download: Function which receives a path and downloads the file there
+    # force: Set if the file is downloaded again even if it is in the cache
+    # OUTPUT: True if the file was downloaded, False if it was taken from the cache
+    def fetch(self,key,target,download,force=False):
+        file = self.entry(key)
+        os.makedirs(os.path.dirname(file),exist_ok=True)
+        # Only one thread or process downloads a file, the others wait and take it from the cache
+        with locked(file + ".lock",timeout=self.timeout,stale=self.timeout):
+            downloaded = force or not os.path.exists(file)
+            if downloaded:
+                # Only the owner of the lock writes it, so the partial file of an interrupted run can be resumed
+                tmp = file + ".tmp"
+                download(tmp)
+                os.replace(tmp,file)
+            self.link(file,target)
+            # The time of use is saved apart, so the times of the linked files are not changed
+            with open(file + ".used","w"):
+                pass
+        self.evict(keep=file)
+        return downloaded
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to put a file of the cache in a folder
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # file: Path of the file in the cache
+    # target: Path where the file should be saved
+    def link(self,file,target):
+        tmp = target + ".tmp" + str(os.getpid())
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        # A hard link does not use more space and keeps the file if it is removed from the cache.
+        # It is copied when the cache is in other disk
+        try:
+            os.link(file,tmp)
+        except OSError:
+            shutil.copyfile(file,tmp)
+        os.replace(tmp,target)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to list the files of the cache
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # OUTPUT: List with the path, the size and the time of the last use of every file, from the oldest use
+    def files(self):
+        files = []
+        for root,dirs,names in os.walk(self.path):
+            for name in names:
+                if name.endswith(".lock") or name.endswith(".used") or ".tmp" in name:
+                    continue
+                file = os.path.join(root,name)
+                try:
+                    used = os.path.getmtime(file + ".used") if os.path.exists(file + ".used") else os.path.getmtime(file)
+                    files.append((file,os.path.getsize(file),used))
+                except FileNotFoundError:
+                    continue
+        return sorted(files,key=lambda f: f[2])
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to remove the files not used for the longest time until the cache fits in its maximum size
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # keep: Path of a file which should not be removed
+    # OUTPUT: List of the files removed
+    def evict(self,keep=None):
+        removed = []
+        if not os.path.exists(self.path):
+            return removed
+        try:
+            with locked(os.path.join(self.path,"evict.lock"),timeout=0):
+                files = self.files()
+                size = sum(f[1] for f in files)
+                for file,file_size,used in files:
+                    if size <= self.max_size:
+                        break
+                    if file == keep:
+                        continue
+                    # The files in use by other thread or process are kept
+                    try:
+                        with locked(file + ".lock",timeout=0,stale=self.timeout):
+                            os.remove(file)
+                            if os.path.exists(file + ".used"):
+                                os.remove(file + ".used")
+                    except TimeoutError:
+                        continue
+                    size -= file_size
+                    removed.append(file)
+        except TimeoutError:
+            # Other thread or process is removing files
+            pass
+        return removed
@@ -0,0 +1,121 @@
+# Resumable downloads over a pool of keep-alive connections
+# Alliance Bioversity, CIAT. 2023
+
+import os
+import time
+import hashlib
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes of the server which are worth to try again
+RETRY_STATUS = [408,429,500,502,503,504]
+
+class Downloader():
+
+    # workers: Number of simultaneous downloads, it is also the size of the pool of connections
+    # retries: Number of times a download is tried again after a failure
+    # backoff: Seconds to wait before the first retry, the time is doubled in every retry
+    # timeout: Seconds to wait for the server to connect or to send data
+    # chunk_size: Number of bytes written to the file at a time
+    def __init__(self,workers=4,retries=5,backoff=1.0,timeout=60,chunk_size=1024 * 1024):
+        self.workers = max(1,workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        # The connections are reused by all downloads of the same server
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,pool_maxsize=self.workers)
+        self.session.mount("http://",adapter)
+        self.session.mount("https://",adapter)
+        self.semaphore = threading.BoundedSemaphore(self.workers)
+
+    # The session and the semaphore are created again when the object is sent to other process
+    def __getstate__(self):
+        return {"workers":self.workers,"retries":self.retries,"backoff":self.backoff,"timeout":self.timeout,"chunk_size":self.chunk_size}
+
+    def __setstate__(self,state):
+        self.__init__(**state)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to download a file, the partial files of previous attempts are resumed
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # url: Url of the file
+    # path: Path where the file should be saved
+    # size: Expected size of the file in bytes. If it is None, it is taken from the server
+    # checksum: Expected hash of the file as "algorithm:hexdigest", for example "sha256:ab12...". If it is None, it is not validated
+    # progress: Function called with the number of bytes written in every chunk
+    # OUTPUT: Path of the downloaded file. It raises the last error if all attempts failed
+    def fetch(self,url,path,size=None,checksum=None,progress=None):
+        part = path + ".part"
+        with self.semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.stream(url,part,size,progress)
+                    self.validate(part,size,checksum)
+                    # The file is renamed at the end, so an interrupted download is not taken as downloaded
+                    os.replace(part,path)
+                    return path
+                except requests.HTTPError as e:
+                    if e.response is None or e.response.status_code not in RETRY_STATUS or attempt == self.retries:
+                        raise
+                except (requests.ConnectionError,requests.Timeout,requests.exceptions.ChunkedEncodingError,IOError,ValueError):
+                    if attempt == self.retries:
+                        raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to write the content of an url in a file, continuing from its current size
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # url: Url of the file
+    # part: Path of the partial file
+    # size: Expected size of the file in bytes
+    # progress: Function called with the number of bytes written in every chunk
+    def stream(self,url,part,size=None,progress=None):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if size is not None and offset > size:
+            os.remove(part)
+            offset = 0
+        headers = {"Range":"bytes=" + str(offset) + "-"} if offset > 0 else {}
+        with self.session.get(url,headers=headers,stream=True,timeout=self.timeout) as response:
+            # The range is after the end of the file, the partial file is complete
+            if response.status_code == 416 and offset > 0:
+                return
+            response.raise_for_status()
+            # The server ignored the range, so the file is written from the beginning
+            if response.status_code != 206:
+                offset = 0
+            length = response.headers.get("Content-Length")
+            with open(part,"ab" if offset > 0 else "wb") as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    if progress is not None:
+                        progress(len(chunk))
+        # A connection closed before the end leaves a partial file which is resumed in the next attempt
+        if length is not None and os.path.getsize(part) != offset + int(length):
+            raise IOError("Incomplete download " + url + ": " + str(os.path.getsize(part)) + " of " + str(offset + int(length)) + " bytes")
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to validate a downloaded file
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # part: Path of the partial file
+    # size: Expected size of the file in bytes
+    # checksum: Expected hash of the file as "algorithm:hexdigest"
+    # It raises ValueError and removes the file if it is not valid, so the next attempt starts again
+    def validate(self,part,size=None,checksum=None):
+        error = None
+        if size is not None and os.path.getsize(part) != size:
+            error = "size " + str(os.path.getsize(part)) + " instead of " + str(size)
+        elif checksum is not None:
+            algorithm,expected = checksum.split(":",1)
+            digest = hashlib.new(algorithm)
+            with open(part,"rb") as f:
+                for chunk in iter(lambda: f.read(self.chunk_size),b""):
+                    digest.update(chunk)
+            if digest.hexdigest() != expected.lower():
+                error = algorithm + " " + digest.hexdigest() + " instead of " + expected
+        if error is not None:
+            os.remove(part)
+            raise ValueError("Invalid download " + part + ": " + error)
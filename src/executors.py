@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Execution backends to process the stations
+# Alliance Bioversity, CIAT. 2023
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import dask.bag as db
+
+BACKENDS = ['serial', 'thread', 'process', 'dask']
+
+class Executor():
+
+    def __init__(self, backend = "serial", workers = 1):
+
+        """ Run a function over a list of items with the selected backend
+
+        Args:
+
+          backend: str
+                'serial' to run in the main process, useful to debug.
+                'thread' to use a pool of threads.
+                'process' to use a pool of processes.
+                'dask' to use dask bag with the processes scheduler.
+
+          workers: int
+                Number of threads, processes or dask partitions
+
+        """
+        if backend not in BACKENDS:
+            raise ValueError("Backend " + str(backend) + " is not valid, it should be one of " + ", ".join(BACKENDS))
+        self.backend = backend
+        self.workers = max(1, int(workers))
+
+    def map(self, func, items):
+
+        """ Apply the function to every item
+
+        The function and the items should be picklable for the 'process' and 'dask' backends, and the scripts
+        which use them should be protected with if __name__ == "__main__".
+
+        Args:
+
+          func: function
+                Function of one argument
+
+          items: list
+                Items to process
+
+        Returns:
+
+          list
+              the results in the same order of the items, for all backends
+
+        """
+        items = list(items)
+        if len(items) == 0:
+            return []
+
+        if self.backend == "serial" or (self.workers == 1 and self.backend != "dask"):
+            return [func(x) for x in items]
+
+        elif self.backend == "thread":
+            with ThreadPoolExecutor(max_workers = self.workers) as executor:
+                return list(executor.map(func, items))
+
+        elif self.backend == "process":
+            chunksize = max(1, len(items) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers = self.workers) as executor:
+                return list(executor.map(func, items, chunksize = chunksize))
+
+        else:
+            bag = db.from_sequence(items, npartitions = min(self.workers, len(items)))
+            return bag.map(func).compute(scheduler = 'processes', num_workers = self.workers)
@@ -0,0 +1,29 @@
+import sys
+
+from resampling import AClimateResampling
+
+
+if __name__ == "__main__":
+    # Params
+    # 0: Country
+    # 1: Path root
+    # 2: Station
+    # 3: Index file of the escenaries of the station (escenarios_index.csv)
+    # 4: Id of the escenary
+    # 5: Output file
+    # 6: Variables separated by comma (optional)
+    parameters = sys.argv[1:]
+    country = parameters[0]
+    path = parameters[1]
+    station = parameters[2]
+    index_root = parameters[3]
+    scenario = int(parameters[4])
+    output = parameters[5]
+    variables = parameters[6].split(",") if len(parameters) > 6 else None
+
+    ar = AClimateResampling(path, country, year_forecast = None)
+    df = ar.materialize_scenario(station, index_root, scenario, variables = variables)
+    df.to_csv(output, index=False)
+    print("Escenary",scenario,"saved in",output)
+
+#python materialize.py "ETHIOPIA" "D:\\CIAT\\Code\\USAID\\aclimate_resampling\\data\\" "5e91e1c214daf81260ebba59" "D:\\...\\escenarios_index.csv" 0 "escenario_0.csv"
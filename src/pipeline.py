@@ -0,0 +1,61 @@
+# Producer and consumer pipeline which overlaps two stages of a process
+# Alliance Bioversity, CIAT. 2023
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class Pipeline():
+
+    # producers: Number of threads of the first stage, for example the downloads
+    # consumers: Number of threads of the second stage, for example the extraction
+    # size: Maximum number of items waiting for the second stage. The producers wait when it is full. 0 is no limit
+    def __init__(self,producers=1,consumers=1,size=0):
+        self.producers = max(1,producers)
+        self.consumers = max(1,consumers)
+        self.size = size
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to process the items in two stages, every item goes to the second stage as soon as its first stage ends
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # items: List of items
+    # produce: Function of the first stage, it receives an item
+    # consume: Function of the second stage, it receives the item and the result of the first stage
+    # OUTPUT: List with the result of the second stage of every item, in the order of the items.
+    # The errors of any stage are returned in the place of the result
+    def run(self,items,produce,consume):
+        items = list(items)
+        results = [None] * len(items)
+        tasks = queue.Queue(maxsize=self.size)
+
+        def producer(i):
+            try:
+                tasks.put((i,produce(items[i]),None))
+            except Exception as e:
+                tasks.put((i,None,e))
+
+        def consumer():
+            while True:
+                task = tasks.get()
+                # Every consumer stops when it gets an empty task
+                if task is None:
+                    return
+                i,value,error = task
+                if error is not None:
+                    results[i] = error
+                    continue
+                try:
+                    results[i] = consume(items[i],value)
+                except Exception as e:
+                    results[i] = e
+
+        threads = [threading.Thread(target=consumer,daemon=True) for _ in range(self.consumers)]
+        for t in threads:
+            t.start()
+        with ThreadPoolExecutor(max_workers=self.producers) as executor:
+            list(executor.map(producer,range(len(items))))
+        for _ in threads:
+            tasks.put(None)
+        for t in threads:
+            t.join()
+        return results
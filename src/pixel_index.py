@@ -0,0 +1,156 @@
+# Cache of the pixels of the stations in the raster grids
+# Alliance Bioversity, CIAT. 2023
+
+import os
+import hashlib
+import threading
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+class PixelIndex():
+
+    # path: Folder where the indexes are saved. If it is None the indexes are just kept in memory
+    def __init__(self,path=None):
+        self.path = path
+        self.memory = {}
+        # Threads extracting rasters of the same grid share the index
+        self.lock = threading.Lock()
+
+    # The lock is created again when the index is sent to other process
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get the signature of a raster grid
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # transform: Affine transform of the raster
+    # shape: Height and width of the raster
+    # crs: Coordinate reference system of the raster
+    # OUTPUT: Hash of the grid, all files of a product share it
+    def signature(self,transform,shape,crs):
+        grid = repr((tuple(transform)[:6],tuple(shape),crs.to_wkt() if crs is not None else ""))
+        return hashlib.sha1(grid.encode("utf-8")).hexdigest()[:16]
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get the signature of some locations
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # lons: Longitudes of the locations
+    # lats: Latitudes of the locations
+    # decimals: Decimals of the coordinates which are kept, smaller differences are taken as the same location
+    # OUTPUT: Hash of the coordinates
+    def locations_signature(self,lons,lats,decimals=6):
+        coordinates = np.round(np.stack([lons,lats],axis=1),decimals) + 0.0
+        return hashlib.sha1(np.ascontiguousarray(coordinates).tobytes()).hexdigest()[:16]
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get the pixels of the locations in a grid
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # transform: Affine transform of the raster
+    # shape: Height and width of the raster
+    # crs: Coordinate reference system of the raster
+    # locations: Dataframe with the columns lon and lat
+    # OUTPUT: Rows and columns of the unique pixels and the position of the pixel of every location
+    def lookup(self,transform,shape,crs,locations):
+        lons = locations['lon'].to_numpy(dtype=np.float64)
+        lats = locations['lat'].to_numpy(dtype=np.float64)
+        # Every set of locations has its own index in a grid, so the runs with other stations do not replace it
+        key = self.signature(transform,shape,crs) + "_" + self.locations_signature(lons,lats)
+
+        with self.lock:
+            index = self.memory.get(key)
+            if index is None and self.path is not None and os.path.exists(os.path.join(self.path,key + ".npz")):
+                with np.load(os.path.join(self.path,key + ".npz")) as f:
+                    index = {k: f[k] for k in f.files}
+
+            # The index is built again only if it is not saved
+            if index is None or index["lons"].shape != lons.shape or not (np.allclose(index["lons"],lons) and np.allclose(index["lats"],lats)):
+                index = self.build(transform,shape,lons,lats)
+                self.save(key,index)
+            self.memory[key] = index
+        return index["rows"],index["cols"],index["inverse"]
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to compute the pixels of the locations
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # transform: Affine transform of the raster
+    # shape: Height and width of the raster
+    # lons: Longitudes of the locations
+    # lats: Latitudes of the locations
+    # OUTPUT: Dictionary with the locations, the unique pixels and the position of the pixel of every location
+    def build(self,transform,shape,lons,lats):
+        rows,cols = rasterio.transform.rowcol(transform,lons,lats)
+        rows,cols = np.asarray(rows,dtype=np.int64).reshape(-1),np.asarray(cols,dtype=np.int64).reshape(-1)
+        # Locations in the same pixel read it once
+        pixels,inverse = np.unique(np.stack([rows,cols],axis=1),axis=0,return_inverse=True)
+        return {"lons":lons,"lats":lats,"rows":pixels[:,0],"cols":pixels[:,1],"inverse":inverse.reshape(-1)}
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to find the pixels inside a raster
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # shape: Height and width of the raster
+    # rows: Rows of the pixels
+    # cols: Columns of the pixels
+    # OUTPUT: Boolean array, True for the pixels inside the raster
+    def inside(self,shape,rows,cols):
+        return (rows >= 0) & (cols >= 0) & (rows < shape[0]) & (cols < shape[1])
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to read the values of some pixels of a raster
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # src: Raster opened with rasterio
+    # rows: Rows of the pixels
+    # cols: Columns of the pixels
+    # band: Band to read
+    # dense: Fraction of the raster from which the full band is read instead of the blocks with pixels
+    # OUTPUT: Array with the values of the pixels, NaN for the pixels out of the raster
+    def sample(self,src,rows,cols,band=1,dense=0.25):
+        height,width = src.shape
+        block_height,block_width = src.block_shapes[band - 1]
+        n_block_cols = (width + block_width - 1) // block_width
+        values = np.empty(len(rows),dtype=src.dtypes[band - 1])
+        if len(rows) == 0:
+            return values
+
+        # Pixels out of the raster have no data, negative indices would take pixels of the other side
+        inside = self.inside(src.shape,rows,cols)
+        if not inside.all():
+            values = np.full(len(rows),np.nan,dtype=np.result_type(src.dtypes[band - 1],np.float32))
+            values[inside] = self.sample(src,rows[inside],cols[inside],band,dense)
+            return values
+
+        blocks,position,counts = np.unique((rows // block_height) * n_block_cols + cols // block_width,return_inverse=True,return_counts=True)
+        # Many blocks with pixels are read as the full band
+        if len(blocks) * block_height * block_width >= dense * height * width:
+            return src.read(band)[rows,cols]
+
+        # Only the blocks with pixels are decoded
+        order = np.argsort(position.reshape(-1),kind="stable")
+        for block,pixels in zip(blocks,np.split(order,np.cumsum(counts)[:-1])):
+            row_off,col_off = (block // n_block_cols) * block_height,(block % n_block_cols) * block_width
+            window = Window(col_off,row_off,min(block_width,width - col_off),min(block_height,height - row_off))
+            data = src.read(band,window=window)
+            values[pixels] = data[rows[pixels] - row_off,cols[pixels] - col_off]
+        return values
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to save an index
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # key: Signature of the grid and of the locations
+    # index: Dictionary with the index
+    def save(self,key,index):
+        if self.path is None:
+            return
+        os.makedirs(self.path,exist_ok=True)
+        file = os.path.join(self.path,key + ".npz")
+        # Write in a temporal file and rename it, so other process never read a partial index
+        tmp = file + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident()) + ".npz"
+        np.savez(tmp,**index)
+        os.replace(tmp,file)
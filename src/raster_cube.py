@@ -0,0 +1,167 @@
+# Monthly cube of the daily rasters of a variable
+# Alliance Bioversity, CIAT. 2023
+
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.windows import from_bounds,Window
+
+# =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+# Function to get the path to open a raster with GDAL
+# =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+# file: Path of the raster, it can be compressed with gzip (.tif.gz)
+# OUTPUT: Path of the raster, the compressed files are read in place through /vsigzip/
+def raster_path(file):
+    if file.endswith(".gz"):
+        return "/vsigzip/" + os.path.abspath(file)
+    return file
+
+class RasterCube():
+
+    # path: Folder where the cubes are saved
+    # workers: Number of threads to read the rasters
+    def __init__(self,path,workers=1):
+        self.path = path
+        self.workers = workers
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get the paths of the cube of a folder of rasters
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # dir_path: Folder of the daily rasters
+    # OUTPUT: Prefix of the binary files and path of the metadata. The metadata has the name of its binary file
+    def entry(self,dir_path):
+        key = hashlib.sha1(os.path.abspath(dir_path).encode("utf-8")).hexdigest()[:12]
+        name = os.path.basename(os.path.normpath(dir_path)) + "_" + key
+        return os.path.join(self.path,name),os.path.join(self.path,name + ".json")
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get the fingerprint of the rasters
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # files: Paths of the daily rasters
+    # OUTPUT: List with the name, size and modification time of every file
+    def fingerprint(self,files):
+        return [[os.path.basename(f),os.stat(f).st_size,os.stat(f).st_mtime_ns] for f in files]
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to read the metadata of the cube of a folder
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # dir_path: Folder of the daily rasters
+    # OUTPUT: Metadata of the cube, None if it does not exist
+    def metadata(self,dir_path):
+        prefix,file_meta = self.entry(dir_path)
+        if not os.path.exists(file_meta):
+            return None
+        try:
+            with open(file_meta) as f:
+                meta = json.load(f)
+        except ValueError:
+            return None
+        if "data" not in meta:
+            return None
+        return meta
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to validate if the cube of a folder is up to date
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # dir_path: Folder of the daily rasters
+    # files: Paths of the daily rasters, in the order of the days
+    # bounds: Extent that the cube should cover (left, bottom, right, top)
+    # OUTPUT: Metadata of the cube if it is valid, otherwise None
+    def lookup(self,dir_path,files,bounds):
+        meta = self.metadata(dir_path)
+        if meta is None or not os.path.exists(os.path.join(self.path,meta["data"])):
+            return None
+        if meta["files"] != self.fingerprint(files):
+            return None
+        # New locations inside the extent of the cube use it without reading the rasters again
+        left,bottom,right,top = meta["bounds"]
+        if bounds[0] < left or bounds[1] < bottom or bounds[2] > right or bounds[3] > top:
+            return None
+        return meta
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to stack the daily rasters cropped to an extent
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # dir_path: Folder of the daily rasters
+    # files: Paths of the daily rasters, in the order of the days
+    # bounds: Extent of the cube (left, bottom, right, top)
+    # OUTPUT: Metadata of the new cube. It raises ValueError if the rasters do not have the same grid
+    def build(self,dir_path,files,bounds):
+        os.makedirs(self.path,exist_ok=True)
+        prefix,file_meta = self.entry(dir_path)
+        with rasterio.open(raster_path(files[0])) as src:
+            grid = (src.transform,src.width,src.height,src.crs)
+            # Window of the extent, rounded to whole pixels and clipped to the raster
+            window = from_bounds(*bounds,transform=src.transform).round_offsets(op="floor").round_lengths(op="ceil")
+            window = window.intersection(Window(0,0,src.width,src.height))
+            transform = src.window_transform(window)
+            crs = src.crs.to_wkt() if src.crs is not None else ""
+            dtype = src.dtypes[0]
+
+        # Every version of the cube has its own binary file, so the metadata never points to other data
+        meta = {"files":self.fingerprint(files),"bounds":list(bounds),"transform":list(transform)[:6],"crs":crs}
+        meta["data"] = os.path.basename(prefix) + "_" + str(os.getpid()) + "_" + str(threading.get_ident()) + "_" + str(time.time_ns()) + ".npy"
+        file_data = os.path.join(self.path,meta["data"])
+        cube = np.lib.format.open_memmap(file_data,mode="w+",dtype=dtype,shape=(len(files),int(window.height),int(window.width)))
+
+        # Every thread decodes its own files into its own days of the cube, GDAL releases the GIL while decoding.
+        # The window is the same for all days, so every raster must have the grid of the first one
+        def read_day(i):
+            with rasterio.open(raster_path(files[i])) as src:
+                if (src.transform,src.width,src.height,src.crs) != grid:
+                    raise ValueError("Raster " + files[i] + " does not have the grid of " + files[0])
+                cube[i] = src.read(1,window=window)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1,self.workers)) as executor:
+                list(executor.map(read_day,range(len(files))))
+            cube.flush()
+        except Exception:
+            del cube
+            os.remove(file_data)
+            raise
+        del cube
+
+        # The metadata is written the last and renamed in one step, so the cube is published when it is complete
+        previous = self.metadata(dir_path)
+        tmp = file_meta + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident())
+        with open(tmp,"w") as f:
+            json.dump(meta,f)
+        os.replace(tmp,file_meta)
+        if previous is not None and previous["data"] != meta["data"] and os.path.exists(os.path.join(self.path,previous["data"])):
+            os.remove(os.path.join(self.path,previous["data"]))
+        return meta
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to read the cube of a folder, it is built if it is not up to date
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # dir_path: Folder of the daily rasters
+    # files: Paths of the daily rasters, in the order of the days
+    # bounds: Extent that the cube should cover (left, bottom, right, top)
+    # buffer: Margin added to the extent when the cube is built, so close locations added later can use it
+    # OUTPUT: Memory mapped array (day x row x col), its affine transform and its crs
+    def read(self,dir_path,files,bounds,buffer=0):
+        for attempt in range(2):
+            meta = self.lookup(dir_path,files,bounds)
+            if meta is None:
+                extent = [bounds[0] - buffer,bounds[1] - buffer,bounds[2] + buffer,bounds[3] + buffer]
+                # The extent grows with the locations out of the previous cube of the same rasters
+                previous = self.metadata(dir_path)
+                if previous is not None and previous["files"] == self.fingerprint(files):
+                    extent = [min(extent[0],previous["bounds"][0]),min(extent[1],previous["bounds"][1]),
+                              max(extent[2],previous["bounds"][2]),max(extent[3],previous["bounds"][3])]
+                meta = self.build(dir_path,files,extent)
+            try:
+                cube = np.load(os.path.join(self.path,meta["data"]),mmap_mode="r")
+                break
+            except FileNotFoundError:
+                # Other process published a new version of the cube and removed this one
+                if attempt == 1:
+                    raise
+        crs = rasterio.crs.CRS.from_wkt(meta["crs"]) if meta["crs"] != "" else None
+        return cube,rasterio.Affine(*meta["transform"]),crs
@@ -6,30 +6,61 @@
 import pandas as pd
 import calendar
 import numpy as np
-import random
 import os
+import sys
 import warnings
-import dask.dataframe as dd
+import functools
+import hashlib
+import json
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from sampling import ScenarioSampler, CATEGORIES
+from station_history import StationHistory
+from station_cache import StationCache
+from scenario_bundle import ScenarioBundle
+from summary import ScenarioSummary
+from executors import Executor
 
 warnings.filterwarnings("ignore")
 
+# Variables checked in the verification of the daily data and the statistics saved for them
+SCAN_COLUMNS = ['t_max', 't_min', 'sol_rad']
+SCAN_STATS = ['max_tmax', 'min_tmax', 'max_tmin', 'min_tmin', 'max_srad', 'min_srad']
+
 class AClimateResampling():
 
-  def __init__(self,path,country, year_forecast):
+  def __init__(self,path,country, year_forecast, forecast_period = "tri", output_mode = "csv", n_scenarios = 100, cores = 1, backend = "dask", seed = None):
      self.path = path
      self.country = country
-     #self.cores = cores
+     self.cores = cores
      self.path_inputs = os.path.join(self.path,self.country,"inputs")
      self.path_inputs_prediccion = os.path.join(self.path_inputs,"prediccionClimatica")
      self.path_inputs_daily = os.path.join(self.path_inputs_prediccion,"dailyData")
+     self.path_inputs_cache = os.path.join(self.path_inputs_prediccion,"dailyData_cache")
      self.path_outputs = os.path.join(self.path,self.country,"outputs")
      self.path_outputs_prob = os.path.join(self.path_outputs,"probForecast")
+     self.path_outputs_prob_file = os.path.join(self.path_outputs_prob,"probabilities.csv")
      self.year_forecast = year_forecast
-     self.npartitions = 10 #int(round(cores/3)) 
+     self.forecast_period = forecast_period
+     # 'csv' to save a file by escenary, 'bundle' to save all escenaries in one NetCDF file,
+     # 'index' to save just the years of the escenaries
+     self.output_mode = output_mode
+     # Number of escenaries generated by station
+     self.n_scenarios = n_scenarios
+     # Number of escenaries added at a time to the summary
+     self.summary_chunk = 256
+     # Seed of the sampling, every station gets its own stream so the escenaries do not depend on the backend
+     self.seed = seed
+     # 'serial', 'thread', 'process' or 'dask' to process the stations with cores workers
+     self.executor = Executor(backend, cores)
+     self.cache = StationCache(self.path_inputs_cache)
 
      pass
 
-  def mdl_verification(self,daily_weather_data, seasonal_probabilities):
+  def mdl_verification(self,daily_weather_data, seasonal_probabilities, workers = 1):
 
 
       clima = os.listdir(daily_weather_data)
@@ -44,30 +75,40 @@ class AClimateResampling():
 
 
 
-      check_clm = []
-      for i in range(len(clima)):
-          df = pd.read_csv(os.path.join(daily_weather_data, f"{clima[i]}.csv"))
-
-          # 1. max de temp_max == min de temp_max
-          # 2. max de temp_min == min de temp_min
-          # 3. max de srad == min de srad
-
-          max_tmax = df['t_max'].max()
-          min_tmax = df['t_max'].min()
-
-          max_tmin = df['t_min'].max()
-          min_tmin = df['t_min'].min()
+      # 1. max de temp_max == min de temp_max
+      # 2. max de temp_min == min de temp_min
+      # 3. max de srad == min de srad
 
-          max_srad = df['sol_rad'].max()
-          min_srad = df['sol_rad'].min()
+      files = [os.path.join(daily_weather_data, f"{c}.csv") for c in clima]
+      fingerprints = [self.cache.fingerprint(f) for f in files]
 
-          if max_tmax == min_tmax or max_tmin == min_tmin or max_srad == min_srad:
-              resultado = pd.DataFrame({'code': [clima[i]], 'value': [f"tmax = {max_tmax}; tmin = {max_tmin}; srad = {max_srad}"]})
+      # Maximum and minimum of every variable by station, reusing the scan of the stations which did not change
+      memo_root = os.path.join(self.path_inputs_cache, "verification.csv")
+      memo = pd.read_csv(memo_root).set_index('source') if os.path.exists(memo_root) else pd.DataFrame(columns = ['size', 'mtime'] + SCAN_STATS)
+      stats = np.full((len(clima), len(SCAN_STATS)), np.nan)
+      pending = []
+      for i, f in enumerate(fingerprints):
+          if f['source'] in memo.index and memo.at[f['source'], 'size'] == f['size'] and memo.at[f['source'], 'mtime'] == f['mtime']:
+              stats[i] = memo.loc[f['source'], SCAN_STATS].values
           else:
-              resultado = pd.DataFrame({'code': [clima[i]], 'value': ["OK"]})
-          check_clm.append(resultado)
-
-      df = pd.concat(check_clm)
+              pending.append(i)
+
+      with ThreadPoolExecutor(max_workers = workers) as executor:
+          for i, values in zip(pending, executor.map(self.scan_station, [files[i] for i in pending])):
+              stats[i] = values
+
+      if len(pending) > 0:
+          memo = pd.DataFrame(stats, columns = SCAN_STATS)
+          memo.insert(0, 'source', [f['source'] for f in fingerprints])
+          memo.insert(1, 'size', [f['size'] for f in fingerprints])
+          memo.insert(2, 'mtime', [f['mtime'] for f in fingerprints])
+          os.makedirs(self.path_inputs_cache, exist_ok = True)
+          memo.to_csv(memo_root, index = False)
+
+      max_tmax, min_tmax, max_tmin, min_tmin, max_srad, min_srad = stats.T
+      problem = (max_tmax == min_tmax) | (max_tmin == min_tmin) | (max_srad == min_srad)
+      value = [f"tmax = {float(max_tmax[i])}; tmin = {float(max_tmin[i])}; srad = {float(max_srad[i])}" if problem[i] else "OK" for i in range(len(clima))]
+      df = pd.DataFrame({'code': clima, 'value': value})
       df_1 = df[df['value'] == "OK"]
       df_2 = df[df['value'] != "OK"]
 
@@ -109,6 +150,25 @@ class AClimateResampling():
       result = {'ids_buenos': ids_buenos, 'ids_malos': ids_malos}
       return result
 
+  def scan_station(self, file):
+
+    """ Get the maximum and minimum of the variables checked for a station
+    
+    Args:
+
+      file: str
+            The root of the climate data of the station
+
+    Returns:
+
+      array
+          maximum and minimum of t_max, t_min and sol_rad in the order of SCAN_STATS
+
+    """
+    df = self.cache.read(file, columns = SCAN_COLUMNS)
+    values = df.to_numpy()
+    return np.column_stack([np.nanmax(values, axis = 0), np.nanmin(values, axis = 0)]).ravel()
+
   def preprocessing(self,prob_root,  ids):
 
     """ Determine seasons of analysis according to the month of forecast in CPT
@@ -190,7 +250,7 @@ class AClimateResampling():
 
         # Merge the prob DataFrame with the period DataFrame based on the 'month' and 'End' month columns
         # Join with prob_a
-        prob = prob_a.append(prob.merge(period, left_on='month', right_on='End'))
+        prob = pd.concat([prob_a, prob.merge(period, left_on='month', right_on='End')])
         prob.drop(['month'], axis = 1, inplace = True )
 
     # Reshape the 'prob' DataFrame and put the 'below', 'normal' and 'above' probability categories in a column
@@ -199,6 +259,23 @@ class AClimateResampling():
     #Return probability DataFrame
     return prob
 
+  def probability_index(self, prob):
+
+    """ Group the probabilities by station, so every station gets its rows without filtering the whole file
+    
+    Args:
+
+      prob: DataFrame
+              The result of preprocessing function
+
+    Returns:
+
+      dict
+          a dictionary with the id of the station as key and a dataframe with its probabilities as value
+
+    """
+    return {station: group.reset_index(drop = True) for station, group in prob.groupby('id', sort = False)}
+
   def forecast_station(self,station, prob, daily_data_root, output_root, year_forecast, forecast_period):
     
     """ Generate  forecast scenaries
@@ -209,7 +286,7 @@ class AClimateResampling():
             The id of th station
     
       prob: DataFrame
-              The result of preprocessing function
+              The probabilities of the station, an item of the result of probability_index function
     
       daily_data_root: str
               Where the climate data by station is located
@@ -227,8 +304,12 @@ class AClimateResampling():
     Returns:
 
       Dataframe
-          a dataframe with climate daily data for every season and escenary id 
           a dataframe with years of escenary for every season
+          a dataframe with climate daily data for every season and escenary id 
+      str
+          the folder where outputs of the station are saved
+      Dataframe
+          a dataframe with the issue of the station, only if the station has problems
 
     """
     # Create folders to save result
@@ -245,208 +326,142 @@ class AClimateResampling():
     output_estacion = output_estacion+'/'+ now.strftime("%d-%m-%Y_%H-%M-%S")
 
 
-    # Read the climate data for the station
-    clim = pd.read_csv(daily_data_root + "/"+station +".csv")
+    # Read the climate data for the station and build its calendar cube
+    history = StationHistory.from_dataframe(self.cache.read(daily_data_root + "/"+station +".csv"))
 
-    # Filter the probability data for the station
-    cpt_prob = prob[prob['id']==station]
+    # Probability data of the station
+    cpt_prob = prob
 
-    if len(cpt_prob.index) == 0:
+    if cpt_prob is None or len(cpt_prob.index) == 0:
       print('Station does not have probabilites')
       base_years = 0
       seasons_range = 0
       p = {'id': [station],'issue': ['Station does not have probabilites']}
       problem = pd.DataFrame(p)
 
-      return base_years, seasons_range, problem
+      return base_years, seasons_range, output_estacion, problem
 
     else:
-      # Get the season for the forecast
-      season = cpt_prob['Season'].iloc[0]
-
-      # Adjust the year if the forecast period is 'tri' if necessary
-      if forecast_period == 'tri':
-        year_forecast = [year_forecast+1 if x in ['Dec-Jan-Feb']  else year_forecast for x in season][0]
-      
-      # Check if year of forecast is a leap year for February
-      leap_forecast = (year_forecast%400 == 0) or (year_forecast%4==0 and year_forecast%100!=0)
-
-      # Filter the February data for leap years
-      clim_feb = clim.loc[clim['month'] == 2]
-      clim_feb['leap'] = [True if (year%400 == 0) or (year%4==0 and year%100!=0) else False for year in clim_feb['year']]
-
-      # Standardize february months by year according to year of forecat
-      february = []
-      for i in np.unique(clim_feb['year']):
-        year_data =  clim_feb.loc[clim_feb['year']==i,:]
-        year = year_data.loc[:,'leap']
-        
-        # If year of forecast is a leap year and a year in climate data is not, then add one day to february in climate data
-        if leap_forecast == True and year.iloc[0] == False:
-          year_data.append(year_data.sample(1), ignore_index=True)
-          year_data.iloc[-1,0] = 29
-        else:
-
-          # If year of forecast is not a leap year and a year in climate data is, then remove one day to february in climate data
-          if leap_forecast == False and year.iloc[0] == True:
-            year_data =  year_data.iloc[:-1]
-          else:
-
-            # If both year of forecast and year in climate data are leap years or not, then keep climate data the same
-            year_data = year_data
-      february.append(year_data)
-
-      # Concat standardized february data with the rest of climate data
-      data = pd.concat(february).drop(['leap'], axis = 1 )
-      data = pd.concat([data,clim.loc[clim['month'] != 2]]).sort_values(['year','month'])
-
+      # Get the seasons of the forecast with their year and if February of the forecast is in a leap year
+      seasons = self.forecast_seasons(cpt_prob, year_forecast)
 
       # Start the resampling process for every season of analysis in CPT probabilities file
 
-      base_years = [] # List to store years of sample for each season
-      seasons_range = [] # List to store climate data in the years of sample for each season
+      totals = np.full((len(seasons), len(history.years)), np.nan)
+      probabilities = np.zeros((len(seasons), len(CATEGORIES)))
 
-      for season in  list(np.unique(cpt_prob['Season'])):
+      for s, (season, start, end, year, leap) in enumerate(seasons):
 
         # Select the probabilities for the season
-        x = cpt_prob[cpt_prob['Season'] == season] 
-
-        if x['Start'].iloc[0] > x['End'].iloc[0]:
-          # In climate data 
-          # If the start month is greater than the end month of the season, select the months from the start and less than the end
-            data_range = data.loc[data['month'] >= x['Start'].iloc[0]]
-            data_range_2 = data.loc[data['month'] <= x['End'].iloc[0]]
-            data_range = data_range.append(data_range_2)
-
-        else:
-            #In climate data
-            #If not, select the months between the start and the end month of season
-            data_range = data.loc[(data['month'] >= x['Start'].iloc[0]) & (data['month'] <= x['End'].iloc[0])]
-
-      # Compute total precipitation for each year in the climate data range selected
-        new_data = data_range[['year','prec']].groupby(['year']).sum().reset_index()
-
-        merge = data_range
+        x = cpt_prob[cpt_prob['Season'] == season]
+
+        # Compute total precipitation in the season for each year in the climate data
+        totals[s] = history.season_totals(start, end, leap)
+
+        # Weights of every category from CPT
+        probabilities[s] = x.groupby('Type')['Prob'].sum().reindex(CATEGORIES).fillna(0).values
+
+      # Calculate quantiles to determine precipitation conditions for every year in climate data and
+      # draw the category and one year of every scenario for all seasons at once based on probability from CPT as weights
+      seed = None if self.seed is None else [self.seed, int(hashlib.sha1(station.encode("utf-8")).hexdigest()[:8], 16)]
+      sampler = ScenarioSampler(n_scenarios = self.n_scenarios, seed = seed)
+      conditions = sampler.tercile_conditions(totals)
+
+      # The categories with probability but without years are reported, their probability is given to the other categories.
+      # The seasons without years in any category with probability can not be drawn, so they are left out of the forecast
+      empty = sampler.empty_categories(probabilities, conditions)
+      drawable = ((probabilities > 0) & ~empty).any(axis = 1)
+      issues = []
+      for s, (season, start, end, year, leap) in enumerate(seasons):
+        if not drawable[s]:
+          issues.append({'id': station, 'issue': 'Season without years in the categories with probability', 'season': season})
+        elif empty[s].any():
+          issues.append({'id': station, 'season': season,
+                         'issue': 'Categories without years, their probability was given to the other categories: ' + ', '.join(np.array(CATEGORIES)[empty[s]])})
+      seasons = [x for s, x in enumerate(seasons) if drawable[s]]
+      probabilities, conditions = probabilities[drawable], conditions[drawable]
+
+      if len(seasons) == 0:
+        print('Station does not have years to draw')
+        return 0, 0, output_estacion, pd.DataFrame(issues)
+
+      categories, sampled_years = sampler.sample(probabilities, conditions)
+
+      base_years = pd.DataFrame({'id': np.arange(sampler.n_scenarios)}) # Years of sample for each season
+      seasons_range = [] # Climate data in the years of sample for each season
+
+      for s, (season, start, end, year, leap) in enumerate(seasons):
+
+        # Set the sample years with the season name
+        base_years[season] = history.years[sampled_years[s]]
+
+        # Get the climate data of the years in the sample (and the next year for the months after December) with the sample id
+        values, months, days, analog_years = history.materialize(sampled_years[s], start, end, leap)
+        n_days = len(days)
+        merge = pd.DataFrame({'day': np.tile(days, sampler.n_scenarios),
+                              'month': np.tile(months, sampler.n_scenarios),
+                              'year': analog_years.ravel()})
+        for i, v in enumerate(history.variables):
+          merge[v] = values[:, :, i].ravel()
         merge['Season'] = season
-
-      # Calculate quantiles to determine precipitation conditions for every year in climate data selected
-        cuantiles = list(np.quantile(new_data['prec'], [.33,.66]))
-        new_data['condition'] =  'NA'
-        new_data.loc[new_data['prec']<= cuantiles[0], 'condition'] = 'below'
-        new_data.loc[new_data['prec']>= cuantiles[1], 'condition'] =  'above'
-        new_data.loc[(new_data['prec']> cuantiles[0]) & (new_data['prec']< cuantiles[1]), 'condition'] =  'normal'
-        
-      # Sample 100 records in probability file of season based on probability from CPT as weights
-        muestras = x[['Start', 'End', 'Type', 'Prob']].sample(100, replace = True, weights=x['Prob'])
-        muestras = muestras.set_index(pd.Index(list(range(0,100))))
-      
-      # Randomly get one year from the total precipitation data based on precipitation conditions selected in the 100 data sample.
-        muestras_by_type = []
-        for i in muestras.index: 
-          m = new_data.loc[new_data['condition'] == muestras['Type'].iloc[i]].sample(1)
-          muestras_by_type.append(m) 
-        
-        # Join the 100 samples and add sample id
-        muestras_by_type = pd.concat(muestras_by_type).reset_index()
-        muestras_by_type['index'] = muestras.index
-        muestras_by_type = muestras_by_type.set_index(pd.Index(list(range(0,100))))
-
-
-        # Rename year column with season name  
-        muestras_by_type = muestras_by_type.rename(columns = {'year':season})
-
-        # Calculate the next year of the year sample and assign the same sample id 
-        muestras_by_type['plus'] = list(map(lambda x: x + 1, muestras_by_type[season]))
-
-        #Set the sample years as list and sort
-        years = list(muestras_by_type[season])
-        years.sort()
-
-        if season == 'Nov-Dec-Jan':
-          # If season is November-December-January 
-
-          years_plus = list(map(lambda x: x + 1, years))
-          years_plus.sort()
-        
-          months_numbers =[11,12]
-
-          # Filter the climate data of the last two months of the years in the sample and get the sample id 
-          merge_a = merge[merge['year'].isin(years)]
-          merge_a = merge_a[merge_a['month'].isin(months_numbers)]
-          merge_a = pd.merge(merge_a, muestras_by_type[['index', season]], left_on = 'year', right_on = season)
-          merge_a.drop(season, axis = 1,inplace = True)
-
-          # Filter the climate data of the first month in the next year of the years in sample and get the sample id
-          merge_b = merge[merge['year'].isin(years_plus)]
-          merge_b = merge_b[merge_b['month'] == 1]
-          merge_b = pd.merge(merge_b, muestras_by_type[['index', 'plus']], left_on = 'year', right_on = 'plus')
-          merge_b.drop('plus', axis = 1,inplace = True)
-
-          # Merge the climate data filtered
-          merge = merge_a.append(merge_b)
-            
-        else:
-          if season == 'Dec-Jan-Feb':
-            # If season is December-January-February
-
-            years_plus = list(map(lambda x: x + 1, years))
-            years_plus.sort()
-            months_numbers =[1,2]
-
-            # Filter the climate data of the last month of the years in the sample and get the sample id 
-            merge_a = merge[merge['year'].isin(years)]
-            merge_a = merge_a[merge_a['month'] == 12]
-            merge_a = pd.merge(merge_a, muestras_by_type[['index', season]], left_on = 'year', right_on = season)
-      
-            # Filter the climate data of the first two months in the next year of the years in sample and get the sample id
-            merge_b = merge[merge['year'].isin(years_plus)]
-            merge_b = merge_b[merge_b['month'].isin(months_numbers)]
-            merge_b = pd.merge(merge_b, muestras_by_type[['index', 'plus']], left_on = 'year', right_on = 'plus')
-            merge_b.drop('plus', axis = 1,inplace = True)
-
-            # Merge filtered data
-            merge = merge_a.append(merge_b)
-
-          else:
-            # If season is another, filter climate data of the years in sample and get the sample id
-
-            merge = merge.loc[merge['year'].isin(muestras_by_type[season])]
-            merge = pd.merge(merge,muestras_by_type[['index',season]],left_on = 'year', right_on = season)
-            merge = merge.drop(season, axis = 1)
-
-
-        # Append the 100 years in the sample for every season in the list
-        base_years.append(muestras_by_type[['index',season]])
+        merge['id'] = np.repeat(np.arange(sampler.n_scenarios), n_days)
 
         # Append the climate data filtered for every season in the list
         seasons_range.append(merge)
 
-   
-      # Join seasons samples by column by sample id and save DataFrame in the folder created
-      base_years = pd.concat(base_years, axis = 1).rename(columns={'index': 'id'})
+      # Join climate data filtered for the seasons
+      seasons_range = pd.concat(seasons_range, ignore_index = True)
 
-      if len(list(np.unique(cpt_prob['Season']))) ==2:
-            base_years = base_years.iloc[:,[0,1,3] ]
+      if len(seasons) ==2 and len(issues) == 0:
             base_years.to_csv(output_estacion+ "/samples_for_forecast_"+ forecast_period +".csv", index = False)
 
-            # Join climate data filtered for the seasons and save DataFrame in the folder created
-            seasons_range = pd.concat(seasons_range).rename(columns={'index': 'id'})
-
             #Return climate data filtered with sample id 
-            return base_years, seasons_range
+            return base_years, seasons_range, output_estacion
 
       else:
-            print('Station just have one season available')
-            base_years = base_years.iloc[:,[0,1] ]
-            p = {'id': [station],'issue': ['Station just have one season available'], 'season': [base_years.columns[1]]}
-            problem = pd.DataFrame(p)
+            if len(seasons) != 2:
+              print('Station just have one season available')
+              issues.append({'id': station, 'issue': 'Station just have one season available', 'season': base_years.columns[1]})
+            problem = pd.DataFrame(issues)
             base_years.to_csv(output_estacion+ "/samples_for_forecast_"+ forecast_period +".csv", index = False)
 
-            # Join climate data filtered for the seasons and save DataFrame in the folder created
-            seasons_range = pd.concat(seasons_range).rename(columns={'index': 'id'})
-
             #Return climate data filtered with sample id 
-            return base_years, seasons_range, problem
+            return base_years, seasons_range, output_estacion, problem
+
+  def forecast_seasons(self, cpt_prob, year_forecast):
+
+    """ Order the seasons of the forecast and get the calendar of each one
+    
+    Args:
+
+      cpt_prob: DataFrame
+              Probabilities of a station, result of preprocessing function
+
+      year_forecast: int
+              Year to forecast
+
+    Returns:
+
+      list
+          a tuple by season in chronological order with name of season, start month, end month,
+          year of the start month and True if February of the season is in a leap year
+
+    """
+    seasons = cpt_prob[['Season', 'Start', 'End']].drop_duplicates('Season').sort_values('Start')
+
+    # The first season is the one after the largest gap between the end of a season and the start of the next one
+    if len(seasons) > 1:
+      gaps = (seasons['Start'].values - np.roll(seasons['End'].values, 1)) % 12
+      seasons = seasons.iloc[np.roll(np.arange(len(seasons)), -int(np.argmax(gaps)))]
+
+    first_start = seasons['Start'].iloc[0]
+    result = []
+    for season, start, end in seasons.itertuples(index = False):
+      # Seasons starting before the first one belong to the next year
+      year = year_forecast + int(start < first_start)
+      year_february = year + int(start > end and end >= 2)
+      result.append((season, int(start), int(end), year, calendar.isleap(year_february)))
+    return result
 
   def save_forecast(self,output_estacion, year_forecast, prob, seasons_range, base_years, station):
 
@@ -465,7 +480,7 @@ class AClimateResampling():
               'tri' if the period of CPT forecast is quarter.
 
       prob: DataFrame
-              The result of preprocessing function
+              The probabilities of the station, an item of the result of probability_index function
 
       seasons_range: DataFrame
               The result of forecast_station function
@@ -481,69 +496,292 @@ class AClimateResampling():
           None
     """
     if isinstance(base_years, pd.DataFrame):
-    # Set the output root based on forecast period
 
+      # Probability DataFrame of the station
+      cpt_prob = prob
 
-      # Filter probability DataFrame by station
-      cpt_prob = prob[prob['id']==station]
+      # Seasons of the forecast with the year of their start month
+      seasons = [x for x in self.forecast_seasons(cpt_prob, year_forecast) if x[0] in base_years.columns]
 
-      # If forecast period is November-December-January or December-January-February then the year of forecast is the next
-      year_forecast = [year_forecast+1 if x in ['NDJ', 'DJF']  else year_forecast for x in cpt_prob['Season'].iloc[0]][0]
+      # Set the year of forecast, the months before the start month of the season are in the next year
+      start = seasons_range['Season'].map({x[0]: x[1] for x in seasons})
+      year = seasons_range['Season'].map({x[0]: x[3] for x in seasons})
+      seasons_range = seasons_range.assign(year = year + (seasons_range['month'] < start).astype(int))
 
-      # Filter climate data by escenry id and save
-      escenarios = []
-      for i in base_years.index:
-          df = seasons_range[(seasons_range['id'] == base_years['id'].iloc[i])]
-          df['year'] = year_forecast
-          df = df.drop(['id', 'Season'], axis = 1)
-          escenarios.append(df)
-          df.to_csv(output_estacion +"/escenario_"+ str(i)+".csv", index=False)
+      if self.output_mode == "index":
+          # Save just the years of every escenary, the daily data is materialized on demand
+          self.save_index(output_estacion, seasons, base_years, station)
+          print("Index of escenaries saved in {}".format(output_estacion))
+
+      else:
+          # Escenary x day x variable array of the escenaries
+          bundle = self.scenario_bundle(seasons_range, base_years, station)
 
-      print("Escenaries saved in {}".format(output_estacion))
+      if self.output_mode == "bundle":
+          # Save all escenaries in one compressed file
+          bundle.write(output_estacion + "/escenarios.nc")
+          print("Bundle of escenaries saved in {}".format(output_estacion))
 
       if os.path.exists(output_estacion+ "/summary/"):
-          summary_path = output_estacion+ "summary/"
+          summary_path = output_estacion+ "/summary/"
       else:
           os.mkdir(output_estacion+ "/summary/")
           summary_path = output_estacion+ "/summary/"
 
-      # Calculate maximum and minimum of escenaries by date and save
-      df = pd.concat(escenarios)
-      df.groupby(['day', 'month']).max().reset_index().sort_values(['month', 'day'], ascending = True).to_csv(summary_path+ station+"_max.csv", index=False)
-      df.groupby(['day', 'month']).min().reset_index().sort_values(['month', 'day'], ascending = True).to_csv(summary_path+ station+"_min.csv", index=False)
-      print("Minimum and Maximum of escenaries saved in {}".format(summary_path))
+      # Statistics of the escenaries by date. The escenaries are added to the summary by chunks as they are saved,
+      # so the summary does not hold other copy of the escenaries
+      if self.output_mode == "index":
+          summary, days, months, years, variables = self.index_summary(seasons_range, base_years)
+      else:
+          summary = ScenarioSummary(len(bundle.days), len(bundle.variables))
+          days, months, years, variables = bundle.days, bundle.months, bundle.years, bundle.variables
+          for start in range(0, bundle.values.shape[0], self.summary_chunk):
+              chunk = range(start, min(start + self.summary_chunk, bundle.values.shape[0]))
+              if self.output_mode == "csv":
+                  for i in chunk:
+                      bundle.to_dataframe(i).to_csv(output_estacion +"/escenario_"+ str(i)+".csv", index=False)
+              summary.update(bundle.values[chunk.start:chunk.stop])
+          if self.output_mode == "csv":
+              print("Escenaries saved in {}".format(output_estacion))
+
+      summary.to_dataframe(days, months, years, variables).to_csv(summary_path+ station+"_summary.csv", index=False)
+      print("Summary of escenaries saved in {}".format(summary_path))
 
     else:
 
       return None
     
 
-  def master_processing(self,station, input_root, climate_data_root, verifica ,output_root, year_forecast):
+  def scenario_bundle(self, seasons_range, base_years, station):
+
+    """ Get the escenaries of the station as an array of escenary x day x variable
+    
+    Args:
+
+      seasons_range: DataFrame
+              The climate daily data of the escenaries with the year of forecast
+
+      base_years: DataFrame 
+              The result of forecast_station function
+
+      station: str
+            The id of th station    
+
+    Returns:
+          ScenarioBundle
+    """
+    variables = [c for c in seasons_range.columns if c not in ['day', 'month', 'year', 'Season', 'id']]
+
+    # Every escenary has the same days, so the rows sorted by escenary are the escenary x day x variable array.
+    # The values keep their type, so the escenario files have the same digits of the daily data
+    seasons_range = seasons_range.sort_values('id', kind = 'stable')
+    first = seasons_range[seasons_range['id'] == base_years['id'].iloc[0]]
+    values = seasons_range[variables].to_numpy().reshape(len(base_years.index), first.shape[0], len(variables))
+
+    return ScenarioBundle(values, first['day'], first['month'], first['year'], variables, station, dtype = values.dtype)
+
+  def index_summary(self, seasons_range, base_years):
+
+    """ Get the statistics of the escenaries from their analog years, without building the array of all escenaries
+
+    The escenaries with the same analog year in a season have the same days, so every analog year is taken once
+    with the number of escenaries which use it as weight.
+    
+    Args:
+
+      seasons_range: DataFrame
+              The climate daily data of the escenaries with the year of forecast
+
+      base_years: DataFrame 
+              The result of forecast_station function
+
+    Returns:
+
+      ScenarioSummary
+          statistics of the escenaries
+      array
+          day of every day of the forecast
+      array
+          month of every day of the forecast
+      array
+          year of every day of the forecast
+      list
+          names of the variables
+    """
+    variables = [c for c in seasons_range.columns if c not in ['day', 'month', 'year', 'Season', 'id']]
+    seasons_range = seasons_range.sort_values('id', kind = 'stable')
+    first = seasons_range[seasons_range['id'] == base_years['id'].iloc[0]]
+
+    summaries = []
+    for season in first['Season'].unique():
+      # One escenary by analog year, the rows sorted by escenary are the analog year x day x variable array
+      _, index, counts = np.unique(base_years[season].values, return_index = True, return_counts = True)
+      ids = base_years['id'].values[index]
+      order = np.argsort(ids, kind = 'stable')
+      rows = seasons_range[(seasons_range['Season'] == season) & seasons_range['id'].isin(ids)]
+      values = rows[variables].to_numpy(dtype = np.float64).reshape(len(ids), -1, len(variables))
+      summary = ScenarioSummary(values.shape[1], values.shape[2])
+      summary.update(values, counts[order])
+      summaries.append(summary)
+
+    return ScenarioSummary.concat(summaries), first['day'].values, first['month'].values, first['year'].values, variables
+
+  def history_fingerprint(self, station):
+
+    """ Get the fingerprint of the daily data of a station, the analog years of an index refer to it
+    
+    Args:
+
+      station: str
+            The id of th station
+
+    Returns:
+
+      dict
+          the station, the size and the sha256 hash of its daily data file
+    """
+    digest = hashlib.sha256()
+    with open(os.path.join(self.path_inputs_daily, station + ".csv"), "rb") as f:
+      for chunk in iter(lambda: f.read(1024 * 1024), b""):
+        digest.update(chunk)
+    return {'station': station, 'size': os.path.getsize(os.path.join(self.path_inputs_daily, station + ".csv")), 'sha256': digest.hexdigest()}
+
+  def save_index(self, output_estacion, seasons, base_years, station):
+
+    """ Save the analog year of every escenary and season in one file, with the fingerprint of the daily data
+    of the station in escenarios_index.json
+    
+    Args:
+
+      output_estacion: str
+              Where outputs of the station are saved.
+
+      seasons: list
+              The result of forecast_seasons function
+
+      base_years: DataFrame 
+              The result of forecast_station function
+
+      station: str
+            The id of th station
+
+    Returns:
+          None
+    """
+    index = []
+    for season, start, end, year, leap in seasons:
+      index.append(pd.DataFrame({'id': base_years['id'], 'Season': season, 'Start': start, 'End': end,
+                                 'year': year, 'leap': leap, 'analog_year': base_years[season]}))
+    pd.concat(index, ignore_index = True).to_csv(output_estacion + "/escenarios_index.csv", index = False)
+    with open(output_estacion + "/escenarios_index.json", "w") as f:
+      json.dump(self.history_fingerprint(station), f)
+
+  def materialize_scenarios(self, history, index, scenarios = None):
+
+    """ Build the climate daily data of escenaries saved by save_index function
+    
+    Args:
+
+      history: StationHistory
+              The daily history of the station used to generate the escenaries
+
+      index: DataFrame
+              The content of the escenarios_index.csv file
+
+      scenarios: list
+              The ids of the escenaries to build. By default all escenaries are built
+
+    Returns:
+
+      array
+          values of the variables of every escenary (n_scenarios x n_days x n_variables)
+      array
+          day of every day of the forecast
+      array
+          month of every day of the forecast
+      array
+          year of every day of the forecast
+
+    """
+    scenarios = np.unique(index['id']) if scenarios is None else np.atleast_1d(scenarios)
+    values, days, months, years = [], [], [], []
+
+    for (season, start, end, year, leap), rows in index.groupby(['Season', 'Start', 'End', 'year', 'leap'], sort = False):
+      analog_years = rows.set_index('id').loc[scenarios, 'analog_year'].values
+      v, m, d, _ = history.materialize(np.searchsorted(history.years, analog_years), start, end, bool(leap))
+      values.append(v)
+      days.append(d)
+      months.append(m)
+      years.append(year + (m < start).astype(int))
+
+    return np.concatenate(values, axis = 1), np.concatenate(days), np.concatenate(months), np.concatenate(years)
+
+  def materialize_scenario(self, station, index_root, scenario, days = None, variables = None):
+
+    """ Get the climate daily data of one escenary saved by save_index function
+    
+    Args:
 
-    if os.path.exists(output_root):
-        output_root = output_root
+      station: str
+            The id of th station
+
+      index_root: str
+            The root of the escenarios_index.csv file of the station
+
+      scenario: int
+            The id of the escenary
+
+      days: slice or list
+            Positions of the days of the forecast to get. By default all days
+
+      variables: list
+            Variables to get. By default all variables
+
+    Returns:
+
+      Dataframe
+          a dataframe with the same columns of the escenario files. It raises ValueError if the daily data of the
+          station changed after the index was saved, the escenaries would be different
+
+    """
+    fingerprint_root = os.path.splitext(index_root)[0] + ".json"
+    if os.path.exists(fingerprint_root):
+      with open(fingerprint_root) as f:
+        expected = json.load(f)
+      if expected != self.history_fingerprint(station):
+        raise ValueError("The daily data of the station " + station + " changed after the index was saved " + index_root)
     else:
-        os.mkdir(output_root)
-        
+      warnings.warn("The index does not have the fingerprint of the daily data, the escenaries could be different " + index_root)
 
+    history = StationHistory.from_dataframe(self.cache.read(os.path.join(self.path_inputs_daily, station + ".csv")))
+    values, d, m, y = self.materialize_scenarios(history, pd.read_csv(index_root), [scenario])
+    days = slice(None) if days is None else days
+    variables = history.variables if variables is None else variables
 
-    print("Reading the probability file and getting the forecast seasons")
-    prob_normalized = self.preprocessing(input_root, verifica, output_root)
+    df = pd.DataFrame({'day': d[days], 'month': m[days], 'year': y[days]})
+    for v in variables:
+      df[v] = values[0, days, history.variables.index(v)]
+    return df
+
+  def master_processing(self,station, prob, climate_data_root, output_root, year_forecast, forecast_period):
+
+    # Workers of the same run could create the folder at the same time
+    os.makedirs(output_root, exist_ok = True)
 
 
     print("Resampling and creating the forecast scenaries")
     resampling_forecast = self.forecast_station(station = station,
-                                           prob = prob_normalized,
+                                           prob = prob,
                                            daily_data_root = climate_data_root,
                                            output_root = output_root,
                                            year_forecast = year_forecast,
-                                           forecast_period = verifica[1])
+                                           forecast_period = forecast_period)
 
 
     print("Saving escenaries and a summary")
     self.save_forecast(output_estacion = resampling_forecast[2],
                   year_forecast = year_forecast,
-                  prob = prob_normalized,
+                  prob = prob,
                   base_years = resampling_forecast[0],
                   seasons_range = resampling_forecast[1],
                   station = station)
@@ -556,38 +794,48 @@ class AClimateResampling():
         return None
     
 
+  def process_station(self, station, prob_index, climate_data_root, output_root, year_forecast, forecast_period):
+
+    # Workers of all backends get the station with the index of probabilities
+    return self.master_processing(station = station,
+                                  prob = prob_index.get(station),
+                                  climate_data_root = climate_data_root,
+                                  output_root = output_root,
+                                  year_forecast = year_forecast,
+                                  forecast_period = forecast_period)
+
   def resampling(self):
 
 
     
+    print("Removing stale entries of the daily data cache")
+    self.cache.evict()
+
     print("Fixing issues in the databases")
-    verifica = self.mdl_verification(self.path_inputs_daily, self.path_outputs_prob)
+    verifica = self.mdl_verification(self.path_inputs_daily, self.path_outputs_prob_file, workers = self.cores)
     
     
     estaciones = os.listdir(self.path_inputs_daily)
     n = [i for i in estaciones if not  i.endswith("_coords.csv") ]
     n = [i.replace(".csv","") for i in n]
-    n1 = [i for i in n if i in list(verifica[0]['ids_buenos']['ids'])]
+    n1 = [i for i in n if i in list(verifica['ids_buenos']['ids'])]
+
+    # The probability file is read once for all stations and shared with the workers grouped by station
+    print("Reading the probability file and getting the forecast seasons")
+    prob_normalized = self.preprocessing(self.path_outputs_prob_file, [verifica, self.forecast_period])
+    prob_index = self.probability_index(prob_normalized)
 
   
     print("Processing resampling for stations")
 
     
-    n_df = pd.DataFrame(n1,columns=["id"])
-    n_df_dd = dd.from_pandas(n_df,npartitions=self.npartitions)
-    _col = {'id': object
-            ,'issue':object
-            , 'season': object
-            , 'name': object}
-    sample = n_df_dd.map_partitions(lambda df:
-                                    df["id"].apply(lambda x: self.master_processing(station = x,
-                                               input_root =  self.path_outputs_prob,
-                                               climate_data_root = self.path_inputs_daily,
-                                               output_root = self.path_outputs,
-                                               verifica = verifica,
-                                               year_forecast = self.year_forecast)
-                                                  ), meta=_col
-                                                  ).compute(scheduler='processes')
+    process = functools.partial(self.process_station,
+                                prob_index = prob_index,
+                                climate_data_root = self.path_inputs_daily,
+                                output_root = self.path_outputs,
+                                year_forecast = self.year_forecast,
+                                forecast_period = self.forecast_period)
+    sample = self.executor.map(process, n1)
     return sample
    
   
\ No newline at end of file
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Functions to draw the forecast scenarios with NumPy
+# Alliance Bioversity, CIAT. 2023
+
+import numpy as np
+
+# Order of the tercile categories used in the codes of the sampler
+CATEGORIES = ['below', 'normal', 'above']
+
+class ScenarioSampler():
+
+    def __init__(self, n_scenarios = 100, seed = None):
+        self.n_scenarios = n_scenarios
+        self.rng = np.random.default_rng(seed)
+
+    def tercile_conditions(self, totals):
+
+        """ Classify every year in below, normal or above according to its total precipitation
+
+        Args:
+
+          totals: array
+                Total precipitation by season and year (n_seasons x n_years). NaN for the
+                years that are not available for the season.
+
+        Returns:
+
+          array
+              Codes of the categories in CATEGORIES (0 below, 1 normal, 2 above) and -1
+              for years without data
+
+        """
+        totals = np.atleast_2d(np.asarray(totals, dtype = np.float64))
+        conditions = np.full(totals.shape, -1, dtype = np.int8)
+
+        for s in range(totals.shape[0]):
+            valid = ~np.isnan(totals[s])
+            if not valid.any():
+                continue
+            cuantiles = np.quantile(totals[s, valid], [.33, .66])
+            row = np.where(totals[s] <= cuantiles[0], 0, np.where(totals[s] >= cuantiles[1], 2, 1))
+            conditions[s, valid] = row[valid]
+
+        return conditions
+
+    def empty_categories(self, probabilities, conditions):
+
+        """ Find the categories with probability from CPT but without years to draw
+
+        Args:
+
+          probabilities: array
+                Weights of below, normal and above categories by season (n_seasons x 3)
+
+          conditions: array
+                Result of tercile_conditions function (n_seasons x n_years)
+
+        Returns:
+
+          array
+              True for the categories of every season whose probability is given to the other
+              categories by sample function (n_seasons x 3)
+
+        """
+        probabilities = np.atleast_2d(np.asarray(probabilities, dtype = np.float64))
+        conditions = np.atleast_2d(conditions)
+        counts = np.stack([(conditions == c).sum(axis = 1) for c in range(len(CATEGORIES))], axis = 1)
+        return (probabilities > 0) & (counts == 0)
+
+    def sample(self, probabilities, conditions):
+
+        """ Draw the category and the analog year of every scenario for all seasons at once
+
+        Args:
+
+          probabilities: array
+                Weights of below, normal and above categories by season (n_seasons x 3)
+
+          conditions: array
+                Result of tercile_conditions function (n_seasons x n_years)
+
+        Returns:
+
+          array
+              Category code of every scenario by season (n_seasons x n_scenarios)
+          array
+              Index of the analog year of every scenario by season (n_seasons x n_scenarios)
+
+        """
+        probabilities = np.atleast_2d(np.asarray(probabilities, dtype = np.float64))
+        conditions = np.atleast_2d(conditions)
+        n_seasons = conditions.shape[0]
+        rows = np.arange(n_seasons)[:, None]
+
+        # Pool of years by category: years sorted by category code and the position where each pool starts
+        order = np.argsort(conditions, axis = 1, kind = 'stable')
+        counts = np.stack([(conditions == c).sum(axis = 1) for c in range(len(CATEGORIES))], axis = 1)
+        starts = (conditions < 0).sum(axis = 1)[:, None] + np.cumsum(counts, axis = 1) - counts
+
+        # Categories without years can not be drawn
+        weights = np.where(counts > 0, np.clip(probabilities, 0, None), 0)
+        total = weights.sum(axis = 1, keepdims = True)
+        if (total == 0).any():
+            raise ValueError("Season without years available for the categories with probability")
+        cumulative = np.cumsum(weights / total, axis = 1)
+        cumulative[:, -1] = 1.0
+
+        # Draw the categories of all scenarios based on the probabilities from CPT as weights
+        u = self.rng.random((n_seasons, self.n_scenarios))
+        categories = (u[:, :, None] >= cumulative[:, None, :]).sum(axis = 2).astype(np.int8)
+
+        # Randomly get one year from the pool of the category drawn for every scenario
+        pool_size = counts[rows, categories]
+        position = starts[rows, categories] + (self.rng.random((n_seasons, self.n_scenarios)) * pool_size).astype(np.int64)
+        years = np.take_along_axis(order, position, axis = 1)
+
+        return categories, years
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Single file container of the forecast scenarios of a station
+# Alliance Bioversity, CIAT. 2023
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import netCDF4
+
+class ScenarioBundle():
+
+    def __init__(self, values, days, months, years, variables, station = "", dtype = np.float32, ids = None):
+
+        """ All the escenaries of a station as an array of escenary x day x variable
+
+        Args:
+
+          values: array
+                Values of the variables (n_scenarios x n_days x n_variables)
+
+          days: array
+                Day of every day of the forecast
+
+          months: array
+                Month of every day of the forecast
+
+          years: array
+                Year of every day of the forecast
+
+          variables: list
+                Names of the variables in the last axis of values
+
+          station: str
+                The id of the station
+
+          dtype: type
+                Type of the values in memory, they are always saved as float32
+
+          ids: array
+                Id of every escenary. By default their positions
+
+        """
+        self.values = np.asarray(values, dtype = dtype)
+        self.days = np.asarray(days, dtype = np.int16)
+        self.months = np.asarray(months, dtype = np.int16)
+        self.years = np.asarray(years, dtype = np.int16)
+        self.variables = list(variables)
+        self.station = station
+        self.ids = np.arange(self.values.shape[0]) if ids is None else np.asarray(ids, dtype = np.int32)
+
+    def write(self, path, complevel = 4):
+
+        """ Save the bundle in a compressed NetCDF file, chunked by groups of escenaries
+
+        Args:
+
+          path: str
+                The root of the file with its name and extension (.nc)
+
+          complevel: int
+                Level of the zlib compression
+
+        """
+        n_scenarios, n_days, n_variables = self.values.shape
+        tmp = path + ".tmp" + str(os.getpid())
+        with netCDF4.Dataset(tmp, "w", format = "NETCDF4") as nc:
+            nc.station = self.station
+            nc.createDimension("scenario", n_scenarios)
+            nc.createDimension("day", n_days)
+            nc.createDimension("variable", n_variables)
+
+            nc.createVariable("scenario", "i4", ("scenario",))[:] = self.ids
+            nc.createVariable("day", "i2", ("day",))[:] = self.days
+            nc.createVariable("month", "i2", ("day",))[:] = self.months
+            nc.createVariable("year", "i2", ("day",))[:] = self.years
+            variable = nc.createVariable("variable", str, ("variable",))
+            for i, v in enumerate(self.variables):
+                variable[i] = v
+
+            data = nc.createVariable("data", "f4", ("scenario", "day", "variable"), zlib = True, complevel = complevel,
+                                     chunksizes = (min(n_scenarios, 64), n_days, n_variables), fill_value = np.float32(np.nan))
+            data[:] = self.values
+
+        # The file is renamed at the end, so readers never get a partial bundle
+        os.replace(tmp, path)
+
+    @classmethod
+    def read(cls, path, scenarios = None):
+
+        """ Read a bundle saved with write function
+
+        Args:
+
+          path: str
+                The root of the file
+
+          scenarios: list
+                Ids of the escenaries to read. By default all escenaries are read
+
+        Returns:
+
+          ScenarioBundle
+
+        """
+        with netCDF4.Dataset(path, "r") as nc:
+            nc.set_auto_mask(False)
+            data = nc.variables["data"]
+            ids = nc.variables["scenario"][:]
+            # The escenaries asked are found by their ids and keep them
+            idx = slice(None) if scenarios is None else np.flatnonzero(np.isin(ids, np.atleast_1d(scenarios)))
+            bundle = cls(data[idx, :, :], nc.variables["day"][:], nc.variables["month"][:], nc.variables["year"][:],
+                         list(nc.variables["variable"][:]), getattr(nc, "station", ""), ids = ids[idx])
+        return bundle
+
+    def to_dataframe(self, scenario):
+
+        """ Get one escenary with the columns of the escenario files
+
+        Args:
+
+          scenario: int
+                Position of the escenary in the bundle
+
+        Returns:
+
+          DataFrame
+
+        """
+        df = pd.DataFrame({'day': self.days, 'month': self.months, 'year': self.years})
+        for i, v in enumerate(self.variables):
+            df[v] = self.values[scenario, :, i]
+        return df
+
+    def to_csv(self, output_root):
+
+        """ Export the bundle as the legacy escenario_<id>.csv files, with the ids of the escenaries
+
+        Args:
+
+          output_root: str
+                Folder where the files are saved
+
+        """
+        for i, scenario in enumerate(self.ids):
+            self.to_dataframe(i).to_csv(os.path.join(output_root, "escenario_" + str(scenario) + ".csv"), index = False)
+
+    def replace_month(self, year, month, df):
+
+        """ Replace the days of a month in all escenaries with the same observed data
+
+        Args:
+
+          year: int
+                Year of the month to replace
+
+          month: int
+                Month to replace
+
+          df: DataFrame
+                Daily data with the columns day, month, year and the variables. It is added at the beginning
+                of the escenaries. The variables missing in df are saved as NaN
+
+        """
+        keep = ~((self.years == year) & (self.months == month))
+        new_values = np.full((df.shape[0], len(self.variables)), np.nan, dtype = self.values.dtype)
+        for i, v in enumerate(self.variables):
+            if v in df.columns:
+                new_values[:, i] = df[v].to_numpy(dtype = self.values.dtype)
+
+        new_values = np.broadcast_to(new_values, (self.values.shape[0],) + new_values.shape)
+        self.values = np.concatenate([new_values, self.values[:, keep, :]], axis = 1)
+        self.days = np.concatenate([df['day'].to_numpy(dtype = np.int16), self.days[keep]])
+        self.months = np.concatenate([df['month'].to_numpy(dtype = np.int16), self.months[keep]])
+        self.years = np.concatenate([df['year'].to_numpy(dtype = np.int16), self.years[keep]])
+
+
+if __name__ == "__main__":
+    # Params
+    # 0: Bundle file of the escenaries of a station (escenarios.nc)
+    # 1: Folder where the escenario files are saved
+    parameters = sys.argv[1:]
+    bundle = ScenarioBundle.read(parameters[0])
+    bundle.to_csv(parameters[1])
+    print("Escenaries saved in",parameters[1])
+
+#python scenario_bundle.py "D:\\...\\escenarios.nc" "D:\\...\\escenarios"
@@ -0,0 +1,162 @@
+# Binary cache of the daily data of the stations
+# Alliance Bioversity, CIAT. 2023
+
+import os
+import json
+import glob
+import time
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+class StationCache():
+
+    # path: Folder where the binary files are saved
+    def __init__(self,path):
+        self.path = path
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get the fingerprint of a source file
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # source: Path of the csv file
+    # OUTPUT: Dictionary with the absolute path, size and modification time of the file
+    def fingerprint(self,source):
+        stat = os.stat(source)
+        return {"source":os.path.abspath(source),"size":stat.st_size,"mtime":stat.st_mtime_ns}
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to get the paths of the cache entry of a source file
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # source: Path of the csv file
+    # OUTPUT: Prefix of the binary files and path of the metadata. The metadata has the name of its binary file
+    def entry(self,source):
+        key = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()[:12]
+        name = os.path.basename(source).replace(".csv","") + "_" + key
+        return os.path.join(self.path,name),os.path.join(self.path,name + ".json")
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to validate if the cache entry of a source file is up to date
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # source: Path of the csv file
+    # OUTPUT: Metadata of the entry if it is valid, otherwise None
+    def lookup(self,source):
+        prefix,file_meta = self.entry(source)
+        if not os.path.exists(file_meta):
+            return None
+        with open(file_meta) as f:
+            meta = json.load(f)
+        if "data" not in meta or not all(os.path.exists(os.path.join(self.path,meta[k])) for k in ["data","text"] if k in meta):
+            return None
+        fingerprint = self.fingerprint(source)
+        if any(meta.get(k) != fingerprint[k] for k in fingerprint):
+            return None
+        return meta
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to convert a csv file into the binary cache
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # source: Path of the csv file
+    # OUTPUT: Metadata of the new entry
+    def build(self,source):
+        os.makedirs(self.path,exist_ok=True)
+        fingerprint = self.fingerprint(source)
+        df = pd.read_csv(source)
+        prefix,file_meta = self.entry(source)
+        meta = dict(fingerprint)
+        meta["columns"] = list(df.columns)
+        meta["dtypes"] = [str(t) for t in df.dtypes]
+        meta["rows"] = int(df.shape[0])
+        # Every version of the entry has its own binary file, so the metadata never points to other data
+        meta["data"] = os.path.basename(prefix) + "_" + str(os.getpid()) + "_" + str(threading.get_ident()) + "_" + str(time.time_ns()) + ".npy"
+
+        # Each numeric column is a row of the array, so reading a column only touches its own bytes
+        numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+        meta["numeric"] = numeric
+        values = np.vstack([df[c].to_numpy(dtype=np.float64) for c in numeric]) if len(numeric) > 0 else np.empty((0,0))
+        with open(os.path.join(self.path,meta["data"]),"wb") as f:
+            np.save(f,values)
+        # The other columns, for example the ids or the dates as text, are saved apart with their types
+        text = [c for c in df.columns if c not in numeric]
+        if len(text) > 0:
+            meta["text"] = meta["data"].replace(".npy",".pkl")
+            df[text].to_pickle(os.path.join(self.path,meta["text"]))
+
+        # The metadata is written the last and renamed in one step, so the entry is published when it is complete
+        previous = None
+        if os.path.exists(file_meta):
+            try:
+                with open(file_meta) as f:
+                    previous = json.load(f).get("data")
+            except ValueError:
+                previous = None
+        tmp = file_meta + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident())
+        with open(tmp,"w") as f:
+            json.dump(meta,f)
+        os.replace(tmp,file_meta)
+        if previous is not None and previous != meta["data"]:
+            for f in [previous,previous.replace(".npy",".pkl")]:
+                if os.path.exists(os.path.join(self.path,f)):
+                    os.remove(os.path.join(self.path,f))
+        return meta
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to read a csv file through the cache
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # source: Path of the csv file
+    # columns: List of columns to read. By default all columns are read
+    # OUTPUT: Dataframe with the data of the file
+    def read(self,source,columns=None):
+        for attempt in range(2):
+            meta = self.lookup(source)
+            if meta is None:
+                meta = self.build(source)
+            try:
+                values = np.load(os.path.join(self.path,meta["data"]),mmap_mode="r")
+                text = pd.read_pickle(os.path.join(self.path,meta["text"])) if "text" in meta else None
+                break
+            except FileNotFoundError:
+                # Other process published a new version of the entry and removed this one
+                if attempt == 1:
+                    raise
+        columns = meta["columns"] if columns is None else columns
+        dtypes = dict(zip(meta["columns"],meta["dtypes"]))
+        numeric = meta.get("numeric",meta["columns"])
+        df = pd.DataFrame({c: np.asarray(values[numeric.index(c)]).astype(dtypes[c]) if c in numeric else text[c].to_numpy() for c in columns})
+        return df
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # Function to remove stale entries of the cache
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
+    # age: Seconds after which a binary file without metadata is a leftover. Younger files can be entries still being written
+    # OUTPUT: Number of entries removed. An entry is stale if its source does not exist or changed
+    def evict(self,age=3600):
+        removed = 0
+        used = set()
+        for file_meta in glob.glob(os.path.join(self.path,"*.json")):
+            try:
+                with open(file_meta) as f:
+                    meta = json.load(f)
+                source = meta["source"]
+                valid = os.path.exists(source) and self.lookup(source) is not None and self.entry(source)[1] == file_meta
+            except (ValueError, KeyError, FileNotFoundError):
+                meta,valid = {},False
+            if valid:
+                used.update(meta[k] for k in ["data","text"] if k in meta)
+                continue
+            for f in [file_meta] + [os.path.join(self.path,meta[k]) for k in ["data","text"] if k in meta]:
+                if os.path.exists(f):
+                    os.remove(f)
+            removed += 1
+        # Binary files without metadata and temporal files are leftovers of replaced entries or interrupted writes
+        for file in glob.glob(os.path.join(self.path,"*.npy")) + glob.glob(os.path.join(self.path,"*.pkl")) + glob.glob(os.path.join(self.path,"*.tmp*")):
+            if os.path.basename(file) in used:
+                continue
+            try:
+                if time.time() - os.path.getmtime(file) > age:
+                    os.remove(file)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Dense representation of the daily history of a station
+# Alliance Bioversity, CIAT. 2023
+
+import calendar
+import numpy as np
+import pandas as pd
+
+# Variables stored for every station
+VARIABLES = ['t_max', 't_min', 'prec', 'sol_rad']
+
+# Calendar of 366 days used as day axis. February 29 is always the slot 59
+CALENDAR_MONTH = np.array([m for m in range(1, 13) for d in range(calendar.monthrange(2000, m)[1])], dtype = np.int8)
+CALENDAR_DAY = np.array([d + 1 for m in range(1, 13) for d in range(calendar.monthrange(2000, m)[1])], dtype = np.int8)
+MONTH_START = np.searchsorted(CALENDAR_MONTH, np.arange(1, 14))
+FEB_29 = 59
+
+class StationHistory():
+
+    __slots__ = ('years', 'variables', 'data', 'leap')
+
+    def __init__(self, years, data, variables = VARIABLES):
+
+        """ Daily history of a station as a cube of year x day of year x variable
+
+        Args:
+
+          years: array
+                Years of the history, one by position in the first axis of data
+
+          data: array
+                Values in float32 (n_years x 366 x n_variables). The slot of February 29 of
+                the years which are not leap has the values of February 28
+
+          variables: list
+                Names of the variables in the last axis of data
+
+        """
+        self.years = np.asarray(years, dtype = np.int32)
+        self.data = np.asarray(data, dtype = np.float32)
+        self.variables = list(variables)
+        self.leap = np.array([calendar.isleap(int(y)) for y in self.years], dtype = bool)
+
+    @classmethod
+    def from_dataframe(cls, df, variables = VARIABLES):
+
+        """ Build the history from a DataFrame with the columns day, month, year and the variables
+
+        Args:
+
+          df: DataFrame
+                Daily climate data of the station
+
+          variables: list
+                Variables to keep
+
+        Returns:
+
+          StationHistory
+
+        """
+        years = np.arange(df['year'].min(), df['year'].max() + 1, dtype = np.int32)
+        data = np.full((len(years), len(CALENDAR_MONTH), len(variables)), np.nan, dtype = np.float32)
+
+        year_idx = df['year'].to_numpy() - years[0]
+        slot = MONTH_START[df['month'].to_numpy() - 1] + df['day'].to_numpy() - 1
+        data[year_idx, slot, :] = df[variables].to_numpy(dtype = np.float32)
+
+        # Years which are not leap take February 28 as February 29
+        history = cls(years, data, variables)
+        history.data[~history.leap, FEB_29, :] = history.data[~history.leap, FEB_29 - 1, :]
+        return history
+
+    @classmethod
+    def from_csv(cls, path, variables = VARIABLES):
+        return cls.from_dataframe(pd.read_csv(path), variables)
+
+    def season_days(self, start, end, leap):
+
+        """ Get the positions of the days of a season in the calendar
+
+        Args:
+
+          start: int
+                Start month of the season
+
+          end: int
+                End month of the season. If it is lower than start the season continues in the next year
+
+          leap: bool
+                True if February of the forecast has 29 days
+
+        Returns:
+
+          array
+              Slot of every day of the season in the calendar
+          array
+              Years to add to the analog year for every day (1 for the months of the next year)
+
+        """
+        months = [m for m in range(start, 13)] + [m for m in range(1, end + 1)] if start > end else list(range(start, end + 1))
+        slots = np.concatenate([np.arange(MONTH_START[m - 1], MONTH_START[m]) for m in months])
+        offsets = np.concatenate([np.full(MONTH_START[m] - MONTH_START[m - 1], int(start > end and m <= end)) for m in months])
+        if not leap:
+            keep = slots != FEB_29
+            slots, offsets = slots[keep], offsets[keep]
+        return slots, offsets.astype(np.int32)
+
+    def season(self, start, end, leap):
+
+        """ View of the days of a season for every analog year
+
+        Returns:
+
+          array
+              Values of the season (n_years x n_days x n_variables). NaN for the analog years
+              without the following year when the season continues in the next year
+
+        """
+        slots, offsets = self.season_days(start, end, leap)
+        if not offsets.any() and (np.diff(slots) == 1).all():
+            # Months of one year with the same calendar are a slice of the cube
+            return self.data[:, slots[0]:slots[-1] + 1, :]
+
+        rows = np.arange(len(self.years))[:, None] + offsets[None, :]
+        valid = rows < len(self.years)
+        values = self.data[np.minimum(rows, len(self.years) - 1), slots[None, :], :]
+        values[~valid] = np.nan
+        return values
+
+    def season_totals(self, start, end, leap, variable = 'prec'):
+
+        """ Total of a variable in the season for every analog year
+
+        Returns:
+
+          array
+              Total by year, the missing days are skipped. NaN for the years without data in the
+              season and for the years whose season runs past the last year of the history
+
+        """
+        values = self.season(start, end, leap)[:, :, self.variables.index(variable)]
+        totals = np.nansum(values, axis = 1, dtype = np.float64)
+
+        # The seasons after the last year can not be drawn, the years without data are not in the daily data
+        _, offsets = self.season_days(start, end, leap)
+        past = np.arange(len(self.years)) + offsets.max() >= len(self.years)
+        totals[past | np.isnan(values).all(axis = 1)] = np.nan
+        return totals
+
+    def materialize(self, year_idx, start, end, leap):
+
+        """ Daily data of the scenarios of a season
+
+        Args:
+
+          year_idx: array
+                Position of the analog year of every scenario in years
+
+        Returns:
+
+          array
+              Values of every scenario (n_scenarios x n_days x n_variables)
+          array
+              Month of every day of the season
+          array
+              Day of every day of the season
+          array
+              Analog year of every day of every scenario (n_scenarios x n_days)
+
+        """
+        slots, offsets = self.season_days(start, end, leap)
+        rows = np.asarray(year_idx)[:, None] + offsets[None, :]
+        values = self.data[rows, slots[None, :], :]
+        return values, CALENDAR_MONTH[slots], CALENDAR_DAY[slots], self.years[rows]
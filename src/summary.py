@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# Statistics of the forecast scenarios
+# Alliance Bioversity, CIAT. 2023
+
+import numpy as np
+import pandas as pd
+
+class ScenarioSummary():
+
+    def __init__(self, n_days, n_variables, percentiles = (10, 50, 90), size = 1024):
+
+        """ Statistics by day and variable of the escenaries, updated with one escenary or one group of escenaries
+        at a time, so the memory does not depend on the number of escenaries
+
+        The minimum, the maximum, the mean and the variance (Welford) are exact. The percentiles come from a sketch
+        of at most size points by day and variable: equal values are kept as one point with their count, so the
+        percentiles are exact while there are less distinct values than size (the escenaries repeat the days of the
+        analog years). Over it the sketch keeps size equally spaced quantiles, with an error in rank below 1 / size.
+        NaN values are skipped. The percentiles use the linear interpolation of np.percentile.
+
+        Args:
+
+          n_days: int
+                Number of days of the escenaries
+
+          n_variables: int
+                Number of variables of the escenaries
+
+          percentiles: tuple
+                Percentiles to compute, between 0 and 100
+
+          size: int
+                Maximum number of points of the sketch of the percentiles by day and variable
+
+        """
+        self.percentiles = list(percentiles)
+        self.size = size
+        shape = (n_days, n_variables)
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        # Points of the sketch sorted by value with their weights, the empty points are +inf with weight 0
+        self.points = np.empty((0,) + shape)
+        self.weights = np.empty((0,) + shape)
+
+    @classmethod
+    def from_values(cls, values, weights = None, percentiles = (10, 50, 90), size = 1024, chunk = 256):
+
+        """ Statistics of escenaries already in memory, added by chunks of escenaries
+
+        Args:
+
+          values: array
+                Escenaries (n x n_days x n_variables)
+
+          weights: array
+                Number of escenaries of every row of values (n). By default every row is one escenary
+
+          chunk: int
+                Number of escenaries added at a time
+
+        Returns:
+
+          ScenarioSummary
+
+        """
+        summary = cls(values.shape[1], values.shape[2], percentiles, size)
+        for start in range(0, values.shape[0], chunk):
+            summary.update(values[start:start + chunk], None if weights is None else weights[start:start + chunk])
+        return summary
+
+    def update(self, values, weights = None):
+
+        """ Add escenaries to the statistics
+
+        Args:
+
+          values: array
+                One escenary (n_days x n_variables) or a group of escenaries (n x n_days x n_variables)
+
+          weights: array
+                Number of escenaries of every row of values (n). By default every row is one escenary
+
+        """
+        values = np.asarray(values, dtype = np.float64)
+        if values.ndim == 2:
+            values = values[None]
+        weights = np.ones(values.shape[0]) if weights is None else np.asarray(weights, dtype = np.float64)
+
+        # NaN values do not count
+        valid = ~np.isnan(values)
+        w = np.where(valid, weights[:, None, None], 0.0)
+        x = np.where(valid, values, 0.0)
+
+        # Mean and variance of the group merged with the previous ones (Welford for groups)
+        count = w.sum(axis = 0)
+        mean = (w * x).sum(axis = 0) / np.maximum(count, 1)
+        m2 = (w * (x - mean) ** 2).sum(axis = 0)
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / np.maximum(total, 1)
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / np.maximum(total, 1)
+        self.count = total
+
+        self.min = np.fmin(self.min, np.where(w > 0, values, np.inf).min(axis = 0))
+        self.max = np.fmax(self.max, np.where(w > 0, values, -np.inf).max(axis = 0))
+        self.merge(np.where(w > 0, values, np.inf), w)
+
+    def merge(self, points, weights):
+
+        """ Add points to the sketch of the percentiles and keep it in its maximum size """
+        points = np.concatenate([self.points, points])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(points, axis = 0, kind = 'stable')
+        points = np.take_along_axis(points, order, axis = 0)
+        weights = np.take_along_axis(weights, order, axis = 0)
+
+        # Equal values are one point with the sum of their weights
+        first = np.ones(points.shape, dtype = bool)
+        first[1:] = points[1:] != points[:-1]
+        group = np.cumsum(first, axis = 0) - 1
+        n = int(group[-1].max()) + 1
+        cell = np.arange(group[0].size).reshape(group.shape[1:])
+        flat = (group * cell.size + cell).ravel()
+        self.weights = np.bincount(flat, weights = weights.ravel(), minlength = n * cell.size).reshape((n,) + cell.shape)
+        self.points = np.full((n,) + cell.shape, np.inf)
+        self.points.reshape(-1)[flat[first.ravel()]] = points[first]
+
+        if n > self.size:
+            self.compress()
+
+    def compress(self):
+
+        """ Replace the points of the sketch by size equally spaced quantiles of the same total weight """
+        n = self.points.shape[0]
+        cumulative = np.cumsum(self.weights, axis = 0)
+        total = cumulative[-1]
+        cells = total.size
+
+        # The first point whose cumulative weight passes every rank, searched at once for all days and variables:
+        # the cumulative weights of every cell are scaled to [0, 1] and shifted by the position of the cell
+        offset = 2 * np.arange(cells)[:, None]
+        fraction = (cumulative / np.where(total > 0, total, 1)).reshape(n, cells).T + offset
+        ranks = (np.arange(self.size) + 0.5)[None, :] / self.size + offset
+        position = np.searchsorted(fraction.ravel(), ranks.ravel(), side = 'right') - np.repeat(np.arange(cells) * n, self.size)
+        position = np.minimum(position, n - 1).reshape(cells, self.size).T.reshape((self.size,) + total.shape)
+
+        self.points = np.take_along_axis(self.points, position, axis = 0)
+        self.weights = np.broadcast_to(total / self.size, self.points.shape).copy()
+
+    @classmethod
+    def concat(cls, summaries):
+
+        """ Join the summaries of consecutive periods, for example the seasons of the forecast """
+        n = max(s.points.shape[0] for s in summaries)
+        summary = cls(0, summaries[0].count.shape[1], summaries[0].percentiles, max(s.size for s in summaries))
+        for k in ['count', 'mean', 'm2', 'min', 'max']:
+            setattr(summary, k, np.concatenate([getattr(s, k) for s in summaries]))
+        # The sketches are filled with empty points to the same size
+        pad = lambda a, value: np.concatenate([a, np.full((n - a.shape[0],) + a.shape[1:], value)])
+        summary.points = np.concatenate([pad(s.points, np.inf) for s in summaries], axis = 1)
+        summary.weights = np.concatenate([pad(s.weights, 0.0) for s in summaries], axis = 1)
+        return summary
+
+    def result(self):
+
+        """ Get the statistics
+
+        Returns:
+
+          dict
+              an array (n_days x n_variables) by statistic: min, max, mean, variance and p<percentile>
+
+        """
+        empty = self.count == 0
+        stats = {'min': np.where(empty, np.nan, self.min),
+                 'max': np.where(empty, np.nan, self.max),
+                 'mean': np.where(empty, np.nan, self.mean),
+                 'variance': np.where(self.count > 1, self.m2 / np.maximum(self.count - 1, 1), np.nan)}
+
+        # Position of every percentile in the escenaries sorted, as in np.percentile
+        cumulative = np.cumsum(self.weights, axis = 0)
+        last = self.points.shape[0] - 1
+        for p in self.percentiles:
+            if last < 0:
+                stats['p' + str(p)] = np.full(self.count.shape, np.nan)
+                continue
+            h = p / 100 * np.maximum(self.count - 1, 0)
+            low = np.floor(h)
+            high = np.minimum(low + 1, np.maximum(self.count - 1, 0))
+            # The point of an escenary position is the first point whose cumulative weight passes it
+            value_low = np.take_along_axis(self.points, np.minimum((cumulative <= low).sum(axis = 0), last)[None], axis = 0)[0]
+            value_high = np.take_along_axis(self.points, np.minimum((cumulative <= high).sum(axis = 0), last)[None], axis = 0)[0]
+            with np.errstate(invalid = 'ignore'):
+                stats['p' + str(p)] = np.where(empty, np.nan, value_low + (h - low) * (value_high - value_low))
+        return stats
+
+    def to_dataframe(self, days, months, years, variables):
+
+        """ Statistics in a table with a row by statistic and day and a column by variable """
+        tables = []
+        for name, value in self.result().items():
+            df = pd.DataFrame({'statistic': name, 'day': days, 'month': months, 'year': years})
+            for i, v in enumerate(variables):
+                df[v] = value[:, i]
+            tables.append(df)
+        return pd.concat(tables, ignore_index = True)
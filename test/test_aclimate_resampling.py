@@ -0,0 +1,301 @@
+import sys
+import os
+import shutil
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from unittest import mock
+import pandas as pd
+import numpy as np
+from src.resampling import AClimateResampling, ScenarioSummary
+from src.sampling import ScenarioSampler
+from src.scenario_bundle import ScenarioBundle
+
+class TestAClimateResampling(unittest.TestCase):
+
+    def setUp(self):
+        self.country = 'ETHIOPIA'
+        self.year_forecast = 2023
+        self.stations = ['5e91e1c214daf81260ebba59', '5eb346bdebd0050e38685f3e', '5ebad0a74c06b707e80d5c4a']
+
+        self.path_data = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+        self.path_data_inputs_forecast = os.path.join(self.path_data, 'inputs', 'prediccionClimatica')
+
+        self.path_env = os.path.abspath(os.path.join(os.path.dirname(__file__), 'test_files_resampling'))
+        self.path_env_country = os.path.join(self.path_env, self.country)
+        self.path_env_country_inputs_forecast = os.path.join(self.path_env_country, 'inputs', 'prediccionClimatica')
+        self.path_env_country_inputs_forecast_dailydata = os.path.join(self.path_env_country_inputs_forecast, 'dailyData')
+        self.path_env_country_outputs = os.path.join(self.path_env_country, 'outputs')
+        self.path_env_country_outputs_prob = os.path.join(self.path_env_country_outputs, 'probForecast')
+
+        os.makedirs(os.path.join(self.path_env_country, 'inputs'), exist_ok=True)
+        shutil.copytree(self.path_data_inputs_forecast, self.path_env_country_inputs_forecast)
+        os.makedirs(self.path_env_country_outputs_prob, exist_ok=True)
+
+        # CPT probabilities for two quarters, the last station has wrong probabilities
+        self.prob_file = os.path.join(self.path_env_country_outputs_prob, 'probabilities.csv')
+        pd.DataFrame({'year': [self.year_forecast] * 6,
+                      'month': [7, 10] * 3,
+                      'id': [s for s in self.stations for _ in range(2)],
+                      'below': [0.2, 0.3, 0.4, 0.4, 0.5, 0.5],
+                      'normal': [0.3, 0.4, 0.3, 0.3, 0.0, 0.0],
+                      'above': [0.5, 0.3, 0.3, 0.3, 0.5, 0.5]}).to_csv(self.prob_file, index=False)
+
+        self.resampling = AClimateResampling(self.path_env, self.country, self.year_forecast)
+
+    def tearDown(self):
+        shutil.rmtree(self.path_env)
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+    # TEST VERIFICATION
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+
+    def test_mdl_verification(self):
+        result = self.resampling.mdl_verification(self.path_env_country_inputs_forecast_dailydata, self.prob_file, workers=2)
+
+        self.assertEqual(sorted(result['ids_buenos']['ids'].unique()), self.stations[:2])
+        self.assertIn(self.stations[2], list(result['ids_malos']['ids']))
+
+    def test_mdl_verification_reuses_scan(self):
+        self.resampling.mdl_verification(self.path_env_country_inputs_forecast_dailydata, self.prob_file)
+
+        # Stations which did not change are not scanned again
+        with mock.patch.object(AClimateResampling, 'scan_station') as scan_station:
+            self.resampling.mdl_verification(self.path_env_country_inputs_forecast_dailydata, self.prob_file)
+            scan_station.assert_not_called()
+
+    def test_mdl_verification_constant_variable(self):
+        # A station with constant solar radiation has problems
+        station_file = os.path.join(self.path_env_country_inputs_forecast_dailydata, self.stations[0] + '.csv')
+        self.resampling.mdl_verification(self.path_env_country_inputs_forecast_dailydata, self.prob_file)
+        df = pd.read_csv(station_file)
+        df['sol_rad'] = 20.0
+        df.to_csv(station_file, index=False)
+        os.utime(station_file, ns=(0, 0))
+
+        result = self.resampling.mdl_verification(self.path_env_country_inputs_forecast_dailydata, self.prob_file)
+        ids_malos = result['ids_malos']
+        self.assertTrue(ids_malos.loc[ids_malos['ids'] == self.stations[0], 'descripcion'].str.contains('srad = 20.0').any())
+
+    def test_scan_station(self):
+        station_file = os.path.join(self.path_env_country_inputs_forecast_dailydata, self.stations[0] + '.csv')
+        df = pd.read_csv(station_file)
+        stats = self.resampling.scan_station(station_file)
+
+        self.assertEqual(len(stats), 6)
+        self.assertEqual(stats[0], df['t_max'].max())
+        self.assertEqual(stats[5], df['sol_rad'].min())
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+    # TEST PROBABILITIES
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+
+    def test_preprocessing_tri(self):
+        verifica = self.resampling.mdl_verification(self.path_env_country_inputs_forecast_dailydata, self.prob_file)
+        prob = self.resampling.preprocessing(self.prob_file, [verifica, 'tri'])
+
+        self.assertEqual(sorted(prob['Season'].unique()), ['Jun-Jul-Aug', 'Sep-Oct-Nov'])
+        self.assertEqual(sorted(prob['id'].unique()), self.stations[:2])
+        # One row by station, season and category
+        self.assertEqual(prob.shape[0], 2 * 2 * 3)
+
+    def test_probability_index(self):
+        verifica = self.resampling.mdl_verification(self.path_env_country_inputs_forecast_dailydata, self.prob_file)
+        prob = self.resampling.preprocessing(self.prob_file, [verifica, 'tri'])
+        prob_index = self.resampling.probability_index(prob)
+
+        self.assertEqual(sorted(prob_index.keys()), self.stations[:2])
+        for station, cpt_prob in prob_index.items():
+            pd.testing.assert_frame_equal(cpt_prob, prob[prob['id'] == station].reset_index(drop=True))
+        self.assertIsNone(prob_index.get(self.stations[2]))
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+    # TEST FORECAST STATION
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+
+    def test_forecast_station(self):
+        verifica = self.resampling.mdl_verification(self.path_env_country_inputs_forecast_dailydata, self.prob_file)
+        prob_index = self.resampling.probability_index(self.resampling.preprocessing(self.prob_file, [verifica, 'tri']))
+        result = self.resampling.forecast_station(self.stations[0], prob_index[self.stations[0]], self.path_env_country_inputs_forecast_dailydata,
+                                                  self.path_env_country_outputs, self.year_forecast, 'tri')
+        base_years, seasons_range, output_estacion = result
+
+        self.assertEqual(list(base_years.columns), ['id', 'Jun-Jul-Aug', 'Sep-Oct-Nov'])
+        self.assertEqual(list(seasons_range.columns), ['day', 'month', 'year', 't_max', 't_min', 'prec', 'sol_rad', 'Season', 'id'])
+        self.assertEqual(base_years.shape[0], 100)
+        # 92 days for Jun-Jul-Aug and 91 days for Sep-Oct-Nov by escenary
+        self.assertEqual(seasons_range.shape[0], 100 * (92 + 91))
+        self.assertTrue(os.path.exists(os.path.join(output_estacion, 'samples_for_forecast_tri.csv')))
+
+    def test_forecast_station_n_scenarios(self):
+        self.resampling = AClimateResampling(self.path_env, self.country, self.year_forecast, output_mode="bundle", n_scenarios=2000)
+        prob, (base_years, seasons_range, output_estacion) = self.forecast(self.stations[0])
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+
+        self.assertEqual(base_years.shape[0], 2000)
+        self.assertEqual(seasons_range.shape[0], 2000 * (92 + 91))
+        bundle = ScenarioBundle.read(os.path.join(output_estacion, 'escenarios.nc'))
+        self.assertEqual(bundle.values.shape, (2000, 92 + 91, 4))
+
+    def test_save_forecast_scale(self):
+        self.resampling = AClimateResampling(self.path_env, self.country, self.year_forecast, output_mode="bundle", n_scenarios=10000)
+        prob, (base_years, seasons_range, output_estacion) = self.forecast(self.stations[0])
+
+        # The 10000 escenaries are added to the summary by chunks instead of escenary by escenary
+        with mock.patch('src.resampling.ScenarioSummary.update', autospec=True, side_effect=ScenarioSummary.update) as update:
+            self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+        self.assertEqual(update.call_count, -(-10000 // self.resampling.summary_chunk))
+        self.assertEqual(sum(call.args[1].shape[0] for call in update.call_args_list), 10000)
+
+        summary = pd.read_csv(os.path.join(output_estacion, 'summary', self.stations[0] + '_summary.csv'))
+        self.assertEqual(summary.shape[0], 7 * (92 + 91))
+
+    def test_forecast_station_without_probabilities(self):
+        result = self.resampling.forecast_station(self.stations[2], None, self.path_env_country_inputs_forecast_dailydata,
+                                                  self.path_env_country_outputs, self.year_forecast, 'tri')
+
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[3]['issue'].iloc[0], 'Station does not have probabilites')
+
+    def test_forecast_station_empty_categories(self):
+        tercile_conditions = ScenarioSampler.tercile_conditions
+
+        def conditions(sampler, totals):
+            # No year is normal in the first season and no year has data in the second one
+            result = tercile_conditions(sampler, totals)
+            result[0, result[0] == 1] = 0
+            result[1] = -1
+            return result
+
+        with mock.patch('src.resampling.ScenarioSampler.tercile_conditions', conditions):
+            prob, result = self.forecast(self.stations[0])
+
+        # The seasons with problems are reported as issues of the station instead of failing
+        self.assertEqual(len(result), 4)
+        issues = result[3]
+        self.assertEqual(list(issues['issue']), ['Categories without years, their probability was given to the other categories: normal',
+                                                 'Season without years in the categories with probability',
+                                                 'Station just have one season available'])
+        self.assertEqual(list(result[0].columns), ['id', issues['season'].iloc[0]])
+        self.assertNotEqual(issues['season'].iloc[0], issues['season'].iloc[1])
+
+    def test_resampling_backends(self):
+        # The same seed gives the same escenaries with all backends
+        escenarios = {}
+        for backend in ['serial', 'thread']:
+            resampling = AClimateResampling(self.path_env, self.country, self.year_forecast, cores=2, backend=backend, seed=10)
+            resampling.resampling()
+            for station in self.stations[:2]:
+                output = os.path.join(self.path_env_country_outputs, station)
+                run = sorted(os.listdir(output))[-1]
+                escenarios[(backend, station)] = pd.read_csv(os.path.join(output, run, 'escenario_5.csv'))
+                shutil.rmtree(output)
+
+        for station in self.stations[:2]:
+            pd.testing.assert_frame_equal(escenarios[('serial', station)], escenarios[('thread', station)])
+
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+    # TEST SAVE FORECAST
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+
+    def forecast(self, station):
+        verifica = self.resampling.mdl_verification(self.path_env_country_inputs_forecast_dailydata, self.prob_file)
+        prob_index = self.resampling.probability_index(self.resampling.preprocessing(self.prob_file, [verifica, 'tri']))
+        result = self.resampling.forecast_station(station, prob_index[station], self.path_env_country_inputs_forecast_dailydata,
+                                                  self.path_env_country_outputs, self.year_forecast, 'tri')
+        return prob_index[station], result
+
+    def test_save_forecast_csv(self):
+        prob, (base_years, seasons_range, output_estacion) = self.forecast(self.stations[0])
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+
+        escenario = pd.read_csv(os.path.join(output_estacion, 'escenario_0.csv'))
+        self.assertEqual(list(escenario.columns), ['day', 'month', 'year', 't_max', 't_min', 'prec', 'sol_rad'])
+        self.assertEqual(escenario.shape[0], 92 + 91)
+        self.assertTrue((escenario['year'] == self.year_forecast).all())
+        self.assertTrue(os.path.exists(os.path.join(output_estacion, 'escenario_99.csv')))
+
+    def test_save_forecast_summary(self):
+        prob, (base_years, seasons_range, output_estacion) = self.forecast(self.stations[0])
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+
+        # All statistics are saved in one file with the same days of the escenaries
+        summary = pd.read_csv(os.path.join(output_estacion, 'summary', self.stations[0] + '_summary.csv'))
+        self.assertEqual(list(summary.columns), ['statistic', 'day', 'month', 'year', 't_max', 't_min', 'prec', 'sol_rad'])
+        self.assertEqual(list(summary['statistic'].unique()), ['min', 'max', 'mean', 'variance', 'p10', 'p50', 'p90'])
+
+        escenarios = pd.concat([pd.read_csv(os.path.join(output_estacion, 'escenario_' + str(i) + '.csv')) for i in range(100)])
+        expected = escenarios.groupby(['month', 'day'], sort=False)['t_max']
+        self.assertTrue(np.allclose(summary.loc[summary['statistic'] == 'max', 't_max'], expected.max()))
+        self.assertTrue(np.allclose(summary.loc[summary['statistic'] == 'mean', 't_max'], expected.mean()))
+
+        # The percentiles are exact
+        values = np.stack([pd.read_csv(os.path.join(output_estacion, 'escenario_' + str(i) + '.csv'))[['t_max', 'prec']].to_numpy() for i in range(100)])
+        for p in [10, 50, 90]:
+            table = summary.loc[summary['statistic'] == 'p' + str(p), ['t_max', 'prec']].to_numpy()
+            self.assertTrue(np.allclose(table, np.percentile(values, p, axis=0)))
+
+    def test_save_forecast_index(self):
+        prob, (base_years, seasons_range, output_estacion) = self.forecast(self.stations[0])
+        self.resampling.output_mode = "index"
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+
+        # Just the index of the escenaries is saved
+        self.assertFalse(os.path.exists(os.path.join(output_estacion, 'escenario_0.csv')))
+        index = pd.read_csv(os.path.join(output_estacion, 'escenarios_index.csv'))
+        self.assertEqual(index.shape[0], 100 * 2)
+        self.assertEqual(list(index.loc[index['Season'] == 'Sep-Oct-Nov', 'analog_year']), list(base_years['Sep-Oct-Nov']))
+
+    def test_save_forecast_index_summary(self):
+        prob, (base_years, seasons_range, output_estacion) = self.forecast(self.stations[0])
+        summary_file = os.path.join(output_estacion, 'summary', self.stations[0] + '_summary.csv')
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+        expected = pd.read_csv(summary_file)
+
+        # The summary computed from the analog years is the same of all escenaries
+        self.resampling.output_mode = "index"
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+        summary = pd.read_csv(summary_file)
+        pd.testing.assert_frame_equal(summary, expected, check_exact=False)
+
+    def test_save_forecast_bundle(self):
+        prob, (base_years, seasons_range, output_estacion) = self.forecast(self.stations[0])
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+        self.resampling.output_mode = "bundle"
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+
+        # The bundle has the same escenaries saved as csv
+        bundle = ScenarioBundle.read(os.path.join(output_estacion, 'escenarios.nc'))
+        self.assertEqual(bundle.values.shape, (100, 92 + 91, 4))
+        for scenario in [0, 99]:
+            escenario = pd.read_csv(os.path.join(output_estacion, 'escenario_' + str(scenario) + '.csv'))
+            pd.testing.assert_frame_equal(bundle.to_dataframe(scenario), escenario, check_dtype=False)
+
+    def test_materialize_scenario(self):
+        prob, (base_years, seasons_range, output_estacion) = self.forecast(self.stations[0])
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+        self.resampling.output_mode = "index"
+        self.resampling.save_forecast(output_estacion, self.year_forecast, prob, seasons_range, base_years, self.stations[0])
+        index_root = os.path.join(output_estacion, 'escenarios_index.csv')
+
+        # The escenaries built from the index are the same saved as csv
+        for scenario in [0, 42, 99]:
+            escenario = pd.read_csv(os.path.join(output_estacion, 'escenario_' + str(scenario) + '.csv'))
+            df = self.resampling.materialize_scenario(self.stations[0], index_root, scenario)
+            pd.testing.assert_frame_equal(df.reset_index(drop=True), escenario, check_dtype=False)
+
+        df = self.resampling.materialize_scenario(self.stations[0], index_root, 7, days=slice(0, 10), variables=['prec'])
+        self.assertEqual(list(df.columns), ['day', 'month', 'year', 'prec'])
+        self.assertEqual(df.shape[0], 10)
+
+        # The escenaries are not built from other daily data
+        daily = os.path.join(self.path_env_country_inputs_forecast_dailydata, self.stations[0] + '.csv')
+        history = pd.read_csv(daily)
+        history.loc[0, 'prec'] = history.loc[0, 'prec'] + 1
+        history.to_csv(daily, index=False)
+        with self.assertRaises(ValueError):
+            self.resampling.materialize_scenario(self.stations[0], index_root, 0)
+
+if __name__ == "__main__":
+    unittest.main()
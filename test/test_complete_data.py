@@ -2,16 +2,29 @@ import sys
 import os
 import shutil
 import glob
+import gzip
 from zipfile import ZipFile
+import functools
+import threading
+import time
+import pickle
+import hashlib
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import unittest
+from unittest import mock
 from datetime import datetime
 from datetime import timedelta
 from src.complete_data import CompleteData
+from src.scenario_bundle import ScenarioBundle
+from src.raster_cube import RasterCube
+from src.download_cache import DownloadCache
 import pandas as pd
 import numpy as np
+import rasterio
+import xarray
 
 class TestCompleteData(unittest.TestCase):
 
@@ -286,6 +299,440 @@ class TestCompleteData(unittest.TestCase):
     # TEST EXTRACT VALUES
     # =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=
     
+    def create_rasters(self, dir_path, dates, shape=(50, 60)):
+        # Daily rasters of 0.05 degrees where every pixel has the value row * 1000 + col + day
+        os.makedirs(dir_path, exist_ok=True)
+        transform = rasterio.transform.from_origin(-73.0, 7.0, 0.05, 0.05)
+        grid = np.arange(shape[0])[:, None] * 1000 + np.arange(shape[1])[None, :]
+        for date in dates:
+            with rasterio.open(os.path.join(dir_path, "chirp." + date.strftime('%Y.%m.%d') + ".tif"), 'w', driver='GTiff',
+                               height=shape[0], width=shape[1], count=1, dtype='float32', crs='EPSG:4326', transform=transform) as dst:
+                dst.write((grid + date.day).astype('float32'), 1)
+        return transform
+
+    def test_extract_era5_data_parallel(self):
+        # Rasters of two variables with the names of ERA 5
+        dates = [self.start_date + timedelta(days=x) for x in range(4)]
+        for v in self.variables_era5:
+            dir_path = os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, v)
+            self.create_rasters(dir_path, dates)
+            for f in os.listdir(dir_path):
+                os.rename(os.path.join(dir_path, f), os.path.join(dir_path, "Temperature_AgERA5_" + f[6:16].replace('.', '') + "_final-v1.0.tif"))
+
+        results = []
+        for cores in [1, 3]:
+            complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=cores)
+            complete_data.path_country_inputs_forecast_dailydownloaded = self.path_env_country_inputs_forecast_dailydownloaded
+            results.append(complete_data.extract_era5_data(self.locations, variables=self.variables_era5))
+
+        # The order of the rows does not depend on the threads
+        pd.testing.assert_frame_equal(results[0], results[1])
+        self.assertEqual(list(results[1].columns), ['ws', 'day', 'month', 'year', 't_max', 't_min'])
+        self.assertEqual(list(results[1]['day']), [1, 1, 2, 2, 3, 3, 4, 4])
+
+    def create_era5_zip(self, variable, dates, path=None):
+        # NetCDF files with the structure of AgERA5 (Kelvin degrees) in the zip of the download
+        os.makedirs(self.path_env_country_inputs_forecast_dailydownloaded_era5, exist_ok=True)
+        if path is None:
+            path = os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, variable + ".zip")
+        lat = np.arange(7.0, 5.0, -0.1) - 0.05
+        lon = np.arange(-73.0, -71.0, 0.1) + 0.05
+        with ZipFile(path, 'w') as zObject:
+            for date in dates:
+                name = "Temperature-Air-2m-Max-24h_C3S-glob-agric_AgERA5_" + date.strftime('%Y%m%d') + "_final-v1.0.nc"
+                file = os.path.join(self.path_env_country, variable + "_" + name)
+                values = 280 + np.random.default_rng(date.day).random((1, len(lat), len(lon))) * 10
+                xds = xarray.DataArray(values.astype('float32'), dims=('time', 'lat', 'lon'), name='Temperature_Air_2m_Max_24h',
+                                       coords={'time': [pd.Timestamp(date)], 'lat': lat, 'lon': lon}).to_dataset()
+                xds['lat'].attrs = {'standard_name': 'latitude', 'axis': 'Y'}
+                xds['lon'].attrs = {'standard_name': 'longitude', 'axis': 'X'}
+                xds.to_netcdf(file)
+                zObject.write(file, name)
+                os.remove(file)
+
+    def test_extract_data_once(self):
+        # Rasters of CHIRP and two variables of ERA 5
+        dates = [self.start_date + timedelta(days=x) for x in range(4)]
+        self.create_rasters(self.path_env_country_inputs_forecast_dailydownloaded_chirp, dates)
+        for v in ["t_max", "t_min", "sol_rad"]:
+            dir_path = os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, v)
+            self.create_rasters(dir_path, dates)
+            for f in os.listdir(dir_path):
+                os.rename(os.path.join(dir_path, f), os.path.join(dir_path, "Temperature_AgERA5_" + f[6:16].replace('.', '') + "_final-v1.0.tif"))
+        locations = pd.concat([self.locations, pd.DataFrame({'ws': ['Location 3'], 'lat': [6.2], 'lon': [-72.2]})], ignore_index=True)
+
+        results = []
+        for cores in [1, 3]:
+            complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=cores)
+            complete_data.path_country_inputs_forecast_dailydownloaded = self.path_env_country_inputs_forecast_dailydownloaded
+            # Every raster is opened once for all stations, whatever the number of cores
+            with mock.patch('src.complete_data.rasterio.open', wraps=rasterio.open) as open_raster:
+                results.append(complete_data.extract_data(locations))
+                self.assertEqual(open_raster.call_count, 16)
+        pd.testing.assert_frame_equal(results[0], results[1])
+        self.assertEqual(results[0].shape, (12, 8))
+
+        # The table of all stations is the same of the stations extracted apart
+        by_station = pd.concat([complete_data.extract_data(locations.iloc[[i]]) for i in range(3)])
+        by_station = by_station.sort_values(['year', 'month', 'day', 'ws']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(results[0].sort_values(['year', 'month', 'day', 'ws']).reset_index(drop=True), by_station)
+
+        # The class can be sent to the processes which write the stations
+        self.assertEqual(pickle.loads(pickle.dumps(complete_data)).cores, 3)
+
+    def test_extract_era5_data_netcdf(self):
+        self.move_tests_files()
+        dates = [self.start_date + timedelta(days=x) for x in range(3)]
+        self.create_era5_zip(self.variable_era5, dates)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.prepare_env()
+        complete_data.raster_cube = None
+
+        # The zip is already downloaded, the NetCDF files are extracted and converted to rasters
+        complete_data.download_era5_data(variables=[self.variable_era5], test=True)
+        expected = complete_data.extract_values(os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, self.variable_era5),
+                                                self.variable_era5, self.locations, -23, -15, '%Y%m%d')
+
+        # The values read directly from the NetCDF files are the same of the rasters
+        extracted_data = complete_data.extract_era5_data(self.locations, variables=[self.variable_era5])
+        pd.testing.assert_frame_equal(extracted_data, expected)
+
+    def test_download_era5_data_convert_updated_files(self):
+        self.move_tests_files()
+        dates = [self.start_date + timedelta(days=x) for x in range(3)]
+        self.create_era5_zip(self.variable_era5, dates)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.prepare_env()
+        complete_data.download_era5_data(variables=[self.variable_era5], test=True)
+
+        path_tif = os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, self.variable_era5)
+        path_nc = os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, self.variable_era5 + "_tmp")
+        tif_files = sorted(glob.glob(os.path.join(path_tif, '*.tif')))
+        self.assertEqual(len(tif_files), 3)
+        mtimes = [os.path.getmtime(f) for f in tif_files]
+
+        # Only the raster of the NetCDF file changed is converted again
+        nc_file = sorted(glob.glob(os.path.join(path_nc, '*.nc')))[1]
+        os.utime(nc_file, (mtimes[1] + 10, mtimes[1] + 10))
+        complete_data.download_era5_data(variables=[self.variable_era5], test=True)
+        new_mtimes = [os.path.getmtime(f) for f in tif_files]
+        self.assertEqual(new_mtimes[0], mtimes[0])
+        self.assertNotEqual(new_mtimes[1], mtimes[1])
+        self.assertEqual(new_mtimes[2], mtimes[2])
+
+    def test_extract_era5_data_zip(self):
+        self.move_tests_files()
+        dates = [self.start_date + timedelta(days=x) for x in range(3)]
+        self.create_era5_zip(self.variable_era5, dates)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.prepare_env()
+
+        # The NetCDF files are converted and extracted from the zip, without the temporal folder
+        complete_data.download_era5_data(variables=[self.variable_era5], test=True, unzip=False)
+        self.assertFalse(os.path.exists(os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, self.variable_era5 + "_tmp")))
+        complete_data.raster_cube = None
+        expected = complete_data.extract_values(os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, self.variable_era5),
+                                                self.variable_era5, self.locations, -23, -15, '%Y%m%d')
+        self.assertEqual(expected.shape[0], 6)
+
+        extracted_data = complete_data.extract_era5_data(self.locations, variables=[self.variable_era5])
+        pd.testing.assert_frame_equal(extracted_data, expected)
+
+    def test_download_era5_data_without_conversion(self):
+        self.move_tests_files()
+        self.create_era5_zip(self.variable_era5, [self.start_date])
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.prepare_env()
+
+        complete_data.download_era5_data(variables=[self.variable_era5], test=True, convert=False)
+        self.assertEqual(len(glob.glob(os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, self.variable_era5 + "_tmp", '*.nc'))), 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_era5, self.variable_era5))), 0)
+
+    def test_download_era5_data_concurrent(self):
+        self.move_tests_files()
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.prepare_env()
+        complete_data.cds_limit = 2
+        variables = ["t_max", "t_min", "sol_rad"]
+        lock = threading.Lock()
+        calls = {"active": 0, "max": 0, "requests": []}
+
+        # Client of the CDS which waits in the queue and writes the zip of the request
+        class FakeClient():
+            def retrieve(client, name, request, target):
+                with lock:
+                    calls["active"] += 1
+                    calls["max"] = max(calls["max"], calls["active"])
+                    calls["requests"].append(request["statistic"])
+                time.sleep(0.2)
+                with lock:
+                    calls["active"] -= 1
+                if request["variable"] == "solar_radiation_flux":
+                    raise Exception("Request failed")
+                # The library of NetCDF is not thread safe
+                with lock:
+                    self.create_era5_zip(os.path.basename(target).split(".")[0], [self.start_date], path=target)
+        complete_data.cds_client = FakeClient
+
+        # The variables are requested at the same time up to the limit, the failed variable is reported after the others
+        with self.assertRaises(RuntimeError):
+            complete_data.download_era5_data(variables=variables, test=True, convert=False, unzip=False)
+        self.assertEqual(calls["max"], 2)
+        self.assertEqual(len(calls["requests"]), 3)
+        self.assertEqual(complete_data.era5_status["t_max"], "downloaded")
+        self.assertEqual(complete_data.era5_status["t_min"], "downloaded")
+        self.assertTrue(complete_data.era5_status["sol_rad"].startswith("failed"))
+        self.assertEqual(sorted(os.listdir(self.path_env_country_inputs_forecast_dailydownloaded_era5)), ["t_max", "t_max.zip", "t_min", "t_min.zip"])
+
+        # Only the failed variable is requested again
+        complete_data.download_era5_data(variables=variables[:2], test=True, convert=False, unzip=False)
+        self.assertEqual(len(calls["requests"]), 3)
+        self.assertEqual(complete_data.era5_status, {"t_max": "already downloaded", "t_min": "already downloaded"})
+
+    def compress_rasters(self, dir_path):
+        for f in glob.glob(os.path.join(dir_path, '*.tif')):
+            with open(f, 'rb') as f_in, gzip.open(f + '.gz', 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(f)
+
+    def test_extract_values_compressed(self):
+        dir_path = os.path.join(self.path_env_country, 'rasters')
+        dates = [self.start_date + timedelta(days=x) for x in range(3)]
+        self.create_rasters(dir_path, dates)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        expected = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+
+        # The compressed rasters are read in place with the same values
+        self.compress_rasters(dir_path)
+        extracted_data = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+        pd.testing.assert_frame_equal(extracted_data, expected)
+
+        complete_data.raster_cube = RasterCube(os.path.join(self.path_env_country, 'cube'))
+        extracted_data = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+        pd.testing.assert_frame_equal(extracted_data, expected)
+
+    def test_crop_rasters(self):
+        dir_path = os.path.join(self.path_env_country, 'rasters')
+        dates = [self.start_date + timedelta(days=x) for x in range(3)]
+        self.create_rasters(dir_path, dates)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.cube_buffer = 0.2
+        expected = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+        self.compress_rasters(dir_path)
+
+        # The rasters are decompressed, cropped to the stations and keep their values
+        bounds = complete_data.stations_bounds(self.locations)
+        self.assertEqual(len(complete_data.crop_rasters(dir_path, bounds)), 3)
+        self.assertEqual(sorted(glob.glob(os.path.join(dir_path, '*.gz'))), [])
+        with rasterio.open(glob.glob(os.path.join(dir_path, '*.tif'))[0]) as src:
+            self.assertLess(src.width * src.height, 60 * 50)
+            self.assertLessEqual(src.bounds.left, bounds[0])
+            self.assertGreaterEqual(src.bounds.top, bounds[3])
+            self.assertEqual(src.profile['compress'], 'deflate')
+            self.assertIn('crop_bounds', src.tags())
+        extracted_data = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+        pd.testing.assert_frame_equal(extracted_data, expected)
+
+        # The cropped rasters are skipped, a larger extent fails
+        mtimes = [os.stat(f).st_mtime_ns for f in glob.glob(os.path.join(dir_path, '*.tif'))]
+        complete_data.crop_rasters(dir_path, bounds)
+        self.assertEqual([os.stat(f).st_mtime_ns for f in glob.glob(os.path.join(dir_path, '*.tif'))], mtimes)
+        with self.assertRaises(ValueError):
+            complete_data.crop_rasters(dir_path, [bounds[0] - 1] + bounds[1:])
+
+    def start_server(self, dir_path):
+        # A local http server with the files of a folder
+        server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(SimpleHTTPRequestHandler, directory=dir_path))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return 'http://127.0.0.1:' + str(server.server_address[1])
+
+    def test_download_file_compressed(self):
+        # A local file as the server
+        dir_path = os.path.join(self.path_env_country, 'server')
+        self.create_rasters(dir_path, [self.start_date])
+        self.compress_rasters(dir_path)
+        url = self.start_server(dir_path) + '/' + self.chirps_url_name
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+
+        # The file is kept compressed
+        complete_data.download_file(url, self.chirps_file_path_compressed, force=False, remove=False)
+        self.assertTrue(os.path.exists(self.chirps_file_path_compressed))
+        self.assertFalse(os.path.exists(self.chirps_file_path))
+
+        # The file is decompressed and the compressed file is removed
+        complete_data.download_file(url, self.chirps_file_path_compressed, force=True, remove=True)
+        self.assertFalse(os.path.exists(self.chirps_file_path_compressed))
+        with gzip.open(os.path.join(dir_path, self.chirps_url_name), 'rb') as f:
+            with open(self.chirps_file_path, 'rb') as f_out:
+                self.assertEqual(f.read(), f_out.read())
+
+    def test_download_file_checksum(self):
+        dir_path = os.path.join(self.path_env_country, 'server')
+        self.create_rasters(dir_path, [self.start_date])
+        self.compress_rasters(dir_path)
+        url = self.start_server(dir_path) + '/' + self.chirps_url_name
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.downloader.backoff = 0
+        complete_data.download_cache = DownloadCache(os.path.join(self.path_env, 'download_cache'))
+        with open(os.path.join(dir_path, self.chirps_url_name), 'rb') as f:
+            content = f.read()
+
+        # A file which is not the expected one is neither saved nor cached
+        with self.assertRaises(ValueError):
+            complete_data.download_file(url, self.chirps_file_path_compressed, remove=False, checksum='md5:' + '0' * 32)
+        self.assertFalse(os.path.exists(self.chirps_file_path_compressed))
+        self.assertFalse(os.path.exists(complete_data.download_cache.entry(complete_data.cache_key(url))))
+
+        complete_data.download_file(url, self.chirps_file_path_compressed, remove=False, size=len(content),
+                                    checksum='sha256:' + hashlib.sha256(content).hexdigest())
+        self.assertTrue(os.path.exists(self.chirps_file_path_compressed))
+
+    def test_download_file_cache(self):
+        dir_path = os.path.join(self.path_env_country, 'server')
+        self.create_rasters(dir_path, [self.start_date])
+        self.compress_rasters(dir_path)
+        url = self.start_server(dir_path) + '/' + self.chirps_url_name
+        cache = DownloadCache(os.path.join(self.path_env, 'download_cache'))
+
+        # The first country downloads the file in the cache
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.download_cache = cache
+        complete_data.download_file(url, self.chirps_file_path_compressed, force=False, remove=True)
+        self.assertTrue(os.path.exists(self.chirps_file_path))
+        self.assertTrue(os.path.exists(cache.entry(complete_data.cache_key(url))))
+
+        # Other country takes it from the cache without the server
+        os.remove(os.path.join(dir_path, self.chirps_url_name))
+        other_path = os.path.join(self.path_env, 'COLOMBIA', self.chirps_url_name)
+        os.makedirs(os.path.dirname(other_path))
+        other = CompleteData(start_date=self.start_date, country='COLOMBIA', path=self.path_env, cores=self.cores)
+        other.download_cache = cache
+        other.download_file(url, other_path, force=False, remove=False)
+        self.assertTrue(os.path.samefile(other_path, cache.entry(other.cache_key(url))))
+
+    def test_download_extract_chirp(self):
+        # A local server with the compressed rasters of the month
+        dir_path = os.path.join(self.path_env_country, 'server', str(self.start_date.year))
+        dates = [self.start_date + timedelta(days=x) for x in range(31)]
+        self.create_rasters(dir_path, dates)
+        self.compress_rasters(dir_path)
+        os.remove(os.path.join(dir_path, 'chirp.' + dates[-1].strftime('%Y.%m.%d') + '.tif.gz'))
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=3)
+        complete_data.path_country_inputs_forecast_dailydownloaded = self.path_env_country_inputs_forecast_dailydownloaded
+        os.makedirs(complete_data.path_country_inputs_forecast_dailydownloaded, exist_ok=True)
+        complete_data.chirp_url = self.start_server(os.path.dirname(dir_path))
+
+        # Every file is extracted after its download, the file of the next month is not downloaded
+        extracted_data = complete_data.download_extract_chirp(self.locations, compressed=True)
+        self.assertEqual(len(glob.glob(os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_chirp, '*.tif.gz'))), 30)
+        expected = complete_data.extract_chirp_data(self.locations)
+        pd.testing.assert_frame_equal(extracted_data, expected)
+        self.assertEqual(extracted_data.shape[0], 30 * self.locations.shape[0])
+
+        # A missing day fails the extraction, the month would have days without data
+        shutil.rmtree(self.path_env_country_inputs_forecast_dailydownloaded_chirp)
+        os.remove(os.path.join(dir_path, 'chirp.' + dates[5].strftime('%Y.%m.%d') + '.tif.gz'))
+        with self.assertRaises(RuntimeError):
+            complete_data.download_extract_chirp(self.locations, compressed=True)
+        self.assertEqual(len(glob.glob(os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_chirp, '*.tif.gz'))), 29)
+
+    def test_download_extract_chirp_crop(self):
+        dir_path = os.path.join(self.path_env_country, 'server', str(self.start_date.year))
+        dates = [self.start_date + timedelta(days=x) for x in range(30)]
+        self.create_rasters(dir_path, dates)
+        self.compress_rasters(dir_path)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=3)
+        complete_data.path_country_inputs_forecast_dailydownloaded = self.path_env_country_inputs_forecast_dailydownloaded
+        os.makedirs(complete_data.path_country_inputs_forecast_dailydownloaded, exist_ok=True)
+        complete_data.chirp_url = self.start_server(os.path.dirname(dir_path))
+        complete_data.download_cache = DownloadCache(os.path.join(self.path_env, 'download_cache'))
+        complete_data.cube_buffer = 0.2
+        expected = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+
+        # Every file is cropped to the stations before its extraction
+        bounds = complete_data.stations_bounds(self.locations)
+        extracted_data = complete_data.download_extract_chirp(self.locations, compressed=True, bounds=bounds)
+        pd.testing.assert_frame_equal(extracted_data, expected)
+        files = glob.glob(os.path.join(self.path_env_country_inputs_forecast_dailydownloaded_chirp, '*.tif'))
+        self.assertEqual(len(files), 30)
+        with rasterio.open(files[0]) as src:
+            self.assertLess(src.width * src.height, 60 * 50)
+
+        # A station out of the crop gets the global file again from the cache
+        locations = pd.concat([self.locations, pd.DataFrame({'ws': ['Location 3'], 'lat': [5.0], 'lon': [-72.9]})], ignore_index=True)
+        shutil.rmtree(dir_path)
+        extracted_data = complete_data.download_extract_chirp(locations, compressed=True, bounds=complete_data.stations_bounds(locations))
+        self.assertFalse(extracted_data['prec'].isna().any())
+        np.testing.assert_array_equal(extracted_data.loc[extracted_data['ws'] != 'Location 3', 'prec'], expected['prec'])
+
+    def test_extract_values_columnar(self):
+        dir_path = os.path.join(self.path_env_country, 'rasters')
+        dates = [self.start_date + timedelta(days=x) for x in range(3)]
+        transform = self.create_rasters(dir_path, dates)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+
+        extracted_data = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+
+        # One row by file and location, in the order of the files and the locations
+        self.assertEqual(list(extracted_data.columns), ['ws', 'day', 'month', 'year', 'prec'])
+        self.assertEqual(list(extracted_data['ws']), ['Location 1', 'Location 2'] * 3)
+        self.assertEqual(list(extracted_data['day']), [1, 1, 2, 2, 3, 3])
+        for i, location in self.locations.iterrows():
+            row, col = rasterio.transform.rowcol(transform, location['lon'], location['lat'])
+            self.assertEqual(extracted_data.loc[i + 2, 'prec'], row * 1000 + col + 2)
+
+    def test_extract_values_cube(self):
+        dir_path = os.path.join(self.path_env_country, 'rasters')
+        dates = [self.start_date + timedelta(days=x) for x in range(3)]
+        self.create_rasters(dir_path, dates)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        expected = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+
+        # The values from the monthly cube are the same of the rasters
+        complete_data.raster_cube = RasterCube(os.path.join(self.path_env_country, 'cube'))
+        extracted_data = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+        pd.testing.assert_frame_equal(extracted_data, expected)
+
+        # A new station close to the others is extracted from the same cube
+        locations = pd.concat([self.locations, pd.DataFrame({'ws': ['Location 3'], 'lat': [6.2], 'lon': [-72.2]})], ignore_index=True)
+        with mock.patch('src.raster_cube.rasterio.open') as open_raster:
+            extracted_data = complete_data.extract_values(dir_path, 'prec', locations, -14, -4, '%Y.%m.%d')
+            open_raster.assert_not_called()
+        self.assertEqual(extracted_data.shape[0], 9)
+
+    def test_extract_values_cube_missing_coordinates(self):
+        dir_path = os.path.join(self.path_env_country, 'rasters')
+        dates = [self.start_date + timedelta(days=x) for x in range(3)]
+        self.create_rasters(dir_path, dates)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.raster_cube = RasterCube(os.path.join(self.path_env_country, 'cube'))
+        expected = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+
+        # A station without coordinates does not change the extent of the cube of the others
+        locations = pd.concat([self.locations, pd.DataFrame({'ws': ['Location 3'], 'lat': [np.nan], 'lon': [np.nan]})], ignore_index=True)
+        extracted_data = complete_data.extract_values(dir_path, 'prec', locations, -14, -4, '%Y.%m.%d')
+        self.assertTrue(extracted_data.loc[extracted_data['ws'] == 'Location 3', 'prec'].isna().all())
+        np.testing.assert_array_equal(extracted_data.loc[extracted_data['ws'] != 'Location 3', 'prec'], expected['prec'])
+        self.assertIsNotNone(complete_data.raster_cube.lookup(dir_path, [os.path.join(dir_path, f) for f in sorted(os.listdir(dir_path))],
+                                                              complete_data.stations_bounds(locations)))
+
+    def test_extract_values_outside(self):
+        dir_path = os.path.join(self.path_env_country, 'rasters')
+        dates = [self.start_date + timedelta(days=x) for x in range(3)]
+        self.create_rasters(dir_path, dates)
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        expected = complete_data.extract_values(dir_path, 'prec', self.locations, -14, -4, '%Y.%m.%d')
+
+        # A station out of the rasters has no data, with and without the monthly cube
+        locations = pd.concat([self.locations, pd.DataFrame({'ws': ['Location 3'], 'lat': [6.2], 'lon': [-75.0]})], ignore_index=True)
+        for cube in [None, RasterCube(os.path.join(self.path_env_country, 'cube'))]:
+            complete_data.raster_cube = cube
+            extracted_data = complete_data.extract_values(dir_path, 'prec', locations, -14, -4, '%Y.%m.%d')
+            self.assertTrue(extracted_data.loc[extracted_data['ws'] == 'Location 3', 'prec'].isna().all())
+            np.testing.assert_array_equal(extracted_data.loc[extracted_data['ws'] != 'Location 3', 'prec'], expected['prec'])
+
     def test_extract_values_single_location_chirp(self):
         self.move_tests_files()
         variable = 'prec'
@@ -302,11 +749,11 @@ class TestCompleteData(unittest.TestCase):
         # Check if the extracted data is correct
         expected_data = [{'ws': 'Test Location', 'day': 1, 'month': 6, 'year': 2023, variable: 20.493248}]
 
-        self.assertEqual(extracted_data[0]['ws'], expected_data[0]['ws'])
-        self.assertEqual(extracted_data[0]['day'], expected_data[0]['day'])
-        self.assertEqual(extracted_data[0]['month'], expected_data[0]['month'])
-        self.assertEqual(extracted_data[0]['year'], expected_data[0]['year'])
-        self.assertEqual(int(extracted_data[0][variable]),int(expected_data[0][variable]))
+        self.assertEqual(extracted_data.loc[0,'ws'], expected_data[0]['ws'])
+        self.assertEqual(extracted_data.loc[0,'day'], expected_data[0]['day'])
+        self.assertEqual(extracted_data.loc[0,'month'], expected_data[0]['month'])
+        self.assertEqual(extracted_data.loc[0,'year'], expected_data[0]['year'])
+        self.assertEqual(int(extracted_data.loc[0,variable]),int(expected_data[0][variable]))
 
     def test_extract_values_multiple_locations_chirp(self):
         self.move_tests_files()
@@ -327,11 +774,11 @@ class TestCompleteData(unittest.TestCase):
             {'ws': 'Location 2', 'day': 1, 'month': 6, 'year': 2023, variable: 11.695796}
         ]
         for i in [0,1]:
-            self.assertEqual(extracted_data[i]['ws'], expected_data[i]['ws'])
-            self.assertEqual(extracted_data[i]['day'], expected_data[i]['day'])
-            self.assertEqual(extracted_data[i]['month'], expected_data[i]['month'])
-            self.assertEqual(extracted_data[i]['year'], expected_data[i]['year'])
-            self.assertEqual(int(extracted_data[i][variable]),int(expected_data[i][variable]))
+            self.assertEqual(extracted_data.loc[i,'ws'], expected_data[i]['ws'])
+            self.assertEqual(extracted_data.loc[i,'day'], expected_data[i]['day'])
+            self.assertEqual(extracted_data.loc[i,'month'], expected_data[i]['month'])
+            self.assertEqual(extracted_data.loc[i,'year'], expected_data[i]['year'])
+            self.assertEqual(int(extracted_data.loc[i,variable]),int(expected_data[i][variable]))
     
     def test_extract_values_single_file_single_location_era5(self):
         self.move_tests_files()
@@ -349,11 +796,11 @@ class TestCompleteData(unittest.TestCase):
         # Check if the extracted data is correct
         expected_data = []
         expected_data.append({'ws': 'Test Location', 'day': 1, 'month': 6, 'year': 2023, variable: 20.708344})
-        self.assertEqual(extracted_data[0]['ws'], expected_data[0]['ws'])
-        self.assertEqual(extracted_data[0]['day'], expected_data[0]['day'])
-        self.assertEqual(extracted_data[0]['month'], expected_data[0]['month'])
-        self.assertEqual(extracted_data[0]['year'], expected_data[0]['year'])
-        self.assertEqual(int(extracted_data[0][variable]),int(expected_data[0][variable]))
+        self.assertEqual(extracted_data.loc[0,'ws'], expected_data[0]['ws'])
+        self.assertEqual(extracted_data.loc[0,'day'], expected_data[0]['day'])
+        self.assertEqual(extracted_data.loc[0,'month'], expected_data[0]['month'])
+        self.assertEqual(extracted_data.loc[0,'year'], expected_data[0]['year'])
+        self.assertEqual(int(extracted_data.loc[0,variable]),int(expected_data[0][variable]))
 
     def test_extract_values_multiple_files_multiple_locations_era5(self):
         self.move_tests_files()
@@ -374,11 +821,11 @@ class TestCompleteData(unittest.TestCase):
             {'ws': 'Location 2', 'day': 1, 'month': 6, 'year': 2023, variable: 25.889648}
         ]
         for i in [0,1]:
-            self.assertEqual(extracted_data[i]['ws'], expected_data[i]['ws'])
-            self.assertEqual(extracted_data[i]['day'], expected_data[i]['day'])
-            self.assertEqual(extracted_data[i]['month'], expected_data[i]['month'])
-            self.assertEqual(extracted_data[i]['year'], expected_data[i]['year'])
-            self.assertEqual(int(extracted_data[i][variable]),int(expected_data[i][variable]))
+            self.assertEqual(extracted_data.loc[i,'ws'], expected_data[i]['ws'])
+            self.assertEqual(extracted_data.loc[i,'day'], expected_data[i]['day'])
+            self.assertEqual(extracted_data.loc[i,'month'], expected_data[i]['month'])
+            self.assertEqual(extracted_data.loc[i,'year'], expected_data[i]['year'])
+            self.assertEqual(int(extracted_data.loc[i,variable]),int(expected_data[i][variable]))
     
     # =-=-=-=-=-=-=-=-=-
     # TEST EXTRACT CHIRP
@@ -521,6 +968,55 @@ class TestCompleteData(unittest.TestCase):
 
         self.assertEqual(df_ws.shape, expected_data.shape)
     
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+    # TEST WRITE OUTPUTS
+    # =-=-=-=-=-=-=-=-=-=-=-=-=-
+
+    def test_write_outputs_bundle(self):
+        self.move_tests_files()
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.prepare_env()
+
+        # Bundle with two escenaries of June and July 2023
+        ws = '5e91e1c214daf81260ebba59'
+        dates = pd.date_range("2023-06-01", "2023-07-31", freq="D")
+        bundle_file = os.path.join(self.path_env_country_outputs_resampling, ws, 'escenarios.nc')
+        ScenarioBundle(np.zeros((2, len(dates), 4)), dates.day, dates.month, dates.year, ['t_max', 't_min', 'prec', 'sol_rad'], ws).write(bundle_file)
+
+        locations = pd.DataFrame({'ws': [ws], 'lat': [12.79], 'lon': [39.65]})
+        data = pd.DataFrame({'ws': ws, 'day': range(1, 31), 'month': 6, 'year': 2023, 'prec': 5.0, 't_max': 30.0, 't_min': 15.0, 'sol_rad': 20.0})
+        complete_data.write_outputs(locations, data, data.iloc[0:0])
+
+        # June is replaced in all escenaries with the data extracted
+        bundle = ScenarioBundle.read(bundle_file)
+        self.assertEqual(bundle.values.shape, (2, 61, 4))
+        self.assertTrue((bundle.values[:, bundle.months == 6, bundle.variables.index('prec')] == 5.0).all())
+        self.assertTrue((bundle.values[:, bundle.months == 7, :] == 0).all())
+
+    def test_write_outputs_index(self):
+        self.move_tests_files()
+        complete_data = CompleteData(start_date=self.start_date, country=self.country, path=self.path_env, cores=self.cores)
+        complete_data.prepare_env()
+
+        # Station with an index of escenaries, a summary and one escenary
+        ws = '5e91e1c214daf81260ebba59'
+        ws_path = os.path.join(self.path_env_country_outputs_resampling, ws)
+        os.makedirs(os.path.join(ws_path, 'summary'), exist_ok=True)
+        index = pd.DataFrame({'id': [0, 1], 'Season': 'Jun-Jul-Aug', 'Start': 6, 'End': 8, 'year': 2023, 'leap': False, 'analog_year': [1990, 2001]})
+        index.to_csv(os.path.join(ws_path, 'escenarios_index.csv'), index=False)
+        with open(os.path.join(ws_path, 'escenarios_index.json'), 'w') as f:
+            f.write('{"station": "' + ws + '"}')
+        pd.DataFrame({'day': [1, 1], 'month': [6, 7], 'year': 2023, 'prec': 0.0, 't_max': 0.0, 't_min': 0.0, 'sol_rad': 0.0}).to_csv(os.path.join(ws_path, 'escenario_0.csv'), index=False)
+
+        locations = pd.DataFrame({'ws': [ws], 'lat': [12.79], 'lon': [39.65]})
+        data = pd.DataFrame({'ws': ws, 'day': [1], 'month': 6, 'year': 2023, 'prec': 5.0, 't_max': 30.0, 't_min': 15.0, 'sol_rad': 20.0})
+        complete_data.write_outputs(locations, data, data.iloc[0:0])
+
+        # The index is kept and the escenary gets the observed month
+        pd.testing.assert_frame_equal(pd.read_csv(os.path.join(ws_path, 'escenarios_index.csv')), index)
+        escenario = pd.read_csv(os.path.join(ws_path, 'escenario_0.csv'))
+        self.assertEqual(list(escenario['prec']), [5.0, 0.0])
+
     # =-=-=-=-=-=-=-=-=-=-=-=-=-
     # TEST EXTRACT CLIMATOLOGY
     # =-=-=-=-=-=-=-=-=-=-=-=-=-
@@ -0,0 +1,103 @@
+import sys
+import os
+import shutil
+import time
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from src.download_cache import DownloadCache, locked
+
+class TestDownloadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(os.path.dirname(__file__), 'tmp_download_cache')
+        self.cache = DownloadCache(os.path.join(self.path, 'cache'), max_size=2500)
+        self.countries = [os.path.join(self.path, c) for c in ['ETHIOPIA', 'COLOMBIA']]
+        for c in self.countries:
+            os.makedirs(c, exist_ok=True)
+        self.downloads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def download(self, content):
+        def download(path):
+            self.downloads.append(path)
+            time.sleep(0.05)
+            with open(path, 'wb') as f:
+                f.write(content)
+        return download
+
+    def test_fetch(self):
+        key = ['chirp', '2.0', '2023', 'chirp.2023.06.01.tif.gz']
+        targets = [os.path.join(c, 'chirp.2023.06.01.tif.gz') for c in self.countries]
+
+        # The second country takes the file from the cache
+        self.assertTrue(self.cache.fetch(key, targets[0], self.download(b'a' * 1000)))
+        self.assertFalse(self.cache.fetch(key, targets[1], self.download(b'b' * 1000)))
+        self.assertEqual(len(self.downloads), 1)
+        for target in targets:
+            with open(target, 'rb') as f:
+                self.assertEqual(f.read(), b'a' * 1000)
+        self.assertTrue(os.path.samefile(targets[0], self.cache.entry(key)))
+
+        # The file is downloaded again with force
+        self.assertTrue(self.cache.fetch(key, targets[1], self.download(b'b' * 1000), force=True))
+        with open(targets[1], 'rb') as f:
+            self.assertEqual(f.read(), b'b' * 1000)
+        with open(targets[0], 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 1000)
+
+    def test_fetch_concurrent(self):
+        # Many runs ask for the same file at the same time, it is downloaded once
+        key = ['era5', 't_max.zip']
+        targets = [os.path.join(self.countries[i % 2], 't_max_' + str(i) + '.zip') for i in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            downloaded = list(executor.map(lambda t: self.cache.fetch(key, t, self.download(b'c' * 100)), targets))
+
+        self.assertEqual(sum(downloaded), 1)
+        self.assertEqual(len(self.downloads), 1)
+        for target in targets:
+            self.assertEqual(os.path.getsize(target), 100)
+        self.assertFalse(any(f.endswith('.lock') for f in os.listdir(os.path.dirname(self.cache.entry(key)))))
+
+    def test_evict(self):
+        keys = [['chirp', str(i)] for i in range(3)]
+        for i, key in enumerate(keys[:2]):
+            self.cache.fetch(key, os.path.join(self.countries[0], str(i)), self.download(b'd' * 1000))
+            time.sleep(0.05)
+        # The first file is used again, so the second one is the least recently used
+        self.cache.fetch(keys[0], os.path.join(self.countries[1], '0'), self.download(b'd' * 1000))
+        time.sleep(0.05)
+        self.cache.fetch(keys[2], os.path.join(self.countries[0], '2'), self.download(b'd' * 1000))
+
+        self.assertTrue(os.path.exists(self.cache.entry(keys[0])))
+        self.assertFalse(os.path.exists(self.cache.entry(keys[1])))
+        self.assertTrue(os.path.exists(self.cache.entry(keys[2])))
+        # The files of the countries are kept
+        self.assertEqual(os.path.getsize(os.path.join(self.countries[0], '1')), 1000)
+        self.assertLessEqual(sum(f[1] for f in self.cache.files()), self.cache.max_size)
+
+    def test_locked(self):
+        lock = os.path.join(self.path, 'file.lock')
+        with locked(lock):
+            with self.assertRaises(TimeoutError):
+                with locked(lock, timeout=0.2):
+                    pass
+        self.assertFalse(os.path.exists(lock))
+
+        # A lock left by a process which died is taken after it is stale
+        open(lock, 'w').close()
+        os.utime(lock, (time.time() - 100, time.time() - 100))
+        with locked(lock, timeout=0, stale=10):
+            self.assertTrue(os.path.exists(lock))
+
+    def test_invalid_key(self):
+        with self.assertRaises(ValueError):
+            self.cache.entry(['chirp', '..', 'file'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+import shutil
+import hashlib
+import pickle
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from src.downloader import Downloader
+
+DATA = bytes(range(256)) * 4000
+
+class ServerHandler(BaseHTTPRequestHandler):
+    # Requests received by path, with their Range header
+    requests = []
+    # Number of times a path fails before it works
+    failures = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        ServerHandler.requests.append((self.path, self.headers.get('Range')))
+        if self.path == '/missing.bin':
+            self.send_error(404)
+            return
+        if ServerHandler.failures.get(self.path, 0) > 0:
+            ServerHandler.failures[self.path] -= 1
+            if self.path == '/busy.bin':
+                self.send_error(503)
+                return
+
+        start = 0
+        if self.headers.get('Range') is not None:
+            start = int(self.headers.get('Range').replace('bytes=', '').split('-')[0])
+            if start >= len(DATA):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes ' + str(start) + '-' + str(len(DATA) - 1) + '/' + str(len(DATA)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(DATA) - start))
+        self.end_headers()
+
+        # A flaky connection which is closed in the middle of the file
+        if self.path == '/flaky.bin' and start == 0:
+            self.wfile.write(DATA[:len(DATA) // 3])
+            self.close_connection = True
+            return
+        self.wfile.write(DATA[start:])
+
+class TestDownloader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ServerHandler)
+        cls.url = 'http://127.0.0.1:' + str(cls.server.server_address[1])
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.path = os.path.join(os.path.dirname(__file__), 'tmp_downloader')
+        os.makedirs(self.path, exist_ok=True)
+        ServerHandler.requests = []
+        ServerHandler.failures = {}
+        self.downloader = Downloader(workers=3, retries=3, backoff=0, timeout=10, chunk_size=4096)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_fetch(self):
+        path = os.path.join(self.path, 'file.bin')
+        checksum = 'sha256:' + hashlib.sha256(DATA).hexdigest()
+        self.downloader.fetch(self.url + '/file.bin', path, size=len(DATA), checksum=checksum)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertFalse(os.path.exists(path + '.part'))
+
+    def test_fetch_resume(self):
+        # The connection is closed in the middle and the next attempt asks for the rest of the file
+        path = os.path.join(self.path, 'flaky.bin')
+        self.downloader.fetch(self.url + '/flaky.bin', path)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertEqual(len(ServerHandler.requests), 2)
+        self.assertIsNone(ServerHandler.requests[0][1])
+        self.assertGreater(int(ServerHandler.requests[1][1].replace('bytes=', '').split('-')[0]), 0)
+
+    def test_fetch_complete_part(self):
+        # A partial file of a previous run which was already complete
+        path = os.path.join(self.path, 'file.bin')
+        with open(path + '.part', 'wb') as f:
+            f.write(DATA)
+        self.downloader.fetch(self.url + '/file.bin', path)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertEqual(len(ServerHandler.requests), 1)
+
+    def test_fetch_retries(self):
+        path = os.path.join(self.path, 'busy.bin')
+        ServerHandler.failures['/busy.bin'] = 2
+        self.downloader.fetch(self.url + '/busy.bin', path)
+        self.assertEqual(len(ServerHandler.requests), 3)
+
+        # The errors of the client are not tried again
+        with self.assertRaises(requests.HTTPError):
+            self.downloader.fetch(self.url + '/missing.bin', os.path.join(self.path, 'missing.bin'))
+        self.assertEqual(len(ServerHandler.requests), 4)
+
+        # All attempts failed
+        ServerHandler.failures['/busy.bin'] = 10
+        with self.assertRaises(requests.HTTPError):
+            self.downloader.fetch(self.url + '/busy.bin', os.path.join(self.path, 'busy_2.bin'))
+        self.assertEqual(len(ServerHandler.requests), 8)
+
+    def test_fetch_invalid(self):
+        path = os.path.join(self.path, 'file.bin')
+        with self.assertRaises(ValueError):
+            self.downloader.fetch(self.url + '/file.bin', path, checksum='md5:' + '0' * 32)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + '.part'))
+        self.assertEqual(len(ServerHandler.requests), 4)
+
+    def test_pickle(self):
+        downloader = pickle.loads(pickle.dumps(self.downloader))
+        self.assertEqual(downloader.workers, 3)
+        downloader.fetch(self.url + '/file.bin', os.path.join(self.path, 'file.bin'))
+
+if __name__ == "__main__":
+    unittest.main()
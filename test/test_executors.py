@@ -0,0 +1,28 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from src.executors import Executor, BACKENDS
+
+def square(x):
+    return x * x
+
+class TestExecutor(unittest.TestCase):
+
+    def test_same_results_all_backends(self):
+        items = list(range(23))
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                self.assertEqual(Executor(backend, workers=3).map(square, items), [x * x for x in items])
+
+    def test_empty_items(self):
+        self.assertEqual(Executor("thread", workers=2).map(square, []), [])
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            Executor("mpi")
+
+if __name__ == "__main__":
+    unittest.main()
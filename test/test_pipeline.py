@@ -0,0 +1,53 @@
+import sys
+import os
+import time
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from src.pipeline import Pipeline
+
+class TestPipeline(unittest.TestCase):
+
+    def test_run_order(self):
+        pipeline = Pipeline(producers=4, consumers=2, size=2)
+        # The items end in any order, the results keep the order of the items
+        results = pipeline.run(range(20), lambda x: time.sleep((20 - x) * 0.001) or x * 2, lambda x, y: y + x)
+        self.assertEqual(results, [x * 3 for x in range(20)])
+
+    def test_run_errors(self):
+        def produce(x):
+            if x == 1:
+                raise IOError("download")
+            return x
+
+        def consume(x, y):
+            if x == 2:
+                raise ValueError("extract")
+            return y
+
+        results = Pipeline(producers=2, consumers=2).run(range(4), produce, consume)
+        self.assertEqual(results[0], 0)
+        self.assertIsInstance(results[1], IOError)
+        self.assertIsInstance(results[2], ValueError)
+        self.assertEqual(results[3], 3)
+
+    def test_run_overlap(self):
+        # The last item is produced only after the first one was consumed
+        consumed = threading.Event()
+
+        def produce(x):
+            if x == 3:
+                self.assertTrue(consumed.wait(timeout=5))
+            return x
+
+        def consume(x, y):
+            consumed.set()
+            return y
+
+        results = Pipeline(producers=1, consumers=1).run(range(4), produce, consume)
+        self.assertEqual(results, [0, 1, 2, 3])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import sys
+import os
+import shutil
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.crs import CRS
+from src.pixel_index import PixelIndex
+
+class TestPixelIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.path_env = os.path.abspath(os.path.join(os.path.dirname(__file__), 'test_files_pixel_index'))
+        self.transform = rasterio.transform.from_origin(-73.0, 7.0, 0.05, 0.05)
+        self.shape = (50, 60)
+        self.crs = CRS.from_epsg(4326)
+        # The first two locations are in the same pixel
+        self.locations = pd.DataFrame({'ws': ['a', 'b', 'c'], 'lat': [6.41, 6.42, 6.38], 'lon': [-72.02, -72.01, -71.87]})
+
+    def tearDown(self):
+        if os.path.exists(self.path_env):
+            shutil.rmtree(self.path_env)
+
+    def test_lookup_deduplicates(self):
+        rows, cols, inverse = PixelIndex().lookup(self.transform, self.shape, self.crs, self.locations)
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(inverse[0], inverse[1])
+        for i, location in self.locations.iterrows():
+            self.assertEqual((rows[inverse[i]], cols[inverse[i]]), rasterio.transform.rowcol(self.transform, location['lon'], location['lat']))
+
+    def test_lookup_persisted(self):
+        expected = PixelIndex(self.path_env).lookup(self.transform, self.shape, self.crs, self.locations)
+        self.assertEqual(len(os.listdir(self.path_env)), 1)
+
+        # Other run reads the index without computing the pixels again
+        with mock.patch('src.pixel_index.rasterio.transform.rowcol') as rowcol:
+            result = PixelIndex(self.path_env).lookup(self.transform, self.shape, self.crs, self.locations)
+            rowcol.assert_not_called()
+        for e, r in zip(expected, result):
+            np.testing.assert_array_equal(e, r)
+
+    def test_lookup_changed_locations(self):
+        index = PixelIndex(self.path_env)
+        index.lookup(self.transform, self.shape, self.crs, self.locations)
+        rows, cols, inverse = index.lookup(self.transform, self.shape, self.crs, self.locations.iloc[[2]])
+
+        self.assertEqual(len(inverse), 1)
+        self.assertEqual((rows[0], cols[0]), rasterio.transform.rowcol(self.transform, -71.87, 6.38))
+
+    def test_lookup_station_sets(self):
+        index = PixelIndex(self.path_env)
+        index.lookup(self.transform, self.shape, self.crs, self.locations)
+        index.lookup(self.transform, self.shape, self.crs, self.locations.iloc[[2]])
+        # Every set of stations keeps its own index in the same grid
+        self.assertEqual(len(os.listdir(self.path_env)), 2)
+
+        # Runs which alternate the sets of stations do not build the indexes again
+        with mock.patch('src.pixel_index.rasterio.transform.rowcol') as rowcol:
+            for locations in [self.locations, self.locations.iloc[[2]]]:
+                PixelIndex(self.path_env).lookup(self.transform, self.shape, self.crs, locations)
+                index.lookup(self.transform, self.shape, self.crs, locations)
+            rowcol.assert_not_called()
+
+    def create_raster(self, **kwargs):
+        # Raster of 512 x 512 pixels in blocks of 128 x 128
+        os.makedirs(self.path_env, exist_ok=True)
+        file = os.path.join(self.path_env, 'raster.tif')
+        data = np.random.default_rng(1).random((512, 512)).astype('float32')
+        with rasterio.open(file, 'w', driver='GTiff', height=512, width=512, count=1, dtype='float32', crs=self.crs,
+                           transform=self.transform, tiled=True, blockxsize=128, blockysize=128) as dst:
+            dst.write(data, 1)
+        return file, data
+
+    def test_sample_blocks(self):
+        file, data = self.create_raster()
+        rows, cols = np.array([3, 5, 100, 511]), np.array([7, 130, 20, 511])
+
+        with rasterio.open(file) as src:
+            with mock.patch.object(src, 'read', wraps=src.read) as read:
+                values = PixelIndex().sample(src, rows, cols)
+                # One window by block with pixels
+                self.assertEqual(read.call_count, 3)
+                self.assertTrue(all('window' in c.kwargs for c in read.call_args_list))
+        np.testing.assert_array_equal(values, data[rows, cols])
+
+    def test_sample_dense(self):
+        file, data = self.create_raster()
+        rows, cols = np.repeat(np.arange(0, 512, 100), 6), np.tile(np.arange(0, 512, 100), 6)
+
+        with rasterio.open(file) as src:
+            with mock.patch.object(src, 'read', wraps=src.read) as read:
+                values = PixelIndex().sample(src, rows, cols)
+                # Pixels in most blocks are read with the full band
+                read.assert_called_once_with(1)
+        np.testing.assert_array_equal(values, data[rows, cols])
+
+    def test_sample_outside(self):
+        file, data = self.create_raster()
+        rows, cols = np.array([3, -1, 100, 512]), np.array([7, 5, -2, 0])
+
+        # The pixels out of the raster have no data
+        with rasterio.open(file) as src:
+            values = PixelIndex().sample(src, rows, cols)
+        self.assertEqual(values[0], data[3, 7])
+        self.assertTrue(np.isnan(values[1:]).all())
+
+    def test_signature(self):
+        index = PixelIndex()
+        other = rasterio.transform.from_origin(-73.0, 7.0, 0.25, 0.25)
+        self.assertEqual(index.signature(self.transform, self.shape, self.crs), index.signature(self.transform, self.shape, self.crs))
+        self.assertNotEqual(index.signature(self.transform, self.shape, self.crs), index.signature(other, self.shape, self.crs))
+
+if __name__ == "__main__":
+    unittest.main()
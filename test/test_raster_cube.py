@@ -0,0 +1,87 @@
+import sys
+import os
+import shutil
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+import numpy as np
+import rasterio
+from src.raster_cube import RasterCube
+
+class TestRasterCube(unittest.TestCase):
+
+    def setUp(self):
+        self.path_env = os.path.abspath(os.path.join(os.path.dirname(__file__), 'test_files_cube'))
+        self.path_rasters = os.path.join(self.path_env, 'rasters')
+        os.makedirs(self.path_rasters, exist_ok=True)
+        self.transform = rasterio.transform.from_origin(30.0, 15.0, 0.1, 0.1)
+        self.files = [os.path.join(self.path_rasters, 'day' + str(d) + '.tif') for d in range(1, 4)]
+        self.data = [self.write_raster(f, d) for d, f in enumerate(self.files, start=1)]
+        self.cube = RasterCube(os.path.join(self.path_env, 'cube'), workers=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path_env)
+
+    def write_raster(self, file, day):
+        data = (np.arange(100 * 120).reshape(100, 120) + day * 100000).astype('float32')
+        with rasterio.open(file, 'w', driver='GTiff', height=100, width=120, count=1, dtype='float32',
+                           crs='EPSG:4326', transform=self.transform) as dst:
+            dst.write(data, 1)
+        return data
+
+    def test_read_cropped(self):
+        cube, transform, crs = self.cube.read(self.path_rasters, self.files, [32.0, 10.0, 33.0, 12.0])
+
+        # Days x rows x cols of the extent
+        self.assertEqual(cube.shape, (3, 20, 10))
+        self.assertEqual(transform.c, 32.0)
+        self.assertEqual(transform.f, 12.0)
+        self.assertEqual(crs.to_epsg(), 4326)
+        for i in range(3):
+            np.testing.assert_array_equal(cube[i], self.data[i][30:50, 20:30])
+
+    def test_read_buffer(self):
+        cube, transform, crs = self.cube.read(self.path_rasters, self.files, [32.0, 10.0, 33.0, 12.0], buffer=0.5)
+        self.assertEqual(cube.shape, (3, 30, 20))
+
+        # An extent inside the buffer uses the same cube and an extent out of it makes it grow
+        self.assertIsNotNone(self.cube.lookup(self.path_rasters, self.files, [31.6, 9.6, 33.4, 12.4]))
+        self.assertIsNone(self.cube.lookup(self.path_rasters, self.files, [34.0, 10.0, 34.5, 12.0]))
+        cube, transform, crs = self.cube.read(self.path_rasters, self.files, [34.0, 10.0, 34.5, 12.0])
+        self.assertEqual(transform.c, 31.5)
+        self.assertEqual(cube.shape[2], 30)
+
+    def test_read_changed_rasters(self):
+        self.cube.read(self.path_rasters, self.files, [32.0, 10.0, 33.0, 12.0])
+        time.sleep(0.01)
+        self.data[1] = self.write_raster(self.files[1], 7)
+
+        self.assertIsNone(self.cube.lookup(self.path_rasters, self.files, [32.0, 10.0, 33.0, 12.0]))
+        cube, transform, crs = self.cube.read(self.path_rasters, self.files, [32.0, 10.0, 33.0, 12.0])
+        np.testing.assert_array_equal(cube[1], self.data[1][30:50, 20:30])
+
+    def test_build_versioned_data(self):
+        self.cube.read(self.path_rasters, self.files, [32.0, 10.0, 33.0, 12.0])
+        old_meta = self.cube.lookup(self.path_rasters, self.files, [32.0, 10.0, 33.0, 12.0])
+        self.cube.read(self.path_rasters, self.files, [34.0, 10.0, 34.5, 12.0])
+        new_meta = self.cube.lookup(self.path_rasters, self.files, [34.0, 10.0, 34.5, 12.0])
+
+        # The metadata points to its own binary file and the previous version is removed after it is published
+        self.assertNotEqual(old_meta['data'], new_meta['data'])
+        self.assertEqual(sorted(os.listdir(self.cube.path)), sorted([new_meta['data'], os.path.basename(self.cube.entry(self.path_rasters)[1])]))
+
+    def test_build_different_grid(self):
+        # A raster with other grid can not be cropped with the window of the first one
+        data = np.zeros((50, 60), dtype='float32')
+        with rasterio.open(self.files[2], 'w', driver='GTiff', height=50, width=60, count=1, dtype='float32',
+                           crs='EPSG:4326', transform=rasterio.transform.from_origin(30.0, 15.0, 0.2, 0.2)) as dst:
+            dst.write(data, 1)
+
+        with self.assertRaises(ValueError):
+            self.cube.read(self.path_rasters, self.files, [32.0, 10.0, 33.0, 12.0])
+        self.assertEqual(os.listdir(self.cube.path), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+import numpy as np
+from src.sampling import ScenarioSampler
+
+class TestScenarioSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = ScenarioSampler(n_scenarios=1000, seed=123)
+        # Two seasons and ten years of total precipitation, the last year is missing in the second season
+        self.totals = np.array([[10, 20, 30, 40, 50, 60, 70, 80, 90, 100],
+                                [5, 1, 9, 3, 7, 2, 8, 4, 6, np.nan]], dtype=float)
+
+    def test_tercile_conditions(self):
+        conditions = self.sampler.tercile_conditions(self.totals)
+
+        self.assertEqual(conditions.shape, self.totals.shape)
+        self.assertEqual(list(conditions[0]), [0, 0, 0, 1, 1, 1, 2, 2, 2, 2])
+        # Years without data are excluded
+        self.assertEqual(conditions[1, -1], -1)
+
+    def test_sample_shapes(self):
+        conditions = self.sampler.tercile_conditions(self.totals)
+        categories, years = self.sampler.sample([[0.2, 0.3, 0.5], [0.4, 0.4, 0.2]], conditions)
+
+        self.assertEqual(categories.shape, (2, 1000))
+        self.assertEqual(years.shape, (2, 1000))
+
+    def test_sample_years_match_categories(self):
+        conditions = self.sampler.tercile_conditions(self.totals)
+        categories, years = self.sampler.sample([[0.2, 0.3, 0.5], [0.4, 0.4, 0.2]], conditions)
+
+        # Every year drawn belongs to the category drawn for the scenario
+        for s in range(2):
+            np.testing.assert_array_equal(conditions[s, years[s]], categories[s])
+        self.assertFalse((years[1] == 9).any())
+
+    def test_sample_follows_probabilities(self):
+        conditions = self.sampler.tercile_conditions(self.totals)
+        categories, years = self.sampler.sample([[0.0, 0.0, 1.0], [1.0, 0.0, 0.0]], conditions)
+
+        self.assertTrue((categories[0] == 2).all())
+        self.assertTrue((categories[1] == 0).all())
+
+    def test_sample_empty_category(self):
+        # The normal category does not have years so its probability is given to the other categories
+        conditions = np.array([[0, 0, 2, 2]], dtype=np.int8)
+        categories, years = self.sampler.sample([[0.2, 0.6, 0.2]], conditions)
+
+        self.assertFalse((categories == 1).any())
+
+    def test_empty_categories(self):
+        conditions = np.array([[0, 0, 2, 2], [-1, -1, -1, -1]], dtype=np.int8)
+        empty = self.sampler.empty_categories([[0.2, 0.6, 0.2], [0.0, 0.5, 0.5]], conditions)
+
+        np.testing.assert_array_equal(empty, [[False, True, False], [False, True, True]])
+
+    def test_sample_reproducible(self):
+        conditions = self.sampler.tercile_conditions(self.totals)
+        _, years_a = ScenarioSampler(seed=1).sample([[0.3, 0.3, 0.4]] * 2, conditions)
+        _, years_b = ScenarioSampler(seed=1).sample([[0.3, 0.3, 0.4]] * 2, conditions)
+
+        np.testing.assert_array_equal(years_a, years_b)
+
+if __name__ == "__main__":
+    unittest.main()
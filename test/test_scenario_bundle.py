@@ -0,0 +1,71 @@
+import sys
+import os
+import shutil
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+import numpy as np
+import pandas as pd
+from src.scenario_bundle import ScenarioBundle
+
+class TestScenarioBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.path_env = os.path.abspath(os.path.join(os.path.dirname(__file__), 'test_files_bundle'))
+        os.makedirs(self.path_env, exist_ok=True)
+        self.bundle_file = os.path.join(self.path_env, 'escenarios.nc')
+
+        # Ten escenaries of July and August 2023
+        dates = pd.date_range("2023-07-01", "2023-08-31", freq="D")
+        self.variables = ['t_max', 't_min', 'prec', 'sol_rad']
+        self.values = np.random.default_rng(1).random((10, len(dates), len(self.variables))).astype(np.float32)
+        self.bundle = ScenarioBundle(self.values, dates.day, dates.month, dates.year, self.variables, 'station')
+
+    def tearDown(self):
+        shutil.rmtree(self.path_env)
+
+    def test_write_read(self):
+        self.bundle.write(self.bundle_file)
+        bundle = ScenarioBundle.read(self.bundle_file)
+
+        np.testing.assert_array_equal(bundle.values, self.values)
+        np.testing.assert_array_equal(bundle.months, self.bundle.months)
+        self.assertEqual(bundle.variables, self.variables)
+        self.assertEqual(bundle.station, 'station')
+
+    def test_read_scenarios(self):
+        self.bundle.write(self.bundle_file)
+        bundle = ScenarioBundle.read(self.bundle_file, scenarios=[3, 7])
+
+        np.testing.assert_array_equal(bundle.values, self.values[[3, 7]])
+        np.testing.assert_array_equal(bundle.ids, [3, 7])
+
+        # The escenary files keep the ids asked
+        bundle.to_csv(self.path_env)
+        escenario = pd.read_csv(os.path.join(self.path_env, 'escenario_7.csv'))
+        np.testing.assert_allclose(escenario['prec'].values, self.values[7, :, 2], rtol=1e-6)
+        self.assertFalse(os.path.exists(os.path.join(self.path_env, 'escenario_0.csv')))
+
+    def test_to_csv(self):
+        self.bundle.write(self.bundle_file)
+        ScenarioBundle.read(self.bundle_file).to_csv(self.path_env)
+
+        # Legacy layout, a file by escenary
+        escenario = pd.read_csv(os.path.join(self.path_env, 'escenario_9.csv'))
+        self.assertEqual(list(escenario.columns), ['day', 'month', 'year'] + self.variables)
+        self.assertEqual(escenario.shape[0], 62)
+        np.testing.assert_allclose(escenario['prec'].values, self.values[9, :, 2], rtol=1e-6)
+
+    def test_replace_month(self):
+        june = pd.DataFrame({'day': range(1, 31), 'month': 6, 'year': 2023, 'prec': 1.0, 't_max': 30.0})
+        self.bundle.replace_month(2023, 7, june)
+
+        # July is replaced by June at the beginning of all escenaries
+        self.assertEqual(self.bundle.values.shape, (10, 30 + 31, 4))
+        self.assertEqual(list(np.unique(self.bundle.months)), [6, 8])
+        self.assertTrue((self.bundle.values[:, :30, 2] == 1.0).all())
+        self.assertTrue(np.isnan(self.bundle.values[:, :30, 1]).all())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import sys
+import os
+import shutil
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from unittest import mock
+import pandas as pd
+from src.station_cache import StationCache
+
+class TestStationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path_env = os.path.abspath(os.path.join(os.path.dirname(__file__), 'test_files_cache'))
+        self.path_cache = os.path.join(self.path_env, 'cache')
+        self.station_file = os.path.join(self.path_env, 'station.csv')
+        os.makedirs(self.path_env, exist_ok=True)
+
+        self.data = pd.DataFrame({'day': [1, 2, 3], 'month': [1, 1, 1], 'year': [1981, 1981, 1981],
+                                  't_max': [25.49, 27.34, 26.1], 't_min': [12.04, 12.17, 11.9],
+                                  'prec': [0.0, 1.5, 0.0], 'sol_rad': [19.97, 20.59, 20.1]})
+        self.data.to_csv(self.station_file, index=False)
+        self.cache = StationCache(self.path_cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.path_env)
+
+    def test_read_same_data(self):
+        df = self.cache.read(self.station_file)
+        pd.testing.assert_frame_equal(df, pd.read_csv(self.station_file))
+
+    def test_read_columns(self):
+        df = self.cache.read(self.station_file, columns=['t_max', 'sol_rad'])
+        self.assertEqual(list(df.columns), ['t_max', 'sol_rad'])
+        self.assertEqual(list(df['t_max']), [25.49, 27.34, 26.1])
+
+    def test_read_text_columns(self):
+        # Daily data with the id of the station and the date as text
+        self.data.insert(0, 'ws', ['a', 'a', None])
+        self.data['date'] = ['1981-01-01', '1981-01-02', '1981-01-03']
+        self.data.to_csv(self.station_file, index=False)
+
+        self.cache.read(self.station_file)
+        with mock.patch('src.station_cache.pd.read_csv') as read_csv:
+            df = self.cache.read(self.station_file)
+            read_csv.assert_not_called()
+        pd.testing.assert_frame_equal(df, pd.read_csv(self.station_file))
+        self.assertEqual(list(self.cache.read(self.station_file, columns=['date', 'prec']).columns), ['date', 'prec'])
+
+        # The evict keeps the file of the text columns of valid entries
+        self.assertEqual(self.cache.evict(age=0), 0)
+        self.assertEqual(len(os.listdir(self.path_cache)), 3)
+
+    def test_read_uses_cache(self):
+        self.cache.read(self.station_file)
+        # The second time the csv file should not be parsed
+        with mock.patch('src.station_cache.pd.read_csv') as read_csv:
+            self.cache.read(self.station_file)
+            read_csv.assert_not_called()
+
+    def test_read_changed_source(self):
+        self.cache.read(self.station_file)
+        time.sleep(0.01)
+        self.data['prec'] = [5.0, 5.0, 5.0]
+        self.data.to_csv(self.station_file, index=False)
+
+        df = self.cache.read(self.station_file)
+        self.assertEqual(list(df['prec']), [5.0, 5.0, 5.0])
+
+    def test_evict(self):
+        self.cache.read(self.station_file)
+        self.assertEqual(self.cache.evict(), 0)
+        self.assertEqual(len(os.listdir(self.path_cache)), 2)
+
+        # The entries of removed stations are stale
+        os.remove(self.station_file)
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertEqual(len(os.listdir(self.path_cache)), 0)
+
+    def test_evict_entries_being_written(self):
+        self.cache.read(self.station_file)
+        # A binary file of an entry still being written is kept, an old one without metadata is removed
+        writing = os.path.join(self.path_cache, 'other_0.npy')
+        leftover = os.path.join(self.path_cache, 'other_1.npy')
+        for f in [writing, leftover]:
+            open(f, 'w').close()
+        os.utime(leftover, (time.time() - 7200, time.time() - 7200))
+
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertTrue(os.path.exists(writing))
+        self.assertFalse(os.path.exists(leftover))
+        self.assertEqual(list(self.cache.read(self.station_file)['prec']), [0.0, 1.5, 0.0])
+
+    def test_build_new_version(self):
+        meta = self.cache.build(self.station_file)
+        # Every build publishes its own binary file and removes the previous one
+        new_meta = self.cache.build(self.station_file)
+        self.assertNotEqual(meta['data'], new_meta['data'])
+        self.assertEqual(sorted(os.listdir(self.path_cache)), sorted([new_meta['data'], os.path.basename(self.cache.entry(self.station_file)[1])]))
+
+        # A reader whose binary file was removed by other process reads the entry again
+        lookup = self.cache.lookup
+        with mock.patch.object(self.cache, 'lookup', side_effect=[meta, lookup(self.station_file)]):
+            df = self.cache.read(self.station_file)
+        pd.testing.assert_frame_equal(df, pd.read_csv(self.station_file))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+import numpy as np
+import pandas as pd
+from src.station_history import StationHistory, FEB_29
+
+class TestStationHistory(unittest.TestCase):
+
+    def setUp(self):
+        # Three years of daily data, 2020 is a leap year. The precipitation is the year so the totals are easy to check
+        dates = pd.date_range("2019-01-01", "2021-12-31", freq="D")
+        self.df = pd.DataFrame({'day': dates.day, 'month': dates.month, 'year': dates.year,
+                                't_max': dates.dayofyear.astype(float), 't_min': 1.0,
+                                'prec': dates.year.astype(float), 'sol_rad': 20.0})
+        self.history = StationHistory.from_dataframe(self.df)
+
+    def test_cube_shape(self):
+        self.assertEqual(self.history.data.shape, (3, 366, 4))
+        self.assertEqual(self.history.data.dtype, np.float32)
+        self.assertEqual(list(self.history.years), [2019, 2020, 2021])
+        self.assertEqual(list(self.history.leap), [False, True, False])
+
+    def test_february_29(self):
+        # Years which are not leap repeat February 28
+        t_max = self.history.variables.index('t_max')
+        self.assertEqual(self.history.data[0, FEB_29, t_max], 59)
+        self.assertEqual(self.history.data[1, FEB_29, t_max], 60)
+
+    def test_season_slice(self):
+        season = self.history.season(6, 8, leap=False)
+
+        self.assertEqual(season.shape, (3, 92, 4))
+        # Seasons of one year are a view of the cube
+        self.assertTrue(np.shares_memory(season, self.history.data))
+
+    def test_season_days_leap(self):
+        slots, offsets = self.history.season_days(1, 3, leap=True)
+        self.assertEqual(len(slots), 91)
+        slots, offsets = self.history.season_days(1, 3, leap=False)
+        self.assertEqual(len(slots), 90)
+        self.assertFalse(offsets.any())
+
+    def test_season_totals_next_year(self):
+        totals = self.history.season_totals(12, 2, leap=False)
+
+        # December of the analog year and January-February of the next one
+        self.assertEqual(totals[0], 31 * 2019 + 59 * 2020)
+        # The last year does not have the next year
+        self.assertTrue(np.isnan(totals[2]))
+
+    def test_season_totals_missing_days(self):
+        # A missing day is skipped, a year without data in the season is not available
+        df = self.df[~((self.df['year'] == 2019) & (self.df['month'] == 6) & (self.df['day'] == 10))]
+        df = df[~((df['year'] == 2020) & df['month'].isin([6, 7, 8]))]
+        totals = StationHistory.from_dataframe(df).season_totals(6, 8, leap=False)
+
+        self.assertEqual(totals[0], 91 * 2019)
+        self.assertTrue(np.isnan(totals[1]))
+        self.assertEqual(totals[2], 92 * 2021)
+
+    def test_materialize(self):
+        values, months, days, years = self.history.materialize(np.array([0, 1]), 12, 2, leap=True)
+
+        self.assertEqual(values.shape, (2, 91, 4))
+        self.assertEqual(list(months[:2]), [12, 12])
+        self.assertEqual(days[-1], 29)
+        self.assertEqual(list(years[0, [0, -1]]), [2019, 2020])
+        self.assertEqual(list(years[1, [0, -1]]), [2020, 2021])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+import tracemalloc
+import numpy as np
+from src.summary import ScenarioSummary
+
+class TestScenarioSummary(unittest.TestCase):
+
+    def setUp(self):
+        # 500 escenaries of 30 days and 2 variables, precipitation with many dry days
+        rng = np.random.default_rng(42)
+        self.values = rng.gamma(0.5, 6.0, size=(500, 30, 2))
+        self.values[self.values < 2] = 0
+
+    def test_exact_statistics(self):
+        result = ScenarioSummary.from_values(self.values, chunk=64).result()
+
+        self.assertTrue(np.allclose(result['min'], self.values.min(axis=0)))
+        self.assertTrue(np.allclose(result['max'], self.values.max(axis=0)))
+        self.assertTrue(np.allclose(result['mean'], self.values.mean(axis=0)))
+        self.assertTrue(np.allclose(result['variance'], self.values.var(axis=0, ddof=1)))
+
+    def test_percentiles(self):
+        result = ScenarioSummary.from_values(self.values, chunk=64).result()
+
+        # The percentiles are the same of numpy, also the median of the dry days
+        for p in [10, 50, 90]:
+            self.assertTrue(np.allclose(result['p' + str(p)], np.percentile(self.values, p, axis=0), rtol=0, atol=1e-12))
+
+    def test_update_one_escenary(self):
+        summary = ScenarioSummary(30, 2)
+        for escenary in self.values[:100]:
+            summary.update(escenary)
+        result = summary.result()
+
+        self.assertTrue(np.allclose(result['variance'], self.values[:100].var(axis=0, ddof=1)))
+        self.assertTrue(np.allclose(result['p10'], np.percentile(self.values[:100], 10, axis=0)))
+
+    def test_weights(self):
+        # Escenaries grouped by analog year have the statistics of the escenaries repeated
+        rows = self.values[:20]
+        weights = np.random.default_rng(1).integers(1, 30, size=20)
+        repeated = np.repeat(rows, weights, axis=0)
+        result = ScenarioSummary.from_values(rows, weights, chunk=7).result()
+        expected = ScenarioSummary.from_values(repeated).result()
+        for k in expected:
+            self.assertTrue(np.allclose(result[k], expected[k]), k)
+        self.assertTrue(np.allclose(result['p90'], np.percentile(repeated, 90, axis=0)))
+
+    def test_sketch_size(self):
+        # Over the size of the sketch the percentiles are close to the exact ones
+        values = np.random.default_rng(3).normal(size=(3000, 5, 2))
+        summary = ScenarioSummary.from_values(values, size=256)
+        self.assertLessEqual(summary.points.shape[0], 256)
+        for p in [10, 50, 90]:
+            self.assertLess(np.abs(summary.result()['p' + str(p)] - np.percentile(values, p, axis=0)).max(), 0.05)
+        self.assertTrue(np.allclose(summary.result()['mean'], values.mean(axis=0)))
+
+    def test_bounded_memory(self):
+        # The peak of memory of the summary does not depend on the number of escenaries added
+        def peak(n_scenarios):
+            rng = np.random.default_rng(5)
+            summary = ScenarioSummary(90, 4, size=128)
+            tracemalloc.start()
+            for _ in range(n_scenarios // 100):
+                summary.update(rng.normal(size=(100, 90, 4)))
+            result = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return result
+
+        small, large = peak(1000), peak(10000)
+        self.assertLess(large, 1.2 * small)
+
+    def test_missing_values(self):
+        values = self.values.copy()
+        values[::2, 0, 0] = np.nan
+        result = ScenarioSummary.from_values(values).result()
+
+        # NaN values are skipped and a day without values has NaN statistics
+        self.assertTrue(np.isclose(result['mean'][0, 0], np.nanmean(values[:, 0, 0])))
+        self.assertTrue(np.isclose(result['p50'][0, 0], np.nanmedian(values[:, 0, 0])))
+        empty = ScenarioSummary.from_values(np.array([[[np.nan]]]))
+        self.assertTrue(all(np.isnan(v[0, 0]) for v in empty.result().values()))
+
+    def test_concat(self):
+        summary = ScenarioSummary.concat([ScenarioSummary.from_values(self.values[:, :10]), ScenarioSummary.from_values(self.values[:50, 10:])])
+        expected = np.concatenate([np.percentile(self.values[:, :10], 50, axis=0), np.percentile(self.values[:50, 10:], 50, axis=0)])
+        self.assertTrue(np.allclose(summary.result()['p50'], expected))
+
+if __name__ == "__main__":
+    unittest.main()